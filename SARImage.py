@@ -10,6 +10,10 @@
 #   python SARIMage.py dislocOutput imageURL
 #   python SARImage.py dislocOutput elevation(degree) azimuth(degree) radarFrequency(in GHz) imageURL
 #
+# dislocOutput: disloc text table, or a binary table (.npy) whose first row
+#   is nx ny lat lon x0 dx y0 dy, opened memory-mapped; tables of the los
+#   product have x y los columns, los is used without projecting again
+#
 # output:
 #   [dislocOutput].png
 #   [dislocOutput].kml
@@ -24,23 +28,25 @@
 #   2011/05/10: temporary fix for QuakeSim logo on small image
 #=====================================================
 
-import csv, math, sys, os, math, string, zipfile
+import csv, math, sys, os, math, string, zipfile, io, threading
 
 try:
     import numpy as np
-    import matplotlib.cm as cm
-    import matplotlib.mlab as mlab
-    import matplotlib.pyplot as plt
-    #from matplotlib.backends.backend_agg import FigureCanvasAgg
-    import matplotlib.image as mpimg
 except ImportError:
-    sys.exit("Import matplotlib failed ")
+    sys.exit("Import numpy failed ")
+
+import dislocengine
+import dislocpalette
+import dislocpng
+import dislockmz
+import dislocmetrics
+from dislocpalette import color_wheel
 
 
 def dxy2lonlat(xy, ref):
     """
         convert dx, dy to lon, lat
-        parameters: dx, dy, reflonlat
+        parameters: dx, dy (numbers or arrays), reflonlat
     """
 
     flattening = 1.0/298.247
@@ -56,9 +62,17 @@ def dxy2lonlat(xy, ref):
     lat2 = xy[1]/yfactor + lat1
     return [lon2,lat2]
 
-def generateKML(extent, outputname, imageurl, params):
+def generateKML(extent, outputname, imageurl, params, pngdata=None, artifacts=None, store=None):
     """
        generate KML
+       outputname: absolute path of the overlay without suffix, the
+                   files go next to it, the KML refers to the PNG by name
+       pngdata: encoded image; when not given the image is the file
+                [outputname].png, the KMZ copies it from there and it is
+                removed afterwards unless png is one of the artifacts
+       artifacts: png, kml and kmz files to write, default: all three
+       store: dict that receives the bytes of every artifact by file name
+              (without the directory)
     """
     kml = """<?xml version="1.0" encoding="UTF-8"?>
 <kml xmlns="http://earth.google.com/kml/2.2">
@@ -96,9 +110,10 @@ def generateKML(extent, outputname, imageurl, params):
     east = str(extent[1])
     south = str(extent[2])
     north = str(extent[3])
-    href = imageurl + "/" + outputname + ".png"
+    name = os.path.basename(outputname)
+    href = imageurl + "/" + name + ".png"
     if imageurl == "":
-        href = outputname + ".png"
+        href = name + ".png"
 
     dislocname = os.path.basename(str(params[0]))
     description = "<![CDATA[%s]]>"
@@ -110,82 +125,103 @@ def generateKML(extent, outputname, imageurl, params):
     #print kml % (north,south,east,west)
     description = description % (desc)
     kml = kml % (description, href, north,south,east,west)
-    kmlf = open(outputname + ".kml",'w')
-    kmlf.write(kml)
-    kmlf.close()
-
-    # generate kmz
-    kmz = outputname + ".kmz"
-    legendfile = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "2pi.png"
-
-    with zipfile.ZipFile(kmz,'w',zipfile.ZIP_DEFLATED) as myzip:
-        myzip.write(outputname + ".kml")
-        myzip.write(href)
-        myzip.write(legendfile,"2pi.png")
-    myzip.close
+
+    artifacts = dislockmz.parseartifacts(artifacts)
+    if pngdata is None:
+        # image streamed to disk, kmz copies it without loading it
+        pngfile = outputname + ".png"
+        if 'kml' in artifacts:
+            dislockmz.writeatomic(outputname + ".kml", kml.encode())
+        if 'kmz' in artifacts or store is not None:
+            dislockmz.writekmz(outputname + ".kmz", name + ".kml", kml, name + ".png", pngfile)
+        if store is not None:
+            for suffix in [".png", ".kmz"]:
+                with open(outputname + suffix, "rb") as f:
+                    store[name + suffix] = f.read()
+            store[name + ".kml"] = kml.encode()
+            if 'kmz' not in artifacts:
+                os.remove(outputname + ".kmz")
+        if 'png' not in artifacts:
+            os.remove(pngfile)
+        return
+
+    # generate kmz in memory, the png is stored as it is
+    files = {outputname + ".png": pngdata, outputname + ".kml": kml.encode()}
+    if 'kmz' in artifacts or store is not None:
+        files[outputname + ".kmz"] = dislockmz.kmzbytes(name + ".kml", kml, name + ".png", pngdata)
+
+    for kind in artifacts:
+        dislockmz.writeatomic(outputname + "." + kind, files[outputname + "." + kind])
+    if store is not None:
+        store.update((os.path.basename(path), data) for path, data in files.items())
     
 
-def color_wheel(fcw):
-    """ make goldstein color wheel """
-
-    #fcw=1 flips order of colors
-    wheel = [[None]*16 for i in range(3)]
-    for i in range(16):
-        if i==0:
-            ib=255
-            ir=ib
-            ig=ib
-        elif i>=1 and i<=5:
-            ib = 255
-            ir = (i-1)*51
-            ig = 255 - 51*(i-1)
-        elif i>=6 and i<=10:
-            ir = 255
-            ig = (i-6)*51
-            ib = 255 - (i-6)*51
-        elif i>=11 and i<=15:
-            ig = 255
-            ib = (i-11)*51
-            ir = 255 -(i-11)*51
-        else:
-            print("something wrong!")
-        wheel[0][i]=math.floor(ir/255.0*225)+30
-        wheel[1][i]=math.floor(ig/255.0*225)+30
-        wheel[2][i]=math.floor(ib/255.0*225)+30
-
-    if fcw == 1:
-        #flip the color wheel
-        for i in range(3):
-            junk = wheel[i][1:]
-            junk.reverse()
-            wheel[i][1:]=junk
-
-    colormatrx = []
-    for j in range(256):
-        mag = math.floor(j/16)
-        i = j % 16
-        red = math.floor(mag/16.0*wheel[0][i]*16/15)
-        green = math.floor(mag/16.0*wheel[1][i]*16/15)
-        blue = math.floor(mag/16.0*wheel[2][i]*16/15)
-        colormatrx.append([red/255.0,green/255.0,blue/255.0])
-
-    return colormatrx
-
-def drawimage(datatable,lonlatgrid, outputname, imageurl, params,colortable=True):
+# matplotlib is only imported by the matplotlib renderer
+plt = None
+# pyplot keeps one current figure per process
+_figurelock = threading.Lock()
+
+def pyplot():
+    """ matplotlib.pyplot, imported on first use """
+    global plt
+    if plt is None:
+        try:
+            import matplotlib.pyplot
+        except ImportError:
+            raise ImportError("Import matplotlib failed, use the bilinear or nearest renderer")
+        plt = matplotlib.pyplot
+    return plt
+
+def drawfigure(newimg, lonlatgrid):
+    """
+       render the image through a matplotlib figure
+       returns the png bytes
+    """
+    plt = pyplot()
+    with _figurelock:
+        # figsize
+        fig = plt.figure(figsize=(lonlatgrid[0]/12.0,lonlatgrid[1]/12.0))
+        fig.subplots_adjust(left=0.0,bottom=0.0,top=1.0,right=1.0)
+        fig.patch.set_alpha(0.85)
+        im = plt.imshow(newimg,interpolation="bilinear",origin='lower',alpha=0.9)
+        plt.axis("off")
+
+        # add QuakeSim logo
+        #if (lonlatgrid[1] < 100) or (lonlatgrid[0] < 100):
+        #    logo = mpimg.imread('QuakeSimLogoGrayEmbossSmall.png')
+        #    fig.figimage(logo, xo=fig.bbox.xmax, yo=2,zorder=1)
+        #else:
+        #    logo = mpimg.imread('QuakeSimLogoGrayEmboss.png')
+        #    fig.figimage(logo, xo=fig.bbox.xmax, yo=2,zorder=1)
+
+
+        buffer = io.BytesIO()
+        plt.savefig(buffer, format="PNG",transparent=True,dpi=(96))
+
+        # close fig to release memory
+        plt.close(fig)
+    return buffer.getvalue()
+
+def drawimage(datatable,lonlatgrid, outputname, imageurl, params,colortable=True,palette=None,renderer="bilinear",scale=dislocpng.SCALE,artifacts=None,store=None):
     """
        produece image
+       outputname: absolute path of the image without suffix
+       palette: name in dislocpalette, default: uavsar, wheel when
+                colortable is False
+       renderer: bilinear or nearest (dislocpng.py, scale pixels per
+                 point) or matplotlib (figure saved at 96 dpi)
+       artifacts, store: files to write and dict of in-memory files,
+                 see generateKML
     """
-    data=[]
-    lat_xy = []
-    lon_xy = []
-    for row in datatable:
-        lon_xy.append(row[0])
-        lat_xy.append(row[1])
-        data.append(row[2])
+    # lon, lat, fringe columns, list of rows or (n, 3) array
+    datatable = np.asarray(datatable)
+    lon_xy = datatable[:,0]
+    lat_xy = datatable[:,1]
+    data = datatable[:,2]
 
     # get the right extent box
-    xy0= [min(lon_xy),min(lat_xy)]
-    xy1= [max(lon_xy),max(lat_xy)]
+    xy0= [float(np.min(lon_xy)),float(np.min(lat_xy))]
+    xy1= [float(np.max(lon_xy)),float(np.max(lat_xy))]
     #print(xy0)
     #print(xy1)
 
@@ -207,139 +243,134 @@ def drawimage(datatable,lonlatgrid, outputname, imageurl, params,colortable=True
     z = np.array(data)
     # drawing with negative fringe
     z = -1 *z
-    minz, maxz = min(z), max(z)
-
-    # disloc discrete color wheel
-    if not colortable:
-        #scale it to [1~15]
-        z = np.fix((z-minz)/(maxz-minz)*14+ 0.001) + 1
-        z = z.astype("int")
-        #handle nan number nan is colored by colm[0]
-        nan = np.where(z<0)
-        z[nan]=0
-        colormatrx = color_wheel(0)
-        # the brightness of colorwheel
-        p=14
-        colm = np.array(colormatrx[(p - 1)*16:p*16])
-        newimg = colm[z]
-
-    # uavsar color table
-    if colortable:
-        #load color table
-
-        colortable_csv = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "colortable.csv"
-        with open(colortable_csv,"r") as csvfile:
-            rawtable = csv.reader(csvfile)
-            colortable=[]
-            numinx=[]
-            for row in rawtable:
-                rowfloat=list(map(float,row))
-                colortable.append(rowfloat[1:4])
-                numinx.append(int(rowfloat[0]))
-        csvfile.close
-        z = np.fix((z-minz)/(maxz-minz)*200) - 100
-        #print min(z),max(z)
-
-        newimg = []
-        for item in z:
-            inx=int((item))
-            # tweak for 175
-            #if inx > 70:
-            #    inx = -inx
-            #if inx < - 74:
-            #    inx = inx - 2* (inx + 87)
-            pos=numinx.index(inx)
-            newimg.append(colortable[pos])
-
-        newimg = np.array(newimg)
+
+    if palette is None:
+        # uavsar color table or disloc discrete color wheel
+        palette = "uavsar" if colortable else "wheel"
+    with dislocmetrics.stage("colorize"):
+        newimg = dislocpalette.colorize(z, palette)
 
     # reshape array as image
     newimg = newimg.reshape(lonlatgrid[1],lonlatgrid[0],3)
-    # figsize
-    fig = plt.figure(figsize=(lonlatgrid[0]/12.0,lonlatgrid[1]/12.0))
-    fig.subplots_adjust(left=0.0,bottom=0.0,top=1.0,right=1.0)
-    fig.patch.set_alpha(0.85)
-    im = plt.imshow(newimg,interpolation="bilinear",origin='lower',alpha=0.9)
-    plt.axis("off")
-
-    # add QuakeSim logo
-    #if (lonlatgrid[1] < 100) or (lonlatgrid[0] < 100):
-    #    logo = mpimg.imread('QuakeSimLogoGrayEmbossSmall.png')
-    #    fig.figimage(logo, xo=fig.bbox.xmax, yo=2,zorder=1)
-    #else:
-    #    logo = mpimg.imread('QuakeSimLogoGrayEmboss.png')
-    #    fig.figimage(logo, xo=fig.bbox.xmax, yo=2,zorder=1)
-
-
-    plt.savefig(outputname + ".png", format="PNG",transparent=True,dpi=(96))
-
-    generateKML([xy0[0],xy1[0],xy0[1],xy1[1]],outputname, imageurl, params)
+    with dislocmetrics.stage("png"):
+        if renderer == "matplotlib":
+            pngdata = drawfigure(newimg, lonlatgrid)
+        else:
+            pngdata = b"".join(dislocpng.pngchunks(newimg, scale=scale, resample=renderer))
 
-    # close fig to release memory
-    plt.close(fig)
+    with dislocmetrics.stage("kml"):
+        generateKML([xy0[0],xy1[0],xy0[1],xy1[1]],outputname, imageurl, params, pngdata, artifacts, store)
 
     # return extent
     return [xy0[0],xy1[0],xy0[1],xy1[1]]
 
-def lineofsight (ele,azi,radarWL,disO,url):
+def readtable(disO):
+    """
+        read a disloc text table in one pass
+        returns gridsize, reflonlat, the column names and the (npts, ncols)
+        array below the x y ... column header
+    """
+    with open(disO) as f:
+        text = f.read()
+
+    # line 1: 30  30  32.237000  -115.083000
+    first = text.split(None, 4)
+    gridsize = [int(float(first[0])), int(float(first[1]))]
+    reflonlat = [float(first[3]), float(first[2])]
+
+    # locate the position of x y ux uy uz exx exy eyy
+    start = 0
+    for line in text.splitlines(True):
+        start += len(line)
+        if 'x' in line.split():
+            names = line.split()
+            break
+    else:
+        raise ValueError("no column header in %s" % disO)
+
+    data = np.fromstring(text[start:], dtype=np.float64, sep=' ')
+    return gridsize, reflonlat, names, data.reshape(-1, len(names))
+
+def readdisplacement(disO, dislocresult=None):
+    """
+        displacement columns of a disloc output, read once for any number
+        of look geometries
+        dislocresult: result dict from dislocengine, used instead of
+                      reading disclocOutput when given
+        returns dict of gridsize, reflonlat, lon, lat and ux, uy, uz
+        (or los for a table of the los product)
+    """
+    if dislocresult is None and disO.endswith(".npy"):
+        # binary table, columns are read from the memory map
+        header, table = dislocengine.readbinary(disO)
+        if header['products'] == 'strain':
+            raise ValueError("no displacements in %s" % disO)
+        gridsize = [int(header['nx']), int(header['ny'])]
+        reflonlat = [header['lon'], header['lat']]
+        names = ['x','y','los'] if header['products'] == 'los' else ['x','y','ux','uy','uz']
+        columns = [table[:,i].astype(np.float64) for i in range(len(names))]
+    elif dislocresult is None:
+        gridsize, reflonlat, header, table = readtable(disO)
+        if 'los' in header:
+            names = ['x','y','los']
+        elif 'ux' in header:
+            names = ['x','y','ux','uy','uz']
+        else:
+            raise ValueError("no displacements in %s" % disO)
+        columns = [table[:,header.index(k)] for k in names]
+    else:
+        # arrays from the in-process engine, no text round trip
+        gridsize = dislocresult['gridsize']
+        reflonlat = [float(dislocresult['lon']), float(dislocresult['lat'])]
+        names = ['x','y','los'] if 'los' in dislocresult else ['x','y','ux','uy','uz']
+        columns = [np.asarray(dislocresult[k], dtype=np.float64) for k in names]
+
+    # conver x,y to lon,lat
+    lon, lat = dxy2lonlat(columns[:2],reflonlat)
+    displacement = {"gridsize": gridsize, "reflonlat": reflonlat, "lon": lon, "lat": lat}
+    displacement.update(zip(names[2:], columns[2:]))
+    return displacement
+
+def lineofsight (ele,azi,radarWL,disO,url,dislocresult=None,palette=None,renderer="bilinear",scale=dislocpng.SCALE,displacement=None,name="",artifacts=None,store=None):
     """
         caculate line of sight
         parameters:elevation,azimuth,radarWaveLength,disclocOutput
+        dislocresult: result dict from dislocengine, used instead of
+                      reading disclocOutput when given
+        palette, renderer, scale, artifacts, store: image options, see drawimage
+        displacement: readdisplacement() of disclocOutput, shared by
+                      several look geometries
+        name: added to the image name, [disclocOutput].insar[name].png,
+              written next to disclocOutput
     """
     params = [disO, ele, azi,radarWL]
 
-    outputReader = csv.reader(open(disO), delimiter = ' ')
-    rawdata=[]
-    header = 0
-    for row in outputReader:
-        # remove ''
-        line = [i for i in row if i !='']
-        if not ('x' in line):
-            rawdata.append(list(map(float,line)))
-        else:
-            # locate the position of x y ux uy uz exx exy eyy
-            header = len(rawdata)
-
-    del outputReader
-    # 30  30  32.237000  -115.083000
-    gridsize = list(map(int,rawdata[0][:2]))
-    reflonlat = [rawdata[0][3], rawdata[0][2]]
-    data = rawdata[header:]
-
-    #print reflonlat
-    #print len(data)
-    #print gridsize
+    if displacement is None:
+        with dislocmetrics.stage("parse"):
+            displacement = readdisplacement(disO, dislocresult)
 
     # unit vector
     # g = {Sin[Azimuth] Cos[Elevation], Cos[Azimuth] Cos[Elevation], Sin[Elevation]}
     azimuth, elevation = math.radians(azi),math.radians(ele)
     g = [math.sin(azimuth)*math.cos(elevation),math.cos(azimuth)*math.cos(elevation),math.sin(elevation)]
-    #print g
-
-    datatable = []
-    for entry in data:
-        # conver x,y to lon,lat
-        lonlat = dxy2lonlat(entry[:2],reflonlat)
-        ux,uy,uv = entry[2:5] # Disloc displacement values are typically in mm
-        # line of sight displacement
-        losd = (g[0]*ux + g[1]*uy + g[2]*uv)/5.0  # Convert from mm to cm to be consistent with radarWL
+
+    with dislocmetrics.stage("los"):
+        if 'los' in displacement:
+            # los product, already projected on g
+            losd = displacement['los']/5.0
+        else:
+            ux,uy,uv = [displacement[k] for k in ['ux','uy','uz']] # Disloc displacement values are typically in mm
+            # line of sight displacement
+            losd = (g[0]*ux + g[1]*uy + g[2]*uv)/5.0  # Convert from mm to cm to be consistent with radarWL
         # fringe
-        # fringe = abs(math.modf(2*losd / radarWL)[0])
-        #fringe = 2*losd / radarWL - math.floor(2*losd / radarWL)
         # mapping is changed to ~2pi to 2pi to match UAVSAR
         # shall be -12 ~ 12
-        fringe = 2*losd / radarWL - math.floor(2*losd / radarWL)
-        #print fringe
-        datatable.append([lonlat[0],lonlat[1],fringe])
-
-    # output for test
-    #writer = csv.writer(open(disO+"_table", "wb"))
-    #writer.writerows(datatable)
-    #del writer
+        fringe = 2*losd / radarWL - np.floor(2*losd / radarWL)
+        datatable = np.column_stack([displacement['lon'], displacement['lat'], fringe])
 
-    outputname = os.path.basename(disO) + ".insar"
+    outputname = os.path.abspath(disO) + ".insar" + name
 
-    imageextent = drawimage(datatable,gridsize, outputname, url, params,colortable = True)
+    imageextent = drawimage(datatable,displacement['gridsize'], outputname, url, params,colortable = True,palette = palette,renderer = renderer,scale = scale,artifacts = artifacts,store = store)
     
     return imageextent
 
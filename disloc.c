@@ -50,6 +50,7 @@ $
 #include <stdlib.h>
 #include   <math.h>
 #include   <strings.h>
+#include   <string.h>
 
 #define FL "%.16g"
 
@@ -100,12 +101,16 @@ struct sumout
    }*sum;
 
 static int test,j;
+static int nostrain;   /* displacements only, set by disloc_strains() */
 float  sa,ca;
 
+void   npyheader(FILE *fo, int nrows);
+
 //#define SOURCE  "/net/milhouse/usr1/andrea/src/disloc/disloc.c"
 #define SOURCE  "./disloc.c"
 #define FLF  " %8.3f "
 
+#ifndef DISLOC_LIBRARY
 main(argc,argv)
 int   argc;
 char  *argv[];
@@ -114,7 +119,9 @@ char  *argv[];
    float   dumx,dumy,xp,yp;
    float   latorig,lonorig;
    double  pi,sd,cd,mat,xpr,ypr;
+   double  row[8];
    char    ibuff[80],str,opt;
+   int     npyout;
    FILE    *fd,*srcfile,*fo;
 /**********************************************************     
  * if no arguments, and not in a pipeline, self document  *    
@@ -139,9 +146,15 @@ char  *argv[];
 /****************************************************
  *  check if ascii file is wanted and open files    *
  ****************************************************/
+/****************************************************
+ *  an outfile ending in .npy gets the binary table  *
+ ****************************************************/
+   npyout = 0;
+   if ((argv[2] != NULL) && strlen(argv[2]) > 4
+       && !strcmp(argv[2] + strlen(argv[2]) - 4,".npy")) npyout = 1;
    if ((argv[2] != NULL))
      {
-       if ((fo = fopen(argv[2],"w")) == NULL)
+       if ((fo = fopen(argv[2],npyout ? "wb" : "w")) == NULL)
 	 {
 	   fprintf(stderr,"     ERROR:  cannot open %s\n",argv[2]);
 	   exit(1);
@@ -193,7 +206,7 @@ char  *argv[];
                                             sizeof(struct sumout));
       dumx = xp;  dumy = yp;
       }
-   if (!test)
+   if (!test && !npyout)
       {
 	fprintf(fo,"%d  %d  %f  %f\n",data.xnum,data.ynum,
 		latorig,lonorig);
@@ -237,7 +250,7 @@ char  *argv[];
 	 printf("d1 =%5.1f; d2 =%5.1f; d3 =%5.1f; l =%5.1f; w =%5.1f;\n",
 	           data.u1,data.u2,data.u3,data.l,data.w);
          }
-      else if (j == 0)
+      else if (j == 0 && !npyout)
          {
 	   /* fprintf(fo,"% 7.3f % 8.3f %8.3f\n",data.lon,data.lat,
 		   data.strike);
@@ -301,13 +314,43 @@ char  *argv[];
 
       }
    j = 0;
-   fprintf(fo,"  x      y       ux        uy        uz        ");
-   fprintf(fo,"exx       exy       eyy\n");
+   if (npyout)
+      {
+/*********************************************************************
+ *  binary table: header row nx ny lat lon x0 dx y0 dy, then one     *
+ *  row x y ux uy uz exx exy eyy per point                          *
+ *********************************************************************/
+      npyheader(fo,data.xnum*data.ynum + 1);
+      row[0] = data.xnum;  row[1] = data.ynum;
+      row[2] = latorig;    row[3] = lonorig;
+      if (data.genparm)
+         {
+         row[4] = dumx;  row[5] = data.xinc;
+         row[6] = dumy;  row[7] = data.yinc;
+         }
+      else
+         row[4] = row[5] = row[6] = row[7] = nan("");
+      fwrite((char *)row, sizeof(double), 8, fo);
+      }
+   else
+      {
+      fprintf(fo,"  x      y       ux        uy        uz        ");
+      fprintf(fo,"exx       exy       eyy\n");
+      }
    for (k=0; k < data.ynum; ++k)
       for (l=0; l < data.xnum; ++l)
          {
          xpr =  data.x[j]*ca + data.y[j]*sa + data.lon;
          ypr = -data.x[j]*sa + data.y[j]*ca + data.lat;
+         if (npyout)
+            {
+            row[0] = xpr;        row[1] = ypr;
+            row[2] = sum[j].d1;  row[3] = sum[j].d2;  row[4] = sum[j].d3;
+            row[5] = sum[j].str1;  row[6] = sum[j].str2;  row[7] = sum[j].str3;
+            fwrite((char *)row, sizeof(double), 8, fo);
+            ++j;
+            continue;
+            }
 	 fprintf(fo,"  % 6.5f  % 6.5f  % 10.3e  % 10.3e  % 10.3e  ",xpr,ypr,
 		 sum[j].d1,sum[j].d2,sum[j].d3);
 	 fprintf(fo,"% 10.3e  % 10.3e  % 10.3e\n",sum[j].str1,sum[j].str2,
@@ -321,6 +364,30 @@ char  *argv[];
 /*   fwrite((char *)&n, sizeof(n), 1, stdout);*/
    fclose(fo); fclose(fd);
 }
+#endif
+
+/*********************************************************************
+ *  NumPy .npy version 1.0 header for a C-order (nrows, 8) table of  *
+ *  doubles in the byte order of this machine                        *
+ *********************************************************************/
+void npyheader(FILE *fo, int nrows)
+{
+   char    header[128];
+   int     len,one;
+   unsigned char size[2];
+
+   one = 1;
+   len = sprintf(header,
+      "{'descr': '%cf8', 'fortran_order': False, 'shape': (%d, 8), }",
+      *(char *)&one ? '<' : '>',nrows);
+   /* pad with spaces so the data starts on a 64 byte boundary */
+   while ((10 + len + 1) % 64) header[len++] = ' ';
+   header[len++] = '\n';
+   size[0] = len & 0xff;  size[1] = (len >> 8) & 0xff;
+   fwrite("\x93NUMPY\x01\x00",1,8,fo);
+   fwrite((char *)size,1,2,fo);
+   fwrite(header,1,len,fo);
+}
 /*********************************************************************/
 
 point(sd,cd,pi,mat,fo)
@@ -377,6 +444,13 @@ double  sd,cd,pi,mat;
       outp.dis[2] = u031+u032+u033;
       xpr = data.x[j]*ca + data.y[j]*sa;
       ypr = -data.x[j]*sa + data.y[j]*ca;
+      if (nostrain)
+         {
+         sum[j].d1 += outp.dis[0];
+         sum[j].d2 += outp.dis[1];
+         sum[j].d3 += outp.dis[2];
+         return;
+         }
       }
 /*
  *  calculate strains
@@ -471,26 +545,30 @@ double  sd,cd,pi,mat;
    chin(sd,cd,pi,mat,xi,eta,&f);
    for (i=0; i<9; ++i) 
       f.u[i]=f.u[i]+f.up[i];
-   for (i=0; i<18; ++i)
-      f.e[i]=f.e[i]+f.ep[i];
+   if (!nostrain)
+      for (i=0; i<18; ++i)
+         f.e[i]=f.e[i]+f.ep[i];
    xi = data.x[j]; eta = p-data.w;
    chin(sd,cd,pi,mat,xi,eta,&f);
    for (i=0; i<9; ++i) 
       f.u[i]=f.u[i]-f.up[i];
-   for (i=0; i<18; ++i)
-      f.e[i]=f.e[i]-f.ep[i];
+   if (!nostrain)
+      for (i=0; i<18; ++i)
+         f.e[i]=f.e[i]-f.ep[i];
    xi = data.x[j]-data.l; eta = p;
    chin(sd,cd,pi,mat,xi,eta,&f);
    for (i=0; i<9; ++i) 
       f.u[i]=f.u[i]-f.up[i];
-   for (i=0; i<18; ++i)
-      f.e[i]=f.e[i]-f.ep[i];
+   if (!nostrain)
+      for (i=0; i<18; ++i)
+         f.e[i]=f.e[i]-f.ep[i];
    xi = data.x[j]-data.l; eta = p-data.w;
    chin(sd,cd,pi,mat,xi,eta,&f);
    for (i=0; i<9; ++i) 
       f.u[i]=f.u[i]+f.up[i];
-   for (i=0; i<18; ++i)
-      f.e[i]=f.e[i]+f.ep[i];
+   if (!nostrain)
+      for (i=0; i<18; ++i)
+         f.e[i]=f.e[i]+f.ep[i];
    for (i=0; i < 9; ++i) 
       if (fabs(f.u[i]) <= 1.0e-08) 
 	 f.u[i] = 0.0;
@@ -700,6 +778,8 @@ double  xi,eta;
 /*
  *  find strain parts
  */
+    if (nostrain)
+        return;
     if (cd != 0.0)  /* exact test is allowed because close cd was set exactly 0 earlier */
     {
         if (!srdt)
@@ -991,3 +1071,127 @@ double  *e,*epr;
       epr[n+3] = e[n]*sa*sa + e[n+3]*ca*ca - (e[n+1]+e[n+2])*sa*ca;
       }
 }
+
+#ifdef DISLOC_LIBRARY
+/*********************************************************************
+ *  shared library entry point, build with:                           *
+ *     gcc -shared -fPIC -DDISLOC_LIBRARY disloc.c -o libdisloc.so -lm*
+ *                                                                    *
+ *  xo, yo:  npts observation points, km from the origin              *
+ *  faults:  nfaults fault records, same fields as the input file     *
+ *  out:     npts*6 doubles, filled with ux uy uz exx exy eyy         *
+ *  xy:      npts*2 doubles, x y as written by main(), may be NULL    *
+ *  returns the number of faults read, -1 if memory runs out          *
+ *  uses the same globals as main(), callers must serialize calls     *
+ *********************************************************************/
+struct faultrec
+   {
+   float x;
+   float y;
+   float strike;
+   int   type;
+   float d;
+   float delta;
+   float lambda;
+   float mu;
+   float u1;
+   float u2;
+   float u3;
+   float l;
+   float w;
+   };
+
+/*********************************************************************
+ *  on = 0 skips the strains of the following disloc_points() calls,  *
+ *  their columns in out are left at 0                                *
+ *********************************************************************/
+void disloc_strains(on)
+int     on;
+{
+   nostrain = !on;
+}
+
+int disloc_points(npts,xo,yo,nfaults,faults,out,xy)
+int     npts,nfaults;
+float   *xo,*yo;
+struct  faultrec *faults;
+double  *out,*xy;
+{
+   int     n,k;
+   float   xp,yp;
+   double  pi,sd,cd,mat;
+
+   pi = acos(-1.0);
+   test = 0;
+   data.genparm = 0;
+   data.xnum = npts;
+   data.ynum = 1;
+   data.x = (float *) malloc(sizeof(float)*npts);
+   data.y = (float *) malloc(sizeof(float)*npts);
+   if (data.x == NULL || data.y == NULL)
+      {
+      free(data.x); free(data.y);
+      return -1;
+      }
+   sum = (struct sumout *) out;
+   for (j=0; j < npts; ++j)
+      {
+      sum[j].d1 = 0.0;  sum[j].str1 = 0.0;
+      sum[j].d2 = 0.0;  sum[j].str2 = 0.0;
+      sum[j].d3 = 0.0;  sum[j].str3 = 0.0;
+      }
+   for (n=0; n < nfaults; ++n)
+      {
+      data.lon = faults[n].x;
+      data.lat = faults[n].y;
+      data.strike = faults[n].strike;
+      data.type = faults[n].type;
+      data.d = faults[n].d;
+      data.delta = faults[n].delta;
+      data.lambda = faults[n].lambda;
+      data.mu = faults[n].mu;
+      data.u1 = faults[n].u1;
+      data.u2 = faults[n].u2;
+      data.u3 = faults[n].u3;
+      data.l = faults[n].l;
+      data.w = faults[n].w;
+      sa = sin(pi*(data.strike-90.0)/180.0);
+      ca = cos(pi*(data.strike-90.0)/180.0);
+      cd = cos(data.delta*pi/180.0);
+      if (fabs(cd) <= 1.0e-08) cd = 0.0;
+      sd = sin(data.delta*pi/180.0);
+      mat = data.mu/(data.lambda + data.mu);
+      for (j=0; j < npts; ++j)
+         {
+         xp = xo[j] - data.lon;
+         yp = yo[j] - data.lat;
+         data.x[j] = xp*ca-yp*sa;
+         data.y[j] = xp*sa+yp*ca;
+/* point source  */
+         if (!data.type)
+            point(sd,cd,pi,mat,NULL);
+/*  finite fault  */
+         else if (data.type == 1)
+            fault(sd,cd,pi,mat,NULL);
+         }
+      }
+   if (xy != NULL)
+      for (k=0; k < npts; ++k)
+         {
+         if (nfaults > 0)
+            {
+            xy[2*k] =  data.x[k]*ca + data.y[k]*sa + data.lon;
+            xy[2*k+1] = -data.x[k]*sa + data.y[k]*ca + data.lat;
+            }
+         else
+            {
+            xy[2*k] = xo[k];
+            xy[2*k+1] = yo[k];
+            }
+         }
+   free(data.x); free(data.y);
+   data.x = NULL; data.y = NULL;
+   sum = NULL;
+   return nfaults;
+}
+#endif
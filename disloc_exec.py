@@ -7,13 +7,35 @@
 import os
 import sys
 import json
+import math
+import time
+import signal
 import random
 import datetime
 import subprocess
 import argparse
+import multiprocessing
 
 
-from SARImage import lineofsight 
+from SARImage import lineofsight, readdisplacement
+import dislocengine
+import disloclib
+import dislocgreens
+import dislocadaptive
+import dislocfarfield
+import dislocstations
+import dislocpalette
+import dislocpng
+import dislockmz
+import dislocgeotiff
+import dislocstream
+import disloccache
+import dislocpool
+import disloccost
+import dislocmetrics
+
+# seconds a disloc run may take
+DISLOC_TIMEOUT = 15
 
 def setoutputlocation():
 	""" return a folder for output """
@@ -50,21 +72,20 @@ def getURLprefix():
     
     return urlprefix
 
-def exec_disloc(input, output, workdir=False):
-    """ execute disloc with input and output """
+def exec_disloc(input, output, workdir=False, timeout=DISLOC_TIMEOUT):
+    """ execute disloc with input and output, killed after timeout seconds """
 
     disloc_binary = getbinary()
 
-    if workdir:
-        os.chdir(workdir)
-    
-    proc = subprocess.Popen([disloc_binary,input,output], stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+    # the binary runs in workdir, this process keeps its current dir
+    proc = subprocess.Popen([disloc_binary,input,output], cwd=workdir or None, stdout=subprocess.PIPE,stderr=subprocess.PIPE)
     try:
-        outs, errs = proc.communicate(timeout=15)
+        outs, errs = proc.communicate(timeout=timeout)
     except subprocess.TimeoutExpired:
         proc.kill()
         outs, errs = proc.communicate()
         # remove output file, save disk space
+        output = os.path.join(workdir or "", output)
         if os.path.exists(output):
             os.remove(output)
         exec_status = {"status":"failed","error":"timeout"}
@@ -77,17 +98,131 @@ def exec_disloc(input, output, workdir=False):
 
     return exec_status
 
-def dislocworkflow(args):
-    """disloc workflow
-        args: dict object from restAPI call
+def isflagset(args, key):
+    """ true if a flag is set in CLI or restAPI arguments """
 
-        step 0: working dir and input file
-        step 1: disloc
-        step 2: SARImage
-        step N: result json
+    value = args.get(key, False)
+    return value is True or str(value).lower() in ['1', 'true', 'yes']
+
+def _runchild(sender, function, args):
+    """ child of runchild(): send the result or the exception """
+
+    # a timeout terminates the worker pool of the engine with the child
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    try:
+        result = (True, function(*args))
+    except Exception as e:
+        result = (False, e)
+    sender.send(result)
+    sender.close()
+
+def runchild(function, args, timeout=DISLOC_TIMEOUT):
+    """ function(*args) in a child process, killed after timeout seconds
+        returns its result, raises its exception, or
+        multiprocessing.TimeoutError
     """
-    
-    # step 0: working dir and input file
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    child = multiprocessing.Process(target=_runchild, args=(sender, function, args))
+    child.start()
+    sender.close()
+    done = False
+    try:
+        if not receiver.poll(timeout):
+            raise multiprocessing.TimeoutError()
+        try:
+            done, result = receiver.recv()
+        except EOFError:
+            child.join()
+            raise OSError("engine exited with code %s" % child.exitcode)
+    finally:
+        receiver.close()
+        if child.is_alive() and not done:
+            child.terminate()
+            child.join(1)
+            if child.is_alive():
+                child.kill()
+        child.join()
+    if not done:
+        raise result
+    return result
+
+def runengine(input, output, evaluator, processes, split, greens, adaptive, look, g, farfield, tolerance, dtype, products, timeout):
+    """ child of exec_dislocengine(): run the engine and write the output """
+
+    with open(input,'r') as f:
+        model = dislocengine.readinput(f.read())
+    if adaptive:
+        result = dislocadaptive.disloc(model, evaluator=evaluator, look=look)
+    elif farfield:
+        result = dislocfarfield.disloc(model, evaluator=evaluator, tolerance=tolerance)
+    elif greens:
+        result = dislocgreens.disloc(model, evaluator=evaluator)
+    else:
+        result = dislocengine.disloc(model, evaluator=evaluator, processes=processes, timeout=timeout, split=split,
+                                     products=products, look=g)
+
+    if result.get('products', 'all') != products:
+        result = dislocengine.selectproducts(result, products, g)
+
+    # keep the table for downloads, text or .npy by the output name
+    dislocengine.writeoutput(result, output, dtype=dtype)
+
+    return result
+
+def exec_dislocengine(input, output, workdir=False, engine='numpy', processes=1, split='rows', greens=False, adaptive=False, look=None, farfield=False, tolerance=None, dtype='float64', products='all', timeout=DISLOC_TIMEOUT):
+    """ run an in-process engine with input and output
+        engine: numpy (dislocengine.py) or library (libdisloc.so)
+        processes: worker processes, 0: one per core
+        split: rows (grid row tiles) or faults (fault list chunks)
+        greens: sum cached unit-slip responses (dislocgreens.py)
+        adaptive: refine a coarse grid near faults and fringes (dislocadaptive.py)
+        look: (elevation, azimuth, radar wavelength in cm) for the adaptive grid
+        farfield: point sources and cutoffs for distant patches (dislocfarfield.py)
+        tolerance: farfield displacement error per patch, None: relative to the largest slip
+        dtype: float64 or float32 for a .npy output
+        products: all, displacement, strain or los (needs look), columns of
+                  the output; the numpy and library engines skip the parts
+                  that are not needed, greens, adaptive and farfield select
+                  them after the run
+        timeout: seconds the engine may take, it runs in a child process
+                 killed after that, as the binary of exec_disloc()
+
+        returns exec status and the result arrays
+    """
+
+    if engine == 'library':
+        evaluator = disloclib.evaluate
+    else:
+        evaluator = dislocengine.evaluate
+
+    if products == 'los' and look is None:
+        exec_status = {"status":"failed","error":"los needs a look geometry"}
+        return exec_status, None
+    g = None if look is None else dislocengine.lookvector(look[0], look[1])
+
+    try:
+        result = runchild(runengine, (input, output, evaluator, processes, split, greens, adaptive, look, g, farfield,
+                                      tolerance, dtype, products, timeout), timeout)
+    except multiprocessing.TimeoutError:
+        # remove output file, save disk space
+        if os.path.exists(output):
+            os.remove(output)
+        exec_status = {"status":"failed","error":"timeout"}
+        return exec_status, None
+    except (ValueError, OSError, MemoryError) as e:
+        exec_status = {"status":"failed","error":str(e)}
+        return exec_status, None
+
+    exec_status = {"status":"success","error":""}
+
+    return exec_status, result
+
+def prepareinput(args):
+    """ working dir and input file of a workflow
+        returns outputdir (False: current dir) and the input file path
+    """
+
     # create a working dir
     outputdir = False
     # create a working dir for api call
@@ -104,44 +239,250 @@ def dislocworkflow(args):
             args['input'] = inputdata
 
     if outputdir: 
-        inputfile = outputdir + os.path.sep + "input.txt"
+        inputfile = os.path.abspath(outputdir + os.path.sep + "input.txt")
     else:
-        inputfile = "input.txt"
+        inputfile = os.path.abspath("input.txt")
         
     # write input file attached input
     if 'input' in args:
         with open(inputfile,"w") as f:
             f.write(args['input'])
 
-    # step 1: disloc
-    # exec disloc.c
-    if 'output' in args:
-        outputfile = args['output'] + ".csv"
-    else:
-        outputfile = "output.csv"
+    return outputdir, inputfile
 
-    disloc_status = exec_disloc(inputfile,outputfile, workdir = outputdir)    
+def parselooks(args, paralist):
+    """ look geometries of a request
+        looks: list of dicts with elevation, azimuth and radarfrequency, or
+               a string "elevation,azimuth,radarfrequency;..." (missing
+               values default to paralist)
+        returns list of paralist dicts, [paralist] without looks
+    """
 
-    # dislo failed
-    if disloc_status['status'] != 'success':
-        err = disloc_status['error']
-        return {"status":"failed","error":"disloc failed"}
+    looks = args.get('looks')
+    if not looks:
+        return [paralist]
+
+    if isinstance(looks, str):
+        looks = [dict(zip(["elevation", "azimuth", "radarfrequency"], item.split(",")))
+                 for item in looks.split(";") if item.strip()]
+    geometries = []
+    for look in looks:
+        geometry = dict(paralist)
+        for key in geometry:
+            if look.get(key, "") != "":
+                geometry[key] = float(look[key])
+        geometries.append(geometry)
+
+    return geometries
+
+def dislocworkflow(args, store=None, progress=None, timeout=DISLOC_TIMEOUT):
+    """disloc workflow
+        args: dict object from restAPI call
+        store: dict that receives the image artifacts in memory, by file
+               name, see SARImage.generateKML
+        progress: function called with the stage name and the fraction
+                  done as the steps start
+        timeout: seconds disloc may take
+
+        step 0: working dir and input file
+        step 1: disloc
+        step 2: SARImage
+        step N: result json
+        with cache set, steps 1 to N are skipped for a job identical to
+        an earlier one, see disloccache.py
+        the time and peak rss of every stage go to timing in the summary
+        and to the metrics of the host, see dislocmetrics.py
+    """
     
-    # step 2: SARImage
-    # three paras:
+    # station list instead of the grid
+    if 'stations' in args or 'stationfile' in args:
+        return stationworkflow(args, timeout)
+
+    with dislocmetrics.recording(dislocmetrics.Stages()) as stages:
+        # step 0: working dir and input file
+        with dislocmetrics.stage("input"):
+            outputdir, inputfile = prepareinput(args)
+
+        # identical jobs are served from disloccache.py, not with an in-memory
+        # store and not without a job folder
+        if isflagset(args, 'cache') and store is None and outputdir and 'input' in args:
+            outputdir = os.path.abspath(outputdir)
+            with dislocmetrics.stage("cache"):
+                disloc_status = disloccache.run(args['input'], args, outputdir, lambda: runworkflow(args, outputdir, inputfile, None, progress, timeout))
+            if disloc_status['status'] == 'success':
+                # names of the cached job, urls of this one
+                disloc_status['output'] = outputlist([os.path.basename(x) for x in disloc_status['output']], outputdir, args)
+                for item in disloc_status.get('looks', []):
+                    item['output'] = outputlist([os.path.basename(x) for x in item['output']], outputdir, args)
+                # the timing of the cached job is not that of this one
+                if disloc_status['cache']['hit']:
+                    cached = disloc_status.get('timing', {})
+                    disloc_status['timing'] = stages.summary(cached if 'grid' in cached else None)
+                writesummary(disloc_status, outputdir)
+        else:
+            disloc_status = runworkflow(args, outputdir, inputfile, store, progress, timeout)
+
+    try:
+        dislocmetrics.record(disloc_status, stages)
+    except OSError:
+        pass
+    return disloc_status
+
+def outputlist(names, outputdir, args):
+    """ file names of the job folder, urls unless called by the api """
+
+    if 'api' in args:
+        return names
+    urlprefix = getURLprefix()
+    foldername = os.path.basename(outputdir)
+    return [urlprefix + foldername + "/" + x for x in names]
+
+def writesummary(disloc_status, outputdir):
+    """ write summary.json to the job folder """
+
+    if outputdir: 
+        jobsummary = outputdir + os.path.sep + "summary.json"
+    else:
+        jobsummary = "summary.json"
+    
+    with open(jobsummary,"w") as f:
+        f.write(json.dumps(disloc_status,indent = 4))
+
+def runworkflow(args, outputdir, inputfile, store=None, progress=None, timeout=DISLOC_TIMEOUT):
+    """ steps 1 to N of dislocworkflow() """
+
+    if progress is None:
+        progress = lambda stage, fraction: None
+
+    # SARImage paras:
     # elevation: 60
     # azimuth: 0
     # radarfrequency: 1.26
-    # step N: result JSON
-    
     paralist = {"elevation":60,"azimuth":0,"radarfrequency":1.26}
     for key in paralist:
         if key in args:
             paralist[key] = float(args[key])
+
+    # looks: several geometries share one disloc run, the first one is
+    # used for the engine (adaptive refinement, los product)
+    try:
+        geometries = parselooks(args, paralist)
+    except (ValueError, TypeError, AttributeError):
+        return {"status":"failed","error":"bad looks: " + str(args.get('looks'))}
+    paralist = geometries[0]
     
     radarfrequency = paralist['radarfrequency']*10**9 # Ghz to hz
     radarwavelength = 299792458.0/radarfrequency * 100.0 # Convert to cm
 
+    # step 1: disloc
+    # exec disloc.c
+    # outputformat: npy (float64), npy32 (float32) or csv (text table)
+    outputformat = args.get('outputformat', 'npy')
+    if outputformat == 'csv':
+        suffix = ".csv"
+    else:
+        suffix = ".npy"
+    # absolute paths in the job folder, the current dir is shared by
+    # the jobs of a process
+    jobdir = os.path.abspath(outputdir) if outputdir else os.getcwd()
+    if 'output' in args:
+        outputfile = os.path.join(jobdir, args['output'] + suffix)
+    else:
+        outputfile = os.path.join(jobdir, "output" + suffix)
+
+    # engine: binary (disloc.c), numpy (dislocengine.py) or library (libdisloc.so)
+    engine = args.get('engine', 'binary')
+    if engine not in ['binary', 'numpy', 'library']:
+        return {"status":"failed","error":"unknown engine: " + str(engine)}
+    dislocresult = None
+    # products: all, displacement, strain or los, numpy and library engines
+    products = args.get('products', 'all')
+    if products not in dislocengine.PRODUCTS:
+        return {"status":"failed","error":"unknown products: " + str(products)}
+    if products == 'los' and len(geometries) > 1:
+        return {"status":"failed","error":"los product has a single look geometry"}
+    # palette of the interferogram, see dislocpalette.py
+    palette = args.get('palette', 'uavsar')
+    if palette not in dislocpalette.names():
+        return {"status":"failed","error":"unknown palette: " + str(palette)}
+    # renderer: bilinear or nearest (dislocpng.py) or matplotlib
+    renderer = args.get('renderer', 'bilinear')
+    if renderer not in ['bilinear', 'nearest', 'matplotlib']:
+        return {"status":"failed","error":"unknown renderer: " + str(renderer)}
+    # imagescale: image pixels per grid point, a positive integer
+    try:
+        imagescale = int(args.get('imagescale', dislocpng.SCALE))
+    except (ValueError, TypeError):
+        imagescale = 0
+    if imagescale < 1:
+        return {"status":"failed","error":"bad imagescale: " + str(args.get('imagescale'))}
+    # artifacts: image files written to the working dir, default: png,kml,kmz
+    try:
+        artifacts = dislockmz.parseartifacts(args.get('artifacts'))
+    except ValueError as e:
+        return {"status":"failed","error":str(e)}
+    # processes of the numpy and library engines, 0: one per core, at
+    # most one per core
+    try:
+        processes = int(args.get('processes', 1))
+    except (ValueError, TypeError):
+        processes = -1
+    if processes < 0:
+        return {"status":"failed","error":"bad processes: " + str(args.get('processes'))}
+    processes = min(processes, os.cpu_count() or 1)
+    # split: rows (grid row tiles) or faults (fault list chunks)
+    split = args.get('split', 'rows')
+    if split not in ['rows', 'faults']:
+        return {"status":"failed","error":"unknown split: " + str(split)}
+    # tolerance: farfield displacement error per patch, finite and > 0
+    tolerance = None
+    if 'tolerance' in args:
+        try:
+            tolerance = float(args['tolerance'])
+        except (ValueError, TypeError):
+            tolerance = 0.0
+        if not (math.isfinite(tolerance) and tolerance > 0):
+            return {"status":"failed","error":"bad tolerance: " + str(args['tolerance'])}
+    progress('disloc', 0.05)
+    starttime = time.time()
+    startmemory = disloccost.peakmemory()
+    with dislocmetrics.stage("engine"):
+        if engine in ['numpy', 'library']:
+            greens = isflagset(args, 'greens')
+            adaptive = isflagset(args, 'adaptive')
+            look = (paralist['elevation'], paralist['azimuth'], radarwavelength)
+            farfield = isflagset(args, 'farfield')
+            disloc_status, dislocresult = exec_dislocengine(inputfile, outputfile, workdir = jobdir, engine = engine, processes = processes, split = split, greens = greens, adaptive = adaptive, look = look, farfield = farfield, tolerance = tolerance, dtype = 'float32' if outputformat == 'npy32' else 'float64', products = products, timeout = timeout)
+        else:
+            disloc_status = exec_disloc(inputfile,outputfile, workdir = jobdir, timeout = timeout)
+
+    # dislo failed, a timeout is told apart from other failures
+    if disloc_status['status'] != 'success':
+        err = disloc_status['error']
+        if err == "timeout":
+            if dislocmetrics.current() is not None:
+                dislocmetrics.current().timeout = True
+            return {"status":"failed","error":"timeout"}
+        return {"status":"failed","error":"disloc failed"}
+    dislocseconds = time.time() - starttime
+
+    # evaluation throughput in patches*points per second
+    if dislocresult is not None:
+        disloc_status['stats'] = dislocresult['stats']
+
+    # float32 GeoTIFF of los, ux ... eyy next to the table
+    if isflagset(args, 'raster'):
+        rasterfile = os.path.splitext(outputfile)[0] + ".tif"
+        try:
+            with dislocmetrics.stage("raster"):
+                bands, extent = dislocgeotiff.export(outputfile, rasterfile, dislocresult, look=(paralist['elevation'], paralist['azimuth']))
+        except (ValueError, OSError) as e:
+            return {"status":"failed","error":"raster failed: " + str(e)}
+        disloc_status['raster'] = {"file":os.path.basename(rasterfile), "bands":bands}
+    
+    # step 2: SARImage
+    # step N: result JSON
+
     imageURL = ""
     dislocOutput = outputfile
     # west = str(extent[0])
@@ -149,39 +490,135 @@ def dislocworkflow(args):
     # south = str(extent[2])
     # north = str(extent[3])
     # # [west,east,south,north]
-    imageextent = lineofsight(paralist['elevation'], paralist['azimuth'],radarwavelength,dislocOutput, imageURL)
-    west = imageextent[0]
-    east = imageextent[1]
-    south =imageextent[2]
-    north =imageextent[3]
-    disloc_status["latlonbox"] = {"north":north,"south":south,"east":east,"west":west}    
+    # strain only: no displacement, no interferogram
+    lookstatus = []
+    drawable = dislocresult is None or dislocresult.get('products', 'all') != 'strain'
+    # stream: large tables are imaged from the file in row blocks,
+    # dislocstream.py, the result arrays are released first
+    stream = renderer != 'matplotlib' and (isflagset(args, 'stream') or dislocstream.islarge(dislocOutput, dislocresult))
+    if stream:
+        dislocresult = None
+        disloc_status['stream'] = True
+    imagestart = time.time()
+    if drawable:
+        # displacements are read once for all geometries
+        with dislocmetrics.stage("parse"):
+            displacement = None if stream else readdisplacement(dislocOutput, dislocresult)
+        for k, geometry in enumerate(geometries):
+            progress('image', 0.6 + 0.35*k/len(geometries))
+            wavelength = 299792458.0/(geometry['radarfrequency']*10**9) * 100.0
+            name = "" if len(geometries) == 1 else ".look%d" % (k + 1)
+            if stream:
+                imageextent = dislocstream.lineofsight(geometry['elevation'], geometry['azimuth'],wavelength,dislocOutput, imageURL, palette=palette, renderer=renderer, scale=imagescale, name=name, artifacts=artifacts, store=store)
+            else:
+                imageextent = lineofsight(geometry['elevation'], geometry['azimuth'],wavelength,dislocOutput, imageURL, palette=palette, renderer=renderer, scale=imagescale, displacement=displacement, name=name, artifacts=artifacts, store=store)
+            west = imageextent[0]
+            east = imageextent[1]
+            south =imageextent[2]
+            north =imageextent[3]
+            imagename = os.path.basename(dislocOutput) + ".insar" + name
+            lookstatus.append({"parameters":geometry,
+                               "latlonbox":{"north":north,"south":south,"east":east,"west":west},
+                               "output":[imagename + "." + x for x in artifacts]})
+        disloc_status["latlonbox"] = lookstatus[0]["latlonbox"]
+    imageseconds = time.time() - imagestart
     disloc_status["parameters"] = paralist
+
+    # keep the cost model of this host current, shortcuts of the numpy
+    # and library engines are not runs of the engine; the coefficients
+    # are of a serial run, a run split over processes counts as
+    # processes times its wall time
+    shortcut = greens or adaptive or farfield if engine in ['numpy', 'library'] else False
+    workers = (processes or os.cpu_count() or 1) if engine in ['numpy', 'library'] else 1
+    job = None
+    try:
+        with open(inputfile) as f:
+            job = disloccost.size(f.read(), args)
+        disloccost.learn(job, engine, None if shortcut else dislocseconds*workers, imageseconds if drawable else None,
+                         disloccost.peakmemory() - startmemory)
+    except (ValueError, IndexError, OSError):
+        pass
+
     # list of output file
+    filelist = os.listdir(jobdir)
+
+    filelist.append('summary.json')
+        
+    disloc_status['output'] = outputlist(filelist, outputdir, args)
+    for item in lookstatus:
+        item['output'] = outputlist(item['output'], outputdir, args)
+    if len(geometries) > 1:
+        disloc_status['looks'] = lookstatus
+    
+    # write summary.json
+    progress('summary', 0.95)
+    stages = dislocmetrics.current()
+    if stages is not None:
+        disloc_status['timing'] = stages.summary(job)
+    writesummary(disloc_status, jobdir)
+
+    return disloc_status
+
+def stationworkflow(args, timeout=DISLOC_TIMEOUT):
+    """station workflow
+        args: dict object from restAPI call, stations: embedded station
+              list or stationfile: station file, lines of lon lat [site]
+        timeout: seconds the predictions may take
+
+        step 0: working dir, input and station files
+        step 1: predictions at the stations, written chunk by chunk
+        step N: result json
+    """
+
+    # step 0: working dir, input and station files
+    outputdir, inputfile = prepareinput(args)
     if outputdir:
-        filelist = os.listdir(outputdir)
+        prefix = outputdir + os.path.sep
+    else:
+        prefix = ""
+
+    if 'stations' in args:
+        stationfile = prefix + "stations.txt"
+        with open(stationfile,"w") as f:
+            f.write(args['stations'])
+    else:
+        stationfile = args['stationfile']
+
+    outputfile = prefix + args.get('output', 'output') + ".stations.txt"
+
+    # step 1: Site Lon Lat DeltaE DeltaN DeltaV sig sig sig per station
+    if args.get('engine', 'numpy') not in ['binary', 'numpy', 'library']:
+        return {"status":"failed","error":"unknown engine: " + str(args.get('engine'))}
+    if args.get('engine', 'numpy') == 'library':
+        evaluator = disloclib.evaluate
     else:
-        filelist = os.listdir()
+        evaluator = dislocengine.evaluate
+    chunksize = int(args.get('chunksize', dislocstations.CHUNKSIZE))
 
+    try:
+        with open(inputfile,'r') as f:
+            model = dislocengine.readinput(f.read())
+        stats = runchild(dislocstations.predict, (model, stationfile, outputfile, evaluator, chunksize), timeout)
+    except multiprocessing.TimeoutError:
+        return {"status":"failed","error":"timeout"}
+    except (ValueError, OSError, MemoryError) as e:
+        return {"status":"failed","error":str(e)}
+
+    # step N: result JSON
+    station_status = {"status":"success","error":"","stats":stats}
+    filelist = os.listdir(outputdir) if outputdir else os.listdir()
     filelist.append('summary.json')
-        
     if 'api' in args:
-        disloc_status['output'] = filelist
+        station_status['output'] = filelist
     else:
         urlprefix = getURLprefix()
         foldername = os.path.basename(outputdir)
-        urlslist = [urlprefix + foldername + "/" + x for x in filelist]
-        disloc_status['output'] = urlslist
-    
-    if outputdir: 
-        jobsummary = outputdir + os.path.sep + "summary.json"
-    else:
-        jobsummary = "summary.json"
-    
-    # write summary.json
-    with open(jobsummary,"w") as f:
-        f.write(json.dumps(disloc_status,indent = 4))
+        station_status['output'] = [urlprefix + foldername + "/" + x for x in filelist]
 
-    return disloc_status
+    with open(prefix + "summary.json","w") as f:
+        f.write(json.dumps(station_status,indent = 4))
+
+    return station_status
 
 def _getParser():
     
@@ -192,6 +629,18 @@ def _getParser():
     # azimuth: in degrees, default: 0
     # radarfrequency: in GHz, default: 1.26
     # workdir: working directory
+    # engine: binary, numpy or library, default: binary
+    # processes: worker processes for numpy/library engines, 0: one per core, default: 1
+    # split: rows or faults, how work is shared by the processes, default: rows
+    # greens: reuse cached unit-slip responses for numpy/library engines
+    # adaptive: adaptive grid refined near faults and fringes for numpy/library engines
+    # farfield: point-source approximation and cutoff of distant patches for numpy/library engines
+    # tolerance: farfield displacement error allowed per patch
+    # outputformat: npy, npy32 or csv, default: npy
+    # stationfile: lon lat [site] station list, predictions at the stations instead of the grid
+    # chunksize: stations evaluated at a time, default: 100000
+    # stream: image the table from the file in row blocks, bounded memory
+    # cache: serve identical jobs from cache/results, see disloccache.py
 
     parser = argparse.ArgumentParser(description="Execute disloc workflow.")
     parser.add_argument('-i','--input', action='store', dest='inputfile',required=True,help='disloc input file')
@@ -199,7 +648,27 @@ def _getParser():
     parser.add_argument('-el','--elevation', action='store', dest='elevation',required=False,help='elevation in degrees, default: 60')
     parser.add_argument('-az','--azimuth', action='store', dest='azimuth',required=False,help='azimuth in degrees, default: 0')
     parser.add_argument('-rf','--radarfrequency', action='store',dest='radarfrequency',required=False,help='radarfrequency: in GHz, default: 1.26')
+    parser.add_argument('-lk','--looks', action='store',dest='looks',required=False,help='several look geometries from one disloc run: "elevation,azimuth,radarfrequency;...", e.g. "60,-5,1.26;30,175,5.405"')
     parser.add_argument('-wd','--workdir', action='store',dest='workdir',required=False,help='working directory')
+    parser.add_argument('-e','--engine', action='store',dest='engine',required=False,choices=['binary','numpy','library'],help='disloc engine: binary, numpy or library, default: binary')
+    parser.add_argument('-np','--processes', action='store',dest='processes',required=False,help='worker processes for numpy/library engines, 0: one per core, at most one per core, default: 1')
+    parser.add_argument('-sp','--split', action='store',dest='split',required=False,choices=['rows','faults'],help='split grid rows or faults across processes, default: rows')
+    parser.add_argument('-g','--greens', action='store_true',dest='greens',required=False,help='reuse cached unit-slip responses when only slip changes')
+    parser.add_argument('-ad','--adaptive', action='store_true',dest='adaptive',required=False,help='evaluate a coarse grid refined near faults and fringes, interpolate the rest')
+    parser.add_argument('-ff','--farfield', action='store_true',dest='farfield',required=False,help='replace distant patches by point sources and skip the farthest')
+    parser.add_argument('-tol','--tolerance', action='store',dest='tolerance',required=False,help='farfield displacement error allowed per patch, default: 1e-5 times the largest slip')
+    parser.add_argument('-of','--outputformat', action='store',dest='outputformat',required=False,choices=['npy','npy32','csv'],help='disloc output table: npy (float64), npy32 (float32) or csv (text), default: npy')
+    parser.add_argument('-st','--stations', action='store',dest='stationfile',required=False,help='station file, lines of lon lat [site]: write Site Lon Lat DeltaE DeltaN DeltaV sig sig sig for every station')
+    parser.add_argument('-cs','--chunksize', action='store',dest='chunksize',required=False,help='stations evaluated at a time, default: 100000')
+    parser.add_argument('-pr','--products', action='store',dest='products',required=False,choices=['all','displacement','strain','los'],help='output columns of the numpy/library engines: all, displacement, strain or los (line of sight), default: all')
+    parser.add_argument('-pa','--palette', action='store',dest='palette',required=False,choices=dislocpalette.names(),help='interferogram colors: uavsar (colortable.csv), wheel or wheelflip (Goldstein color wheel), default: uavsar')
+    parser.add_argument('-r','--renderer', action='store',dest='renderer',required=False,choices=['bilinear','nearest','matplotlib'],help='interferogram image: bilinear or nearest upscaling written directly as PNG, or a matplotlib figure, default: bilinear')
+    parser.add_argument('-is','--imagescale', action='store',dest='imagescale',required=False,help='image pixels per grid point of the bilinear and nearest renderers, default: 8')
+    parser.add_argument('-ar','--artifacts', action='store',dest='artifacts',required=False,help='image files to write: comma separated png, kml, kmz or none, default: png,kml,kmz')
+    parser.add_argument('-sm','--stream', action='store_true',dest='stream',required=False,help='image the output table from the file in blocks of grid rows, memory bounded by the block size; on by default for grids over 4M points')
+    parser.add_argument('-c','--cache', action='store_true',dest='cache',required=False,help='serve a job identical to an earlier one (same normalized input and parameters) from cache/results instead of running it')
+    parser.add_argument('-lo','--local', action='store_true',dest='local',required=False,help='run the workflow in this process even when a worker pool (dislocpool.py) is running')
+    parser.add_argument('-rs','--raster', action='store_true',dest='raster',required=False,help='also write output.tif, a float32 GeoTIFF with los, ux, uy, uz, exx, exy, eyy bands')
     return parser
 
 def main():
@@ -210,7 +679,10 @@ def main():
     # remove none paras
     noneparas = {k: v for k, v in paras.items() if v is not None}
     noneparas['api'] = False
-    results = dislocworkflow(noneparas)
+    # jobs go to a running dislocpool.py pool, unless local is set
+    results = None if noneparas.pop('local') else dislocpool.run(noneparas)
+    if results is None:
+        results = dislocworkflow(noneparas)
     print(results)
     # test exec_disloc
     #test case 1
@@ -8,8 +8,10 @@
 """
 
 import sys
+import json
 import argparse
 from earthquakefeed import check_event_geojson
+import dislocbatch
 
 
 def moment_tensor_workflow(geojsonurl):
@@ -25,6 +27,30 @@ def moment_tensor_workflow(geojsonurl):
     return
 
 
+def multiple_files_workflow(manifest, workdir, processes, timeout, params):
+    """execute the disloc workflow for every input of a manifest or directory"""
+
+    common = {}
+    for param in params:
+        key, sep, value = param.partition("=")
+        if not sep:
+            print("!notice: --param takes key=value, not", param)
+            sys.exit(1)
+        common[key] = value
+
+    try:
+        items = dislocbatch.readmanifest(manifest)
+    except (OSError, ValueError) as e:
+        print("!notice: bad manifest", manifest, e)
+        sys.exit(1)
+
+    summary = dislocbatch.batch(items, workdir, common, processes, timeout)
+    print(json.dumps(summary["stats"]))
+    for item in summary["items"]:
+        print("%-24s %-8s %6.1f s %s" % (item["name"], item["status"], item["seconds"], item["error"]))
+    return summary
+
+
 def main():
     """parameters parsing"""
 
@@ -36,6 +62,12 @@ def main():
     # monment-tensor
     # url to the event GeoJSON
     parser.add_argument("--geojson", help="URL to event GeoJSON")
+    # multiple-files
+    parser.add_argument("--manifest", help="directory of disloc inputs, or file of lines: path [key=value ...]")
+    parser.add_argument("--workdir", help="batch folder: summary.json and a folder per input")
+    parser.add_argument("-n", "--processes", type=int, default=dislocbatch.PROCESSES, help="inputs run at the same time, default: %d" % dislocbatch.PROCESSES)
+    parser.add_argument("--timeout", type=float, default=dislocbatch.ITEMTIMEOUT, help="longest seconds an input may run, each gets a timeout proportional to its predicted cost, default: %d" % dislocbatch.ITEMTIMEOUT)
+    parser.add_argument("--param", action="append", default=[], help="key=value parameter of every input, e.g. engine=numpy; repeat for more")
 
     args = parser.parse_args()
     if args.workflow == "moment-tensor":
@@ -43,6 +75,12 @@ def main():
             print("!notice: for moment-tensor workflow, an GeoJSON URL is required.")
         else:
             moment_tensor_workflow(args.geojson)
+    elif args.workflow == "multiple-files":
+        if not (args.manifest and args.workdir):
+            print("!notice: for multiple-files workflow, --manifest and --workdir are required.")
+        else:
+            summary = multiple_files_workflow(args.manifest, args.workdir, args.processes, args.timeout, args.param)
+            sys.exit(0 if summary["status"] == "success" else 1)
 
 if __name__ == "__main__":
     main()
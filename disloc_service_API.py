@@ -10,6 +10,7 @@
 
 """
 
+import os
 import sys
 import socket
 import json
@@ -19,6 +20,14 @@ from flask import Response
 from flask import jsonify
 
 from disloc_exec import dislocworkflow
+import dislockmz
+import disloccache
+import dislocjobs
+import dislocpool
+import disloccost
+import dislocbatch
+import dislocsweep
+import dislocmetrics
 
 app = Flask(__name__)
 
@@ -33,6 +42,40 @@ def test():
     info_str += disloc.__doc__.replace('\n','<br>')
     return info_str
 
+def runworkflow(args, store=None, timeout=None):
+    """ dislocworkflow() in a warm dislocpool.py worker when a pool is
+        running, in this process otherwise
+        timeout: seconds disloc may take, None: DISLOC_TIMEOUT
+    """
+
+    result = dislocpool.run(args, store, timeout)
+    if result is None:
+        if timeout is None:
+            result = dislocworkflow(args, store=store)
+        else:
+            result = dislocworkflow(args, store=store, timeout=timeout)
+    return result
+
+# arguments naming files of the server, never taken from a request
+LOCALKEYS = ['inputfile', 'workdir', 'stationfile', 'api']
+
+def admission(args):
+    """ lane of a job by its predicted cost, see disloccost.py; inputurl
+        jobs are not sized, they run in the request with the timeout of
+        the small lane
+    """
+
+    if 'input' not in args:
+        if args.get('engine', 'binary') not in disloccost.DEFAULTS['disloc']:
+            return {"lane": "reject", "code": 400, "error": "unknown engine: " + str(args.get('engine'))}
+        return {"lane": "small", "code": 200, "estimate": {"timeout": disloccost.SMALLTIMEOUT}}
+    return disloccost.admit(args.get('input', ''), args, dislocjobs.queued())
+
+def rejected(decision):
+    """ json and status of a rejected job """
+
+    return jsonify({"status":"failed","error":decision['error'],"estimate":decision.get('estimate')}), decision['code']
+
 """disloc service"""
 @app.route("/dislocservice/disloc")
 def disloc():
@@ -49,27 +92,277 @@ def disloc():
         elevation: in degrees, default: 60
         azimuth: in degrees, default: 0
         radarfrequency: in GHz, default: 1.26
+        looks: several geometries of one run, "elevation,azimuth,radarfrequency;..."
+        palette: uavsar, wheel or wheelflip, default: uavsar
+        renderer: bilinear, nearest or matplotlib, default: bilinear
+        imagescale: image pixels per grid point, default: 8
+        artifacts: image files to keep, png,kml,kmz (default), a subset or none
+        stream: image the table from the file in row blocks, bounded memory
+        cache: serve a job identical to an earlier one from cache/results,
+               default: true, false to always run
+        raster: also write output.tif, float32 GeoTIFF of los, ux ... eyy
+        response: kmz to stream the KMZ of the (first) interferogram as the
+                  response body instead of the json, artifacts default to none
         
         Returns:
         --------------
-        json:
+        json: summary.json of the job; a job predicted to take longer
+              than disloccost.SMALLSECONDS is queued instead, as with
+              /dislocservice/submit (202); 413: job too large, 429: too
+              many jobs running, retry later
             
     """
 
-    args = request.args
+    args = request.args.to_dict()
+    for key in LOCALKEYS:
+        args.pop(key, None)
 
     # assume everything is right
     if not("input" in args or 'inputurl' in args):
-        return Response(jsonify({"status":"failed","error": "input or inputurl required!"}),status=400)
+        return jsonify({"status":"failed","error": "input or inputurl required!"}), 400
     
+    args.setdefault('cache', 'true')
+
+    # run here, queue as a large job or reject, by the predicted cost
+    decision = admission(args)
+    if decision['lane'] == 'large' and args.get('response') == 'kmz':
+        decision.update(lane="reject", code=413, error="job too large for response=kmz, use /dislocservice/submit")
+    if decision['lane'] == 'reject':
+        return rejected(decision)
+    timeout = decision['estimate']['timeout']
+    if decision['lane'] == 'large':
+        args['timeout'] = timeout
+        info = dislocjobs.status(dislocjobs.submit(args))
+        info['estimate'] = decision['estimate']
+        return jsonify(info), 202
+    if not disloccost.acquire():
+        return jsonify({"status":"failed","error":"too many jobs running, retry later"}), 429
+
+    try:
+        if args.get('response') == 'kmz':
+            args.setdefault('artifacts', 'none')
+            store = {}
+            result = runworkflow(args, store, timeout)
+            kmzs = [name for name in store if name.endswith(".kmz")]
+            if result['status'] == 'success' and not kmzs:
+                result = {"status":"failed","error":"no interferogram for response=kmz"}
+            if result['status'] != 'success':
+                return jsonify(result), 500
+            headers = {"Content-Disposition": "attachment; filename=" + os.path.basename(kmzs[0]),
+                       "Content-Length": str(len(store[kmzs[0]]))}
+            return Response(dislockmz.stream(store[kmzs[0]]), mimetype=dislockmz.KMZTYPE, headers=headers)
 
-    result = dislocworkflow(args)
+        result = runworkflow(args, timeout=timeout)
+    finally:
+        disloccost.release()
 
     if result['status'] != 'success':
-        return Response(jsonify(result),status=500)
+        return jsonify(result), 500
     
     return jsonify(result)
 
+"""asynchronous jobs"""
+@app.route("/dislocservice/submit")
+def submit():
+    """ queue a disloc job, run by the workers of dislocjobs.py
+          /dislocservice/submit?
+
+        Parameters: those of /dislocservice/disloc, without response
+
+        Returns:
+        --------------
+        json: job id, state, queue position and the cost estimate, status
+              202; 413: job too large, 429: queue full, retry later
+    """
+
+    args = request.args.to_dict()
+    if "input" not in args:
+        return jsonify({"status":"failed","error": "input required!"}), 400
+    for key in LOCALKEYS + ['response']:
+        args.pop(key, None)
+    args.setdefault('cache', 'true')
+
+    decision = admission(args)
+    if decision['lane'] == 'reject':
+        return rejected(decision)
+    args['timeout'] = decision['estimate']['timeout']
+
+    info = dislocjobs.status(dislocjobs.submit(args))
+    info['estimate'] = decision['estimate']
+    return jsonify(info), 202
+
+"""multiple-files batch"""
+@app.route("/dislocservice/batch", methods=['POST'])
+def batch():
+    """ queue a batch of disloc inputs, run by the workers of dislocjobs.py,
+        see dislocbatch.py
+          POST /dislocservice/batch
+
+        Parameters: json body
+        --------------
+        items: list of the jobs, each with input (embedded input file),
+               optional name and any parameter of /dislocservice/disloc
+        workers: items run at the same time, default: 2, at most
+                 dislocbatch.MAXPROCESSES
+        other keys: parameters of every item, e.g. engine
+
+        Returns:
+        --------------
+        json: job id, state and queue position, status 202; the result
+              of the job lists every item with its status, seconds and
+              outputs; 400: bad item, 413: an item or the batch too large
+              (dislocbatch.MAXITEMS items, disloccost.MAXSECONDS
+              predicted in all), 429: queue full, retry later
+    """
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('items'), list) or not body['items']:
+        return jsonify({"status":"failed","error": "items required!"}), 400
+    if len(body['items']) > dislocbatch.MAXITEMS:
+        return jsonify({"status":"failed","error": "%d items, at most %d" % (len(body['items']), dislocbatch.MAXITEMS)}), 413
+    common = {k: str(v) for k, v in body.items() if k not in ['items', 'timeout'] + LOCALKEYS}
+    common.setdefault('cache', 'true')
+    try:
+        common['workers'] = str(dislocbatch.workers(common.get('workers', dislocbatch.PROCESSES)))
+    except ValueError:
+        return jsonify({"status":"failed","error": "bad workers: " + common['workers']}), 400
+    if dislocjobs.queued() >= disloccost.MAXQUEUED:
+        return jsonify({"status":"failed","error":"large job queue full, retry later"}), 429
+
+    items = []
+    timeout = 0
+    seconds = 0.0
+    for number, item in enumerate(body['items'], 1):
+        if not isinstance(item, dict) or "input" not in item:
+            return jsonify({"status":"failed","error": "item %d: input required!" % number}), 400
+        item = {k: str(v) for k, v in item.items() if k not in LOCALKEYS}
+        decision = disloccost.admit(item['input'], dict(common, **item))
+        if decision['lane'] == 'reject':
+            decision['error'] = "item %d: %s" % (number, decision['error'])
+            return rejected(decision)
+        job = decision['estimate']
+        timeout = max(timeout, job['timeout'], disloccost.SAFETY*job['seconds'])
+        seconds += job['seconds']
+        items.append(item)
+    if seconds > disloccost.MAXSECONDS:
+        return jsonify({"status":"failed","error": "batch too large: %.0f s predicted" % seconds}), 413
+
+    args = dict(common, batch=items, timeout=timeout)
+    return jsonify(dislocjobs.status(dislocjobs.submit(args))), 202
+
+"""parameter sweep"""
+@app.route("/dislocservice/sweep")
+def sweep():
+    """ queue a parameter sweep of one input, run by the workers of
+        dislocjobs.py, see dislocsweep.py
+          /dislocservice/sweep?
+
+        Parameters:
+        --------------
+        input: emebed input file
+        slip, dip, depth, elevation, azimuth, radarfrequency: ranges,
+              start:stop:step, a,b,c or a value; slip scales the slip of
+              every fault, dip and depth are added to every fault
+        workers: runs at the same time, default: 2, at most
+                 dislocbatch.MAXPROCESSES
+        other parameters: those of /dislocservice/disloc for every run,
+              engine defaults to numpy
+
+        Returns:
+        --------------
+        json: job id, state and queue position, status 202; the result
+              of the job is the index of the variants with the urls of
+              their kmz and thumbnail; 400: bad input or range, 413: too
+              many variants, a run too large or all runs predicted over
+              disloccost.MAXSECONDS, 429: queue full
+    """
+
+    args = request.args.to_dict()
+    if "input" not in args:
+        return jsonify({"status":"failed","error": "input required!"}), 400
+    for key in LOCALKEYS + ['looks', 'response']:
+        args.pop(key, None)
+    args.setdefault('cache', 'true')
+
+    try:
+        fields = dislocsweep.ranges(args)
+    except ValueError as e:
+        return jsonify({"status":"failed","error": str(e)}), 400
+    try:
+        args['workers'] = str(dislocbatch.workers(args.get('workers', dislocbatch.PROCESSES)))
+    except ValueError:
+        return jsonify({"status":"failed","error": "bad workers: " + args['workers']}), 400
+    nlooks = 1
+    for key in dislocsweep.LOOKFIELDS:
+        nlooks *= len(fields[key])
+    nruns = 1
+    for key in dislocsweep.FAULTFIELDS:
+        nruns *= len(fields[key])
+    nvariants = nruns*nlooks
+    if nvariants > dislocsweep.MAXVARIANTS:
+        return jsonify({"status":"failed","error": "%d variants, at most %d" % (nvariants, dislocsweep.MAXVARIANTS)}), 413
+
+    # cost of one run: every look of one fault variant
+    run = {k: v for k, v in args.items() if k not in dislocsweep.FIELDS}
+    run.setdefault('engine', 'numpy')
+    run['looks'] = ";".join(["60,0,1.26"]*nlooks)
+    decision = disloccost.admit(args['input'], run, dislocjobs.queued())
+    if decision['lane'] == 'reject':
+        return rejected(decision)
+    job = decision['estimate']
+    if nruns*job['seconds'] > disloccost.MAXSECONDS:
+        return jsonify({"status":"failed","error": "sweep too large: %d runs, %.0f s predicted" % (nruns, nruns*job['seconds'])}), 413
+    args.update(sweep='true', timeout=max(job['timeout'], disloccost.SAFETY*job['seconds']))
+
+    info = dislocjobs.status(dislocjobs.submit(args))
+    info['variants'] = nvariants
+    return jsonify(info), 202
+
+@app.route("/dislocservice/status")
+def status():
+    """ state, queue position, stage and progress (0 ... 1) of a job
+          /dislocservice/status?job=[id]
+    """
+
+    info = dislocjobs.status(request.args.get('job', ''))
+    if info is None:
+        return jsonify({"status":"failed","error": "unknown job"}), 404
+    return jsonify(info)
+
+@app.route("/dislocservice/result")
+def result():
+    """ summary.json of a finished job, the job status (202) before
+          /dislocservice/result?job=[id]
+    """
+
+    jobid = request.args.get('job', '')
+    info = dislocjobs.status(jobid)
+    if info is None:
+        return jsonify({"status":"failed","error": "unknown job"}), 404
+    if info['state'] in ['queued', 'running']:
+        return jsonify(info), 202
+
+    summary = dislocjobs.result(jobid)
+    if summary['status'] not in ['success', 'partial']:
+        return jsonify(summary), 500
+    return jsonify(summary)
+
+"""result cache counters"""
+@app.route("/dislocservice/cache")
+def cache():
+    """ hits and misses of this process, entries and bytes of the cache """
+
+    return jsonify(disloccache.counters())
+
+"""metrics of the jobs of this host"""
+@app.route("/dislocservice/metrics")
+def metrics():
+    """ job, failure, timeout and cache counters and histograms of the
+        job and stage seconds, Prometheus text format
+    """
+
+    return Response(dislocmetrics.prometheus(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     pass
     # old method
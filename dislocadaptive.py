@@ -0,0 +1,191 @@
+"""
+    dislocadaptive.py
+        -- adaptive multiresolution evaluation of a disloc grid
+        -- starts with coarse cells over the line-2 grid and subdivides
+           them quadtree-style near fault traces and where the
+           displacement or the fringe rate is not resolved; the rest of
+           the grid is filled by bilinear interpolation, so the result is
+           the regular raster that SARImage.drawimage() expects
+
+    refinement tests for a cell (i0..i1, j0..j1 raster indices):
+        -- the cell is close to the surface projection of a fault
+        -- the centre value differs from the bilinear value of the
+           corners by more than disptol (displacement, output units)
+        -- with a look geometry: the corners span more than fringerate
+           fringe cycles, or the centre misses by more than fringetol
+"""
+
+import math
+import time
+
+import numpy as np
+
+import dislocengine
+
+# coarse cell size in raster points
+COARSE = 16
+
+
+def faultcentres(model):
+    """ centres (x, y) and radii of the surface projection of each fault """
+
+    centres = []
+    for item in model['faults']:
+        sa, ca, sd, cd, mat = dislocengine.faultgeometry(item)
+        # fault frame: along strike 0..length, across 0..width*cos(dip)
+        xf = float(item['length'])/2.0
+        yf = float(item['width'])*cd/2.0
+        x = float(item['x']) + xf*float(ca) + yf*float(sa)
+        y = float(item['y']) - xf*float(sa) + yf*float(ca)
+        centres.append([x, y, math.sqrt(xf*xf + yf*yf)])
+
+    return np.array(centres).reshape(-1, 3)
+
+
+def disloc(model, evaluator=None, coarse=COARSE, disptol=0.5, look=None,
+           fringerate=0.5, fringetol=0.05):
+    """ evaluate the model adaptively on its grid
+
+        look: (elevation, azimuth, radar wavelength in cm) to refine on the
+              fringe pattern, None for displacement only
+        same return value as dislocengine.disloc; stats also list the
+        number of evaluated points
+    """
+
+    if model['grid'] is None:
+        raise ValueError("adaptive grid needs a generated grid (gen=1)")
+    if evaluator is None:
+        evaluator = dislocengine.evaluate
+
+    starttime = time.time()
+    x0, dx, nx, y0, dy, ny = model['grid']
+    xrow = x0 + np.arange(nx, dtype=np.float32)*dx
+    ycol = y0 + np.arange(ny, dtype=np.float32)*dy
+
+    values = np.zeros((len(dislocengine.COMPONENTS), ny, nx))
+    done = np.zeros((ny, nx), dtype=bool)
+
+    def evaluatepoints(i, j):
+        """ evaluate raster points not done yet """
+        keep = ~done[j, i]
+        i, j = i[keep], j[keep]
+        flat = np.unique(j*nx + i)
+        if len(flat) == 0:
+            return
+        i, j = flat % nx, flat//nx
+        result = evaluator(model, xrow[i], ycol[j])
+        for k, name in enumerate(dislocengine.COMPONENTS):
+            values[k, j, i] = result[name]
+        done[j, i] = True
+
+    if look is not None:
+        g = dislocengine.lookvector(look[0], look[1])
+        wavelength = look[2]
+
+    def cycles(j, i):
+        """ fringe cycles at raster points """
+        losd = (g[0]*values[0, j, i] + g[1]*values[1, j, i] + g[2]*values[2, j, i])/5.0
+        return 2*losd/wavelength
+
+    centres = faultcentres(model)
+
+    # coarse cells
+    starts_i = np.arange(0, max(nx - 1, 1), coarse)
+    starts_j = np.arange(0, max(ny - 1, 1), coarse)
+    I0, J0 = [a.ravel() for a in np.meshgrid(starts_i, starts_j)]
+    I1 = np.minimum(I0 + coarse, nx - 1)
+    J1 = np.minimum(J0 + coarse, ny - 1)
+
+    leaves = []
+    while len(I0):
+        IM = (I0 + I1)//2
+        JM = (J0 + J1)//2
+        evaluatepoints(np.concatenate([I0, I1, I0, I1, IM]), np.concatenate([J0, J0, J1, J1, JM]))
+
+        splittable = (I1 - I0 > 1) | (J1 - J0 > 1)
+        refine = np.zeros(len(I0), dtype=bool)
+
+        # centre against the bilinear value of the corners
+        fi = np.where(I1 > I0, (IM - I0)/np.maximum(I1 - I0, 1), 0.0)
+        fj = np.where(J1 > J0, (JM - J0)/np.maximum(J1 - J0, 1), 0.0)
+        weights = [(1 - fi)*(1 - fj), fi*(1 - fj), (1 - fi)*fj, fi*fj]
+        corners = [(J0, I0), (J0, I1), (J1, I0), (J1, I1)]
+        for k in range(3):
+            guess = sum(w*values[k, j, i] for w, (j, i) in zip(weights, corners))
+            refine |= np.abs(values[k, JM, IM] - guess) > disptol
+
+        # fringe rate
+        if look is not None:
+            phase = [cycles(j, i) for j, i in corners]
+            spread = np.max(phase, axis=0) - np.min(phase, axis=0)
+            guess = sum(w*p for w, p in zip(weights, phase))
+            refine |= (spread > fringerate) | (np.abs(cycles(JM, IM) - guess) > fringetol)
+
+        # close to a fault trace
+        if len(centres):
+            cx = (xrow[I0].astype(np.float64) + xrow[I1])/2.0
+            cy = (ycol[J0].astype(np.float64) + ycol[J1])/2.0
+            halfdiag = 0.5*np.hypot(xrow[I1].astype(np.float64) - xrow[I0], ycol[J1].astype(np.float64) - ycol[J0])
+            for fx, fy, radius in centres:
+                refine |= np.hypot(cx - fx, cy - fy) < radius + halfdiag
+
+        refine &= splittable
+        keep = ~refine
+        leaves.append((I0[keep], I1[keep], J0[keep], J1[keep]))
+
+        # quadtree split of the refined cells, an axis with a single
+        # raster step is not split
+        I0, I1, J0, J1, IM, JM = [a[refine] for a in [I0, I1, J0, J1, IM, JM]]
+        widei = I1 - I0 > 1
+        widej = J1 - J0 > 1
+        halves_i = [(I0, np.where(widei, IM, I1), np.ones(len(I0), dtype=bool)), (IM, I1, widei)]
+        halves_j = [(J0, np.where(widej, JM, J1), np.ones(len(J0), dtype=bool)), (JM, J1, widej)]
+        children = []
+        for a0, a1, va in halves_i:
+            for b0, b1, vb in halves_j:
+                valid = va & vb
+                children.append((a0[valid], a1[valid], b0[valid], b1[valid]))
+        I0, I1, J0, J1 = [np.concatenate([c[n] for c in children]) for n in range(4)]
+
+    # bilinear fill of the raster from the leaf corners
+    owner = np.zeros((4, ny, nx), dtype=np.int64)
+    for A0, A1, B0, B1 in leaves:
+        for a0, a1, b0, b1 in zip(A0, A1, B0, B1):
+            owner[:, b0:b1 + 1, a0:a1 + 1] = np.array([a0, a1, b0, b1])[:, None, None]
+    A0, A1, B0, B1 = owner
+    jj, ii = np.mgrid[0:ny, 0:nx]
+    fi = np.where(A1 > A0, (ii - A0)/np.maximum(A1 - A0, 1), 0.0)
+    fj = np.where(B1 > B0, (jj - B0)/np.maximum(B1 - B0, 1), 0.0)
+
+    result = {"gridsize": [nx, ny], "grid": model['grid'], "lat": model['lat'],
+              "lon": model['lon'], "faults": model['faults']}
+    xo, yo = dislocengine.observationpoints(model)
+    result['x'], result['y'] = dislocengine.outputcoordinates(model, xo, yo)
+    for k, name in enumerate(dislocengine.COMPONENTS):
+        v = values[k]
+        fill = ((1 - fi)*(1 - fj)*v[B0, A0] + fi*(1 - fj)*v[B0, A1]
+                + (1 - fi)*fj*v[B1, A0] + fi*fj*v[B1, A1])
+        result[name] = np.where(done, v, fill).ravel()
+
+    seconds = time.time() - starttime
+    npatches = len(model['faults'])
+    evaluated = int(done.sum())
+    result['stats'] = {"split": "adaptive", "processes": 1, "patches": npatches,
+                       "points": nx*ny, "evaluated": evaluated, "seconds": seconds,
+                       "throughput": npatches*evaluated/seconds if seconds > 0 else 0.0}
+
+    return result
+
+
+def main():
+
+    # test case: regional grid around short faults
+    with open("test/4fault.txt") as f:
+        model = dislocengine.readinput(f.read())
+    look = (60.0, -5.0, 299792458.0/1.26e9*100.0)
+    result = disloc(model, look=look)
+    print(result['stats'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+    dislocbatch.py
+        -- the multiple-files workflow: many disloc inputs, each with its
+           own look parameters, run by a bounded pool of processes
+        -- every item runs dislocworkflow() in its own process and folder
+           [batch]/[name]; an item that fails, crashes or runs past its
+           timeout is recorded (its process group killed) and the batch
+           goes on with the next one
+        -- items are read and sized first (disloccost.py): an unreadable
+           input fails without a run, the timeout of an item is
+           proportional to its predicted seconds
+        -- [batch]/summary.json lists every item with its status, error,
+           seconds and outputs
+
+    manifest: a directory, every file in it is an input, or a text file
+    with one item per line, "path [key=value ...]", '#' starts a comment:
+        faults/4fault.txt azimuth=-5 elevation=45
+        faults/KO1.input looks=60,-5,1.26;30,175,5.405 engine=numpy
+    relative paths are relative to the manifest
+
+    usage:
+        python disloc_service.py multiple-files --manifest list.txt --workdir out -n 4
+        /dislocservice/batch (POST json), see disloc_service_API.py
+"""
+
+import os
+import json
+import time
+import signal
+import multiprocessing
+
+import disloccost
+
+# items run at the same time by default, and at most for the service
+PROCESSES = 2
+MAXPROCESSES = 8
+
+# items of a batch queued by the service
+MAXITEMS = 1000
+
+# longest seconds an item may run, disloc included
+ITEMTIMEOUT = 600
+
+# seconds between looks at the running items
+POLL = 0.1
+
+
+def readmanifest(manifest):
+    """ items of a manifest file or directory: dicts with name, inputfile
+        and the parameters of the item
+    """
+
+    items = []
+    if os.path.isdir(manifest):
+        for name in sorted(os.listdir(manifest)):
+            path = os.path.join(manifest, name)
+            if not name.startswith(".") and os.path.isfile(path):
+                items.append({"inputfile": os.path.abspath(path)})
+    else:
+        basedir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest) as f:
+            for number, line in enumerate(f, 1):
+                fields = line.split("#")[0].split()
+                if not fields:
+                    continue
+                item = {"inputfile": os.path.join(basedir, fields[0])}
+                for field in fields[1:]:
+                    key, sep, value = field.partition("=")
+                    if not sep or not key:
+                        raise ValueError("line %d: %s is not key=value" % (number, field))
+                    item[key] = value
+                items.append(item)
+
+    return nameitems(items)
+
+
+def nameitems(items):
+    """ unique folder names of the items, from name or the input file """
+
+    names = set()
+    named = []
+    for number, item in enumerate(items, 1):
+        item = dict(item)
+        base = item.get('name') or os.path.splitext(os.path.basename(item.get('inputfile', '')))[0] or "item%d" % number
+        base = "".join(c if c.isalnum() or c in "-_." else "_" for c in str(base)).lstrip(".") or "item%d" % number
+        name, k = base, 1
+        while name in names:
+            k += 1
+            name = "%s_%d" % (base, k)
+        names.add(name)
+        item['name'] = name
+        named.append(item)
+    return named
+
+
+def runitem(args, itemdir, timeout):
+    """ one item, in its own process: the workflow writes summary.json
+        when it succeeds, the failed status or the exception is written
+        there otherwise
+    """
+
+    # the item and everything it starts are killed together on timeout
+    os.setpgid(0, 0)
+    from disloc_exec import dislocworkflow
+
+    try:
+        status = dislocworkflow(args, timeout=timeout)
+    except Exception as e:
+        status = {"status": "failed", "error": str(e)}
+    summaryfile = itemdir + os.path.sep + "summary.json"
+    if status.get('status') != 'success' or not os.path.exists(summaryfile):
+        with open(summaryfile, "w") as f:
+            f.write(json.dumps(status, indent=4, default=str))
+
+
+def size(item, common):
+    """ workflow arguments and timeout of an item, from the cost
+        estimate of its input; raises ValueError for an unreadable input
+    """
+
+    args = dict(common)
+    args.update({k: v for k, v in item.items() if k != 'name'})
+    try:
+        if 'input' in args:
+            text = args['input']
+        else:
+            with open(args['inputfile']) as f:
+                text = f.read()
+        job = disloccost.estimate(text, args)
+    except (OSError, KeyError, IndexError) as e:
+        raise ValueError(str(e))
+    return args, max(job['timeout'], disloccost.SAFETY*job['seconds'])
+
+
+def collect(itemdir, exitcode):
+    """ status of a finished item from its summary.json """
+
+    try:
+        with open(itemdir + os.path.sep + "summary.json") as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        summary = {"status": "failed", "error": "item exited with code %s" % exitcode}
+    return summary
+
+
+def batch(items, outputdir, common=None, processes=PROCESSES, timeout=ITEMTIMEOUT, progress=None, urls=False):
+    """ run the items, at most processes at a time, and write the
+        aggregate summary.json to outputdir
+
+        items: dicts with input (text) or inputfile and the parameters of
+               the item, over those of common; see readmanifest()
+        timeout: longest seconds of one item, each item gets the
+                 timeout of its cost estimate up to this
+        progress: function called with "items" and the fraction done
+        urls: outputs as urls of the static/ folder, names otherwise
+        returns the aggregate summary: status success (every item),
+        partial or failed (no item), the items and the totals
+    """
+
+    if progress is None:
+        progress = lambda stage, fraction: None
+    common = dict(common or {})
+    outputdir = os.path.abspath(outputdir)
+    os.makedirs(outputdir, exist_ok=True)
+    items = nameitems(items)
+
+    start = time.time()
+    results = [None]*len(items)
+    pending = []
+    sized = {}
+    for index, item in enumerate(items):
+        try:
+            args, itemtimeout = size(item, common)
+        except ValueError as e:
+            results[index] = {"name": item['name'], "status": "failed", "error": "bad input: " + str(e),
+                              "seconds": 0.0, "output": []}
+            continue
+        sized[index] = (args, min(itemtimeout, timeout))
+        pending.append(index)
+    running = {}
+    progress("items", 0.0)
+    while pending or running:
+        while pending and len(running) < processes:
+            index = pending.pop(0)
+            args, itemtimeout = sized[index]
+            itemdir = outputdir + os.path.sep + items[index]['name']
+            os.makedirs(itemdir, exist_ok=True)
+            args.update(api=True, workdir=itemdir)
+            process = multiprocessing.Process(target=runitem, args=(args, itemdir, itemtimeout))
+            process.start()
+            running[index] = (process, itemdir, time.time(), itemtimeout)
+
+        time.sleep(POLL)
+        for index, (process, itemdir, started, itemtimeout) in list(running.items()):
+            if process.is_alive():
+                if time.time() - started <= itemtimeout:
+                    continue
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except OSError:
+                    process.kill()
+                process.join()
+                summary = {"status": "failed", "error": "timeout"}
+            else:
+                process.join()
+                summary = collect(itemdir, process.exitcode)
+            del running[index]
+
+            name = items[index]['name']
+            output = [name + "/" + x for x in summary.get('output', [])]
+            results[index] = {"name": name, "status": summary.get('status', 'failed'),
+                              "error": summary.get('error', ''), "seconds": time.time() - started,
+                              "output": outputurls(output, outputdir) if urls else output}
+            progress("items", 1.0 - (len(pending) + len(running))/len(sized))
+
+    succeeded = len([x for x in results if x['status'] == 'success'])
+    timedout = len([x for x in results if x['error'] == 'timeout'])
+    if succeeded == len(results):
+        status = "success"
+    elif succeeded:
+        status = "partial"
+    else:
+        status = "failed"
+    summary = {"status": status,
+               "error": "" if status == "success" else "%d of %d items failed" % (len(results) - succeeded, len(results)),
+               "items": results,
+               "stats": {"items": len(results), "succeeded": succeeded, "failed": len(results) - succeeded,
+                         "timedout": timedout, "processes": processes, "seconds": time.time() - start}}
+    with open(outputdir + os.path.sep + "summary.json", "w") as f:
+        f.write(json.dumps(summary, indent=4))
+
+    return summary
+
+
+def workers(value):
+    """ processes of a batch asked for by the service, 1 ... MAXPROCESSES """
+
+    return max(1, min(int(value), MAXPROCESSES))
+
+
+def outputurls(names, outputdir):
+    """ urls of files of the item folders of a batch in static/ """
+
+    from disloc_exec import getURLprefix
+    return [getURLprefix() + os.path.basename(outputdir) + "/" + x for x in names]
+
+
+def batchworkflow(args, progress=None, timeout=ITEMTIMEOUT):
+    """ a batch queued by the service: args of dislocjobs.py with the
+        items in batch and the number of processes in workers (at most
+        MAXPROCESSES), outputs in a new static/ folder as urls
+    """
+
+    from disloc_exec import setoutputlocation
+
+    args = dict(args)
+    items = args.pop('batch')
+    processes = workers(args.pop('workers', PROCESSES))
+    args.pop('api', None)
+    return batch(items, setoutputlocation(), args, processes, timeout, progress, urls=True)
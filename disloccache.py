@@ -0,0 +1,252 @@
+"""
+    disloccache.py
+        -- content-addressed cache of workflow results
+        -- the key is a hash of the normalized input text (numbers as
+           floats, blank lines and spacing dropped) and of the parameters
+           that change the outputs, missing ones at their defaults
+        -- a hit links the cached files into the job folder and returns
+           the cached summary, nothing is computed
+        -- identical jobs are run once: the first one holds an flock on
+           [key].lock while it computes, the others wait for it and are
+           served from its entry
+
+    cache layout:
+        [cachedir]/[key]/summary.json   status of the run, outputs by name
+        [cachedir]/[key]/...            the files of the job folder
+        [cachedir]/[key].lock           lock file of the key, removed with
+                                        the entry
+
+    entries are removed least recently used first when the cache grows
+    beyond CACHESIZE bytes; hits and misses are counted per process
+"""
+
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import threading
+import contextlib
+
+CACHEDIR = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "cache" + os.path.sep + "results"
+
+# size bound of the cache in bytes
+CACHESIZE = 1024**3
+
+# parameters that change the outputs and their defaults; the others
+# (processes, split, stream) give the same files
+PARAMETERS = {"output": "output", "elevation": 60.0, "azimuth": 0.0, "radarfrequency": 1.26, "looks": "",
+              "engine": "binary", "greens": False, "adaptive": False, "farfield": False, "tolerance": "",
+              "outputformat": "npy", "products": "all", "palette": "uavsar", "renderer": "bilinear",
+              "imagescale": 8, "artifacts": "png,kml,kmz", "raster": False}
+
+FLAGS = ["greens", "adaptive", "farfield", "raster"]
+
+_counters = {"hits": 0, "misses": 0}
+_lock = threading.Lock()
+
+
+def normalize(text):
+    """ input text with numbers as floats, one space between fields """
+
+    lines = []
+    for line in text.splitlines():
+        fields = []
+        for field in line.split():
+            try:
+                fields.append(repr(float(field)))
+            except ValueError:
+                fields.append(field)
+        if fields:
+            lines.append(" ".join(fields))
+    return "\n".join(lines)
+
+
+def parameter(key, value):
+    """ normalized value of one parameter """
+
+    if key in FLAGS:
+        return value is True or str(value).lower() in ['1', 'true', 'yes']
+    if isinstance(PARAMETERS[key], float):
+        return float(value)
+    if isinstance(PARAMETERS[key], int):
+        return int(value)
+    if key == "looks":
+        return ";".join(",".join(repr(float(x)) for x in look.split(",") if x.strip())
+                        for look in str(value).split(";"))
+    return str(value).strip()
+
+
+def cachekey(inputtext, args):
+    """ sha1 of the normalized input and parameters """
+
+    params = dict((key, parameter(key, args.get(key, default))) for key, default in PARAMETERS.items())
+    # names in the summary: urls or plain file names
+    params['api'] = 'api' in args
+    h = hashlib.sha1(normalize(inputtext).encode())
+    h.update(json.dumps(params, sort_keys=True).encode())
+
+    return h.hexdigest()
+
+
+def count(kind):
+    """ add one to the hits or misses counter """
+
+    with _lock:
+        _counters[kind] += 1
+
+
+def counters(cachedir=CACHEDIR):
+    """ hits and misses of this process, entries and bytes of the cache """
+
+    with _lock:
+        stats = dict(_counters)
+    entries = listentries(cachedir)
+    stats['entries'] = len(entries)
+    stats['bytes'] = sum(size for mtime, size, path in entries)
+    return stats
+
+
+def linkfiles(source, target, names):
+    """ hard link (copy across file systems) files from source to target """
+
+    for name in names:
+        src = source + os.path.sep + name
+        dst = target + os.path.sep + name
+        if not os.path.isfile(src):
+            continue
+        if os.path.lexists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+
+def lookup(entry, outputdir):
+    """ cached summary with its files linked into outputdir, None on a miss """
+
+    try:
+        with open(entry + os.path.sep + "summary.json") as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    linkfiles(entry, outputdir, [name for name in os.listdir(entry) if name != "summary.json"])
+    # mark as recently used for the eviction
+    os.utime(entry)
+    return status
+
+
+def insert(entry, outputdir, status):
+    """ copy the job files and the summary into a new entry """
+
+    cachedir = os.path.dirname(entry)
+    tmpdir = tempfile.mkdtemp(dir=cachedir, suffix=".tmp")
+    try:
+        names = [name for name in os.listdir(outputdir) if name != "summary.json"]
+        linkfiles(outputdir, tmpdir, names)
+        with open(tmpdir + os.path.sep + "summary.json", "w") as f:
+            f.write(json.dumps(status, indent=4))
+        if os.path.exists(entry):
+            shutil.rmtree(entry)
+        os.replace(tmpdir, entry)
+    except BaseException:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+
+
+def listentries(cachedir=CACHEDIR):
+    """ (mtime, bytes, path) of every entry """
+
+    entries = []
+    if not os.path.isdir(cachedir):
+        return entries
+    for name in os.listdir(cachedir):
+        path = cachedir + os.path.sep + name
+        if name.endswith(".lock") or name.endswith(".tmp") or not os.path.isdir(path):
+            continue
+        try:
+            size = sum(os.stat(path + os.path.sep + item).st_size for item in os.listdir(path))
+            entries.append((os.stat(path).st_mtime, size, path))
+        except OSError:
+            continue
+    return entries
+
+
+def evict(cachedir=CACHEDIR, maxbytes=CACHESIZE):
+    """ remove least recently used entries until the cache fits maxbytes,
+        entries locked by a running job are kept
+    """
+
+    entries = listentries(cachedir)
+    total = sum(size for mtime, size, path in entries)
+    removed = 0
+    for mtime, size, path in sorted(entries):
+        if total <= maxbytes:
+            break
+        with open(path + ".lock", "a") as lockfile:
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            os.unlink(path + ".lock")
+        total -= size
+        removed += 1
+
+    return removed
+
+
+@contextlib.contextmanager
+def lock(entry):
+    """ hold the lock file of an entry; evict() unlinks it with the
+        entry, a lock taken on the unlinked file is taken again
+    """
+
+    while True:
+        with open(entry + ".lock", "a") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                current = os.stat(entry + ".lock").st_ino == os.fstat(lockfile.fileno()).st_ino
+            except OSError:
+                current = False
+            if current:
+                yield
+                return
+
+
+def run(inputtext, args, outputdir, workflow, cachedir=CACHEDIR, maxbytes=CACHESIZE):
+    """ status of workflow() for the input and args, from the cache when
+        an identical job ran before
+
+        outputdir: absolute path of the job folder
+        workflow: function running the job, returns its status; only
+                  successful runs are cached
+        returns the status with "cache": {"key": key, "hit": bool}
+    """
+
+    try:
+        key = cachekey(inputtext, args)
+    except ValueError:
+        # bad parameters, the workflow reports them
+        return workflow()
+    entry = cachedir + os.path.sep + key
+    os.makedirs(cachedir, exist_ok=True)
+
+    # single flight: one job per key computes, the others wait here
+    with lock(entry):
+        status = lookup(entry, outputdir) if os.path.isdir(entry) else None
+        if status is not None:
+            count("hits")
+            status['cache'] = {"key": key, "hit": True}
+            return status
+
+        count("misses")
+        status = workflow()
+        if status['status'] == 'success':
+            insert(entry, outputdir, status)
+
+    evict(cachedir, maxbytes)
+    status['cache'] = {"key": key, "hit": False}
+    return status
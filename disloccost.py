@@ -0,0 +1,199 @@
+"""
+    disloccost.py
+        -- cost model of a workflow job and admission control
+        -- a job is sized from its input: points of the grid (or the
+           point list), fault patches weighted by type (point sources
+           cost less than finite faults), looks and image pixels
+        -- seconds and peak memory are predicted with per-host
+           coefficients: seconds per point-patch of each engine, seconds
+           per image pixel and bytes per point, kept in
+           cache/cost-[host].json and moved towards every completed run
+
+    admission:
+        small   predicted within SMALLSECONDS, run in the request
+        large   run by the dislocjobs.py workers
+        reject  413 beyond MAXSECONDS or MAXMEMORY, 429 when the lane is
+                full; 400 when the input cannot be read or the engine is
+                unknown
+    the timeout of the disloc run is SAFETY times its prediction, at
+    least MINTIMEOUT
+"""
+
+import os
+import json
+import fcntl
+import socket
+import resource
+import tempfile
+import threading
+
+import dislocengine
+
+COSTFILE = (os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "cache" + os.path.sep
+            + "cost-" + socket.gethostname() + ".json")
+
+# coefficients before the first run, measured with test/4fault.txt on a
+# 801 x 401 grid
+DEFAULTS = {"overhead": 0.2, "disloc": {"binary": 2.6e-6, "numpy": 2.8e-6, "library": 2.1e-6},
+            "image": 1.5e-7, "memory": 600.0, "runs": 0}
+
+# cost of a point source relative to a finite fault
+TYPEWEIGHT = {0: 0.3, 1: 1.0}
+
+# weight of a completed run in the coefficients
+LEARNRATE = 0.2
+
+# predicted seconds of a job run in the request, and its longest timeout
+SMALLSECONDS = 10.0
+SMALLTIMEOUT = 15.0
+
+# limits of any job
+MAXSECONDS = 1800.0
+MAXMEMORY = 8*1024**3
+
+# jobs running in the requests of one process, queued large jobs
+MAXRUNNING = 4
+MAXQUEUED = 32
+
+# timeout of the disloc run: SAFETY times its prediction, at least MINTIMEOUT
+SAFETY = 3.0
+MINTIMEOUT = 5.0
+
+_lock = threading.Lock()
+_running = 0
+
+
+def coefficients(costfile=COSTFILE):
+    """ coefficients of this host, DEFAULTS before the first run """
+
+    try:
+        with open(costfile) as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return json.loads(json.dumps(DEFAULTS))
+    merged = json.loads(json.dumps(DEFAULTS))
+    merged.update(stored)
+    merged['disloc'] = dict(DEFAULTS['disloc'], **stored.get('disloc', {}))
+    return merged
+
+
+def size(inputtext, args):
+    """ grid, points, fault patches, weighted point-patches, looks and
+        pixels of a job; the points of a station job are its stations
+    """
+
+    model = dislocengine.readinput(inputtext)
+    if 'stations' in args:
+        # predictions at the stations, no image
+        npts = len([line for line in str(args['stations']).splitlines() if len(line.split()) >= 2])
+    elif model['grid'] is None:
+        npts = len(model['xo'])
+    else:
+        npts = model['grid'][2]*model['grid'][5]
+    units = npts*sum(TYPEWEIGHT.get(item['type'], 0.0) for item in model['faults'])
+    looks = len([look for look in str(args.get('looks', '')).split(";") if look.strip()]) or 1
+    scale = float(args.get('imagescale', 8))
+    pixels = 0 if args.get('products') == 'strain' or 'stations' in args else npts*scale*scale*looks
+
+    return {"grid": dislocengine.gridsize(model), "points": npts, "faults": len(model['faults']), "units": units,
+            "looks": looks, "pixels": pixels}
+
+
+def estimate(inputtext, args, costfile=COSTFILE):
+    """ size, predicted seconds (disloc run, images, total) and peak bytes """
+
+    engine = args.get('engine', 'binary')
+    if engine not in DEFAULTS['disloc']:
+        raise ValueError("unknown engine: " + str(engine))
+    job = size(inputtext, args)
+    coeff = coefficients(costfile)
+    job['disloc'] = coeff['disloc'][engine]*job['units']
+    job['image'] = coeff['image']*job['pixels']
+    job['seconds'] = coeff['overhead'] + job['disloc'] + job['image']
+    job['memory'] = coeff['memory']*job['points']
+    job['timeout'] = max(MINTIMEOUT, SAFETY*(coeff['overhead'] + job['disloc']))
+    return job
+
+
+def admit(inputtext, args, queued=0, costfile=COSTFILE):
+    """ lane of a job: {"lane": small, large or reject, "code": http status,
+        "error", "estimate"}
+
+        queued: large jobs waiting in the queue
+    """
+
+    if args.get('engine', 'binary') not in DEFAULTS['disloc']:
+        return {"lane": "reject", "code": 400, "error": "unknown engine: " + str(args.get('engine'))}
+    try:
+        job = estimate(inputtext, args, costfile)
+    except (ValueError, IndexError) as e:
+        return {"lane": "reject", "code": 400, "error": "bad input: " + str(e)}
+
+    decision = {"estimate": job}
+    if job['seconds'] > MAXSECONDS or job['memory'] > MAXMEMORY:
+        decision.update(lane="reject", code=413,
+                        error="job too large: %.0f s, %.0f MB predicted" % (job['seconds'], job['memory']/1024**2))
+    elif job['seconds'] <= SMALLSECONDS:
+        job['timeout'] = min(job['timeout'], SMALLTIMEOUT)
+        decision.update(lane="small", code=200)
+    elif queued >= MAXQUEUED:
+        decision.update(lane="reject", code=429, error="large job queue full, retry later")
+    else:
+        decision.update(lane="large", code=202)
+    return decision
+
+
+def acquire():
+    """ take a place in the small lane of this process, False when full """
+
+    global _running
+
+    with _lock:
+        if _running >= MAXRUNNING:
+            return False
+        _running += 1
+        return True
+
+
+def release():
+    """ leave the small lane """
+
+    global _running
+
+    with _lock:
+        _running -= 1
+
+
+def peakmemory():
+    """ peak resident bytes of this process """
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+
+def learn(job, engine, disloc=None, image=None, memory=None, costfile=COSTFILE):
+    """ move the coefficients towards the seconds and bytes of a run
+
+        job: size() of the run; disloc, image: seconds of the steps;
+        memory: growth of the peak resident bytes during the run
+    """
+
+    os.makedirs(os.path.dirname(costfile), exist_ok=True)
+    with open(costfile + ".lock", "a") as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        coeff = coefficients(costfile)
+        if disloc is not None and job['units'] > 0:
+            old = coeff['disloc'].get(engine, DEFAULTS['disloc']['numpy'])
+            coeff['disloc'][engine] = old + LEARNRATE*(disloc/job['units'] - old)
+        if image is not None and job['pixels'] > 0:
+            coeff['image'] += LEARNRATE*(image/job['pixels'] - coeff['image'])
+        # the peak only grows: a job below it gives no sample
+        if memory and job['points'] > 0:
+            coeff['memory'] += LEARNRATE*(memory/job['points'] - coeff['memory'])
+        coeff['runs'] += 1
+
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(costfile), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(json.dumps(coeff, indent=4))
+        os.replace(tmpname, costfile)
+
+    return coeff
@@ -0,0 +1,772 @@
+"""
+    dislocengine.py
+        -- in-process disloc engine: Okada (1985) surface deformation with NumPy
+        -- same point()/fault()/chin() math as disloc.c, evaluated on whole
+           arrays of observation points instead of one point at a time
+
+    usage:
+        model = readinput(open("test/4fault.txt").read())
+        result = disloc(model)
+        writeoutput(result, "4fault.csv")
+        writeoutput(result, "4fault.npy", dtype=np.float32)
+
+    result['stats']['throughput'] is the evaluation rate in patches*points
+    per second, for sizing hardware
+"""
+
+import os
+import math
+import time
+import multiprocessing
+
+import numpy as np
+
+# disloc.c keeps coordinates and fault parameters in single precision
+f32 = np.float32
+
+# column names of the disloc output table
+COMPONENTS = ["ux", "uy", "uz", "exx", "exy", "eyy"]
+
+# fault record fields, in input file order
+FAULTFIELDS = ["x", "y", "strike", "type", "depth", "dip", "lambda", "mu",
+               "u1", "u2", "u3", "length", "width"]
+
+# points evaluated per block, bounds the size of the temporaries
+BLOCKSIZE = 65536
+
+# products a run can be asked for and the columns they fill; los is the
+# displacement projected on the look vector, strains are skipped for
+# displacement and los, displacements for strain
+PRODUCTS = {"all": COMPONENTS,
+            "displacement": ["ux", "uy", "uz"],
+            "strain": ["exx", "exy", "eyy"],
+            "los": ["los"]}
+
+# code of the products in the binary header
+PRODUCTCODES = ["all", "displacement", "strain", "los"]
+
+# first row of the binary (.npy) output table, the rows after it are
+# x, y, ux, uy, uz, exx, exy, eyy as in the text table.  A table with fewer
+# columns (products other than all) spreads the header and a ninth field,
+# the product code, over as many rows as needed
+HEADERFIELDS = ["nx", "ny", "lat", "lon", "x0", "dx", "y0", "dy"]
+
+
+def readinput(text):
+    """ parse disloc input text into a model dict
+
+        tokens are read in the same order as the fscanf calls in disloc.c,
+        line breaks are not significant
+    """
+
+    tokens = text.split()
+
+    try:
+        model = {}
+        model['lat'] = f32(tokens[0])
+        model['lon'] = f32(tokens[1])
+        model['genparm'] = int(tokens[2])
+        pos = 3
+
+        if model['genparm'] == 0:
+            # scatter points: number of points, then x y pairs
+            npoints = int(tokens[pos])
+            pos += 1
+            if len(tokens) < pos + 2*npoints:
+                raise ValueError("unexpected end of disloc input")
+            points = np.array(tokens[pos:pos + 2*npoints], dtype=np.float64).astype(f32)
+            model['xo'] = points[0::2]
+            model['yo'] = points[1::2]
+            model['grid'] = None
+            pos += 2*npoints
+        else:
+            # grid: x0, dx, nx, y0, dy, ny
+            x0, dx, nx, y0, dy, ny = tokens[pos:pos + 6]
+            model['grid'] = [f32(x0), f32(dx), int(nx), f32(y0), f32(dy), int(ny)]
+            pos += 6
+
+        faults = []
+        while pos < len(tokens):
+            record = tokens[pos:pos + 13]
+            if len(record) < 13:
+                raise ValueError("incomplete fault record in disloc input")
+            fault = dict(zip(FAULTFIELDS, [f32(x) for x in record]))
+            fault['type'] = int(record[3])
+            faults.append(fault)
+            pos += 13
+        model['faults'] = faults
+    except (IndexError, ValueError) as e:
+        raise ValueError("bad disloc input: " + str(e))
+
+    return model
+
+
+def gridsize(model):
+    """ return [nx, ny] of the observation points """
+
+    if model['grid'] is None:
+        return [len(model['xo']), 1]
+    return [model['grid'][2], model['grid'][5]]
+
+
+def observationpoints(model):
+    """ return observation points (x, y) in km as flat float32 arrays
+
+        grid points are generated row by row (y outer, x inner) with the
+        same single precision arithmetic as disloc.c
+    """
+
+    if model['grid'] is None:
+        return model['xo'], model['yo']
+
+    x0, dx, nx, y0, dy, ny = model['grid']
+    xrow = x0 + np.arange(nx, dtype=f32)*dx
+    ycol = y0 + np.arange(ny, dtype=f32)*dy
+    xo = np.tile(xrow, ny)
+    yo = np.repeat(ycol, nx)
+
+    return xo, yo
+
+
+def faultgeometry(fault):
+    """ return the rotation and elastic constants of one fault
+
+        sa, ca are stored in single precision as in disloc.c
+    """
+
+    pi = math.pi
+    sa = f32(math.sin(pi*(float(fault['strike']) - 90.0)/180.0))
+    ca = f32(math.cos(pi*(float(fault['strike']) - 90.0)/180.0))
+    cd = math.cos(float(fault['dip'])*pi/180.0)
+    if abs(cd) <= 1.0e-08:
+        cd = 0.0
+    sd = math.sin(float(fault['dip'])*pi/180.0)
+    mat = float(fault['mu']/(fault['lambda'] + fault['mu']))
+
+    return sa, ca, sd, cd, mat
+
+
+def transform(e, sa, ca):
+    """ rotate strain partials back to the map system, see transform() in disloc.c """
+
+    sa = float(sa)
+    ca = float(ca)
+    # ca*ca - sa*sa is single precision arithmetic in disloc.c
+    cs = float(f32(ca)*f32(ca) - f32(sa)*f32(sa))
+    epr = [None]*12
+    for n in range(0, 12, 4):
+        exy = .5*(e[n+1] + e[n+2])
+        epr[n] = e[n]*ca*ca + e[n+3]*sa*sa + 2.0*exy*sa*ca
+        epr[n+1] = -(e[n] - e[n+3])*sa*ca + exy*cs - 0.5*(e[n+2] - e[n+1])
+        epr[n+2] = 2.0*(e[n+3] - e[n])*sa*ca + 2.0*exy*cs - epr[n+1]
+        epr[n+3] = e[n]*sa*sa + e[n+3]*ca*ca - (e[n+1] + e[n+2])*sa*ca
+    return epr
+
+
+def point(x, y, fault, sd, cd, mat, sa, ca, displacements=True, strains=True):
+    """ point source, returns (dis, str) lists of three arrays, None for a
+        part that is not asked for
+    """
+
+    pi = math.pi
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    d = float(fault['depth'])
+    sa = float(sa)
+    ca = float(ca)
+
+    r = np.sqrt(x*x + y*y + d*d)
+    p = ((y*cd) + (d*sd))
+    q = ((y*sd) - (d*cd))
+    temp = float(fault['length']*fault['width'])/(2.0*pi)
+    r3 = r*r*r
+    r5 = r*r*r*r*r
+    rd = r + d
+    rd3 = rd*rd*rd
+    rd4 = rd*rd*rd*rd
+    t1 = -float(fault['u1'])*temp
+    t2 = -float(fault['u2'])*temp
+    t3 = float(fault['u3'])*temp
+
+    dis = None
+    if displacements:
+        # surface displacements
+        i01 = mat*y*((1.0/(r*(r+d)*(r+d)))-(x*x*(3.0*r+d)/(r3*(r+d)*(r+d)*(r+d))))
+        i02 = mat*x*((1.0/(r*(r+d)*(r+d)))-(y*y*(3.0*r+d)/(r3*(r+d)*(r+d)*(r+d))))
+        i03 = mat*(x/(r3)) - i02
+        i04 = mat*(-x*y*(2.0*r+d)/(r3*(r+d)*(r+d)))
+        i05 = mat*((1.0/(r*(r+d)))-(x*x*(2.0*r+d)/(r3*(r+d)*(r+d))))
+
+        u011 = t1*(3.0*x*x*q/(r5) + i01*sd)
+        u021 = t1*(3.0*x*y*q/(r5) + i02*sd)
+        u031 = t1*(3.0*x*d*q/(r5) + i04*sd)
+        u012 = t2*(3.0*x*p*q/(r5) - i03*sd*cd)
+        u022 = t2*(3.0*y*p*q/(r5) - i01*sd*cd)
+        u032 = t2*(3.0*d*p*q/(r5) - i05*sd*cd)
+        u013 = t3*(3.0*x*q*q/(r5) - i03*sd*sd)
+        u023 = t3*(3.0*y*q*q/(r5) - i01*sd*sd)
+        u033 = t3*(3.0*d*q*q/(r5) - i05*sd*sd)
+        up11 = u011*ca + u021*sa
+        up21 = -u011*sa + u021*ca
+        up12 = u012*ca + u022*sa
+        up22 = -u012*sa + u022*ca
+        up13 = u013*ca + u023*sa
+        up23 = -u013*sa + u023*ca
+
+        dis = [up11 + up12 + up13, up21 + up22 + up23, u031 + u032 + u033]
+
+    strain = None
+    if strains:
+        # strains
+        jnk = (5.0*r*r + 4.0*r*d + d*d)/(r5*rd4)
+        j01 = mat*((-3.0*x*y*(3.0*r+d)/(r3*rd3)) + (3.0*x*x*x*y*jnk))
+        j02 = mat*((1.0/r3) - (3.0/(r*rd*rd)) + 3.0*x*x*y*y*jnk)
+        j03 = mat*((1.0/r3) - (3.0*x*x/r5)) - j02
+        j04 = mat*(-3.0*x*y/r5) - j01
+        s = p*sd + q*cd
+
+        e0 = [None]*12
+        e0[0] = t1*((3.0*x*q/r5)*(2.0-5.0*x*x/(r*r))+j01*sd)
+        e0[1] = t1*(-15.0*x*x*y*q/(r5*r*r)+(3.0*x*x/r5+j02)*sd)
+        e0[2] = t1*((3.0*y*q/r5)*(1.0-5.0*x*x/(r*r))+j02*sd)
+        e0[3] = t1*((3.0*x*q/r5)*(1.0-5.0*y*y/(r*r))+(3.0*x*y/r5+j04)*sd)
+        e0[4] = t2*((3.0*p*q/r5)*(1.0-5.0*x*x/(r*r))-j03*sd*cd)
+        e0[5] = t2*((3.0*x/r5)*(s-(5.0*y*p*q)/(r*r))-j01*sd*cd)
+        e0[6] = t2*((-15.0*x*y*p*q/(r5*r*r))-j01*sd*cd)
+        e0[7] = t2*((3.0*p*q/r5)*(1.0-5.0*y*y/(r*r))+3.0*y*s/r5-j02*sd*cd)
+        e0[8] = t3*((3.0*q*q/r5)*(1.0-5.0*x*x/(r*r))-j03*sd*sd)
+        e0[9] = t3*((3.0*x*q/r5)*(2.0*sd-5.0*y*q/(r*r))-j01*sd*sd)
+        e0[10] = t3*((-15.0*x*y*q*q/(r5*r*r))-j01*sd*sd)
+        e0[11] = t3*((3.0*q/r5)*(q+2.0*y*sd-5.0*y*y*q/(r*r))-j02*sd*sd)
+        e0pr = transform(e0, sa, ca)
+
+        strain = [e0pr[0] + e0pr[4] + e0pr[8],
+                  0.5*(e0pr[1] + e0pr[2] + e0pr[5] + e0pr[6] + e0pr[9] + e0pr[10]),
+                  e0pr[3] + e0pr[7] + e0pr[11]]
+
+    return dis, strain
+
+
+def chin(y, fault, sd, cd, mat, xi, eta, displacements=True, strains=True):
+    """ one corner term of the finite fault, returns (up, ep) lists of arrays,
+        None for a part that is not asked for
+
+        up[6] is never assigned in disloc.c; its four corner terms cancel,
+        so it is returned as zero.  Only the strain parts ep[0..11] that
+        reach the output are computed, the tilts are skipped.
+    """
+
+    pi = math.pi
+    twopi = 2.0*pi
+    d = float(fault['depth'])
+    p = ((y*cd) + (d*sd))
+    q = ((y*sd) - (d*cd))
+    yt = eta*cd + q*sd
+    dt = eta*sd - q*cd
+    rr = np.sqrt(xi*xi + eta*eta + q*q)
+    xx = np.sqrt(xi*xi + q*q)
+    mat2 = mat/2.0
+    t1 = -float(fault['u1'])/twopi
+    t2 = -float(fault['u2'])/twopi
+    t3 = float(fault['u3'])/twopi
+    rdt = rr + dt
+    rdt2 = rdt*rdt
+    xi2 = xi*xi
+    xi3 = xi*xi*xi
+    rr3 = rr*rr*rr
+    rpe = rr*(rr+eta)
+
+    # flags for denominator factors that might be near-zero
+    srpe = np.abs(rr+eta) <= 1.0e-08
+    srpx = np.abs(rr+xi) <= 1.0e-08
+    srdt = np.abs(rdt) <= 1.0e-08
+    sqt = np.abs(q) <= 1.0e-08
+    # disloc.c tests q for the rr flag as well
+    srr = sqt
+    rz = np.abs(rr) <= 1.0e-8
+
+    up = None
+    if displacements:
+        # displacement parts
+        at = np.where(sqt | srr, 0.0, np.arctan((xi*eta)/(q*rr)))
+        lg = np.where(srr, 0.0, np.where(srpe, -np.log(rr - eta), np.log(rr + eta)))
+        lgprime = np.where(srr, 0.0, np.where(srdt, -np.log(rr - dt), np.log(rr + dt)))
+
+        if cd == 0.0:
+            # point at fault corner can generate rdt2 == 0
+            i1 = np.where(srdt, 0.0, -mat2*xi*q/rdt2)
+            i3 = np.where(srdt, mat2*(-lg), mat2*(eta/rdt+yt*q/rdt2-lg))
+            i4 = np.where(srdt, 0.0, -mat*q/rdt)
+            i5 = np.where(srdt, 0.0, -mat*xi*sd/(rr+dt))
+            i2 = mat*(-lg) - i3
+        else:
+            jnk = np.where((np.abs(xi) <= 1.0e-08) | (np.abs(rr+xx) <= 1.0e-08), 0.0,
+                           (eta*(xx+q*cd)+xx*(rr+xx)*sd)/(xi*(rr+xx)*cd))
+            i5 = (mat*2.0/cd)*np.arctan(jnk)
+            i4 = mat*(1.0/cd)*(lgprime - sd*lg)
+            i3 = mat*((1.0/cd)*yt/rdt-lg) + sd*i4/cd
+            i2 = mat*(-lg) - i3
+            i1 = mat*(((-1.0)/cd)*(xi/rdt)) - sd*i5/cd
+
+        up = [None]*9
+        longe = ~srpe & ~srr
+        longx = ~srpx & ~srr
+        up[0] = np.where(longe, t1*((xi*q)/(rr*(rr+eta))+at+i1*sd), t1*(at+i1*sd))
+        up[1] = np.where(longe, t1*((yt*q)/(rr*(rr+eta))+(q*cd)/(rr+eta)+i2*sd), t1*(i2*sd))
+        up[2] = np.select([longe, ~srpe & srr],
+                          [t1*((dt*q)/(rr*(rr+eta))+(q*sd)/(rr+eta)+i4*sd), t1*((q*sd)/(rr+eta)+i4*sd)],
+                          t1*(i4*sd))
+        up[3] = np.select([~srr, ~srpe],
+                          [t2*(q/rr - i3*sd*cd), t2*(-i3*sd*cd)],
+                          -t2*i3*sd*cd)
+        up[4] = np.where(longx, t2*((yt*q)/(rr*(rr+xi))+cd*at-i1*sd*cd), t2*(cd*at-i1*sd*cd))
+        up[5] = np.where(longx, t2*((dt*q)/(rr*(rr+xi))+sd*at-i5*sd*cd), t2*(sd*at-i5*sd*cd))
+        up[6] = np.zeros_like(xi)
+        up[7] = np.select([srr | (srpe & srpx), ~srpe & ~srpx, ~srpe],
+                          [t3*(sd*at-i1*sd*sd),
+                           t3*((-dt*q)/(rr*(rr+xi))-sd*((xi*q)/(rr*(rr+eta))-at)-i1*sd*sd),
+                           t3*(-sd*((xi*q)/(rr*(rr+eta))-at)-i1*sd*sd)],
+                          t3*((-dt*q)/(rr*(rr+xi))+sd*at-i1*sd*sd))
+        up[8] = np.select([srr | (srpe & srpx), ~srpe & ~srpx, ~srpe],
+                          [t3*(-cd*at-i5*sd*sd),
+                           t3*((yt*q)/(rr*(rr+xi))+cd*((xi*q)/(rr*(rr+eta))-at)-i5*sd*sd),
+                           t3*(cd*((xi*q)/(rr*(rr+eta))-at)-i5*sd*sd)],
+                          t3*((yt*q)/(rr*(rr+xi))-cd*at-i5*sd*sd))
+
+    ep = None
+    if strains:
+        # strain parts
+        zero = np.zeros_like(xi)
+        axi = np.where(srpx, 0.0, (2.0*rr+xi)/(rr*rr*rr*(rr+xi)*(rr+xi)))
+        aeta = np.where(srpe, 0.0, (2.0*rr+eta)/(rr*rr*rr*(rr+eta)*(rr+eta)))
+        if cd != 0.0:
+            # exact test is allowed because close cd was set exactly 0 earlier
+            k3 = np.select([~srdt & ~srr, srdt & ~srr],
+                           [(mat/cd*(q/(rr*(rr+eta))-yt/(rr*rdt))), (mat/cd*(q/(rr*(rr+eta))))],
+                           zero)
+            k1 = np.select([~srdt & ~srr, srdt & ~srr],
+                           [(mat*xi/cd*(1.0/(rr*rdt)-sd/(rr*(rr+eta)))), (mat*xi/cd*(-sd/(rr*(rr+eta))))],
+                           zero)
+            j1 = np.select([~srdt & ~srr, ~srdt],
+                           [(mat/cd*(xi*xi/(rr*rdt2)-1.0/rdt)-sd*k3/cd), (mat/cd*(-1.0/rdt) - sd*k3/cd)],
+                           (-sd*k3/cd))
+            j2 = np.where(~srdt & ~srr, (mat/cd*(xi*yt/(rr*rdt2))-sd*k1/cd), (-sd*k1/cd))
+        else:
+            k3 = np.select([~srdt & ~srr, ~srdt & srr, srdt & ~srr],
+                           [mat*sd/rdt*(xi*xi/(rr*rdt) - 1.0), mat*sd/rdt*(-1.0), -1.0 + zero],
+                           zero)
+            k1 = np.where(~srdt & ~srr, mat*xi*q/(rr*rdt2), zero)
+            j1 = np.select([~srdt & ~srr, ~srdt],
+                           [(mat2*q/rdt2*(2.0*xi*xi/(rr*rdt)-1.0)), (mat2*q/rdt2*(-1.0))],
+                           zero)
+            j2 = np.select([~srdt & ~srr, ~srdt],
+                           [(mat2*xi*sd/rdt2*(2.0*q*q/(rr*rdt)-1.0)), (mat2*xi*sd/rdt2*(-1.0))],
+                           zero)
+        k2 = np.where(srr, -k3, np.where(srpe, (mat*(-sd/rr)-k3), (mat*(-sd/rr + q*cd/(rr*(rr+eta)))-k3)))
+        j3 = np.where(srr | srpe, -j2, (mat*(-xi/(rr*(rr+eta)))-j2))
+        j4 = np.select([srr, srpe],
+                       [-j1, (mat*(-cd/rr)-j1)],
+                       (mat*(-cd/rr-q*sd/(rr*(rr+eta)))-j1))
+        axi = np.where(srr, 0.0, axi)
+        aeta = np.where(srr, 0.0, aeta)
+
+        ep = [None]*12
+        both = srpe & srpx
+        eq0 = np.abs(eta*eta+q*q) <= 1.0e-8
+        ep[0] = -t1*(xi2*q*aeta-j1*sd)
+        ep[1] = np.select([rz & ~(both & eq0), eq0],
+                          [-(xi3*aeta+j2)*sd, -t1*(-(xi3*aeta+j2)*sd)],
+                          -t1*(xi3*dt/(rr3*(eta*eta+q*q))-(xi3*aeta+j2)*sd))
+        ep[2] = np.where(rz, (xi*q*q*aeta-j2)*sd, -t1*(xi*q*cd/rr3+(xi*q*q*aeta-j2)*sd))
+        ep[3] = np.select([rz, ~srpe],
+                          [-t1*((q*q*q*aeta*sd - j4)*sd),
+                           -t1*(yt*q*cd/rr3 + (q*q*q*aeta*sd - 2.0*q*sd/rpe - (xi2 + (eta*eta))*cd/rr3 - j4)*sd)],
+                          -t1*(yt*q*cd/rr3 + (q*q*q*aeta*sd - (xi2 + (eta*eta))*cd/rr3 - j4)*sd))
+        ep[4] = np.where(rz, -t2*j3*sd*cd, -t2*(xi*q/rr3+j3*sd*cd))
+        ep[5] = np.where(rz, -t2*(j1*sd*cd), -t2*(yt*q/rr3-sd/rr+j1*sd*cd))
+        ep[6] = np.select([~srpe, rz],
+                          [-t2*(yt*q/rr3+q*cd/rpe+j1*sd*cd), -t2*(j1*sd*cd)],
+                          -t2*(yt*q/rr3+j1*sd*cd))
+        ep[7] = np.select([~srpe & ~srpx & ~rz, ~srpe, ~srpx & ~rz],
+                          [-t2*(yt*yt*q*axi-(2.0*yt/(rr*(rr+xi))+xi*cd/rpe)*sd+j2*sd*cd),
+                           -t2*(yt*yt*q*axi-(xi*cd/rpe)*sd+j2*sd*cd),
+                           -t2*(yt*yt*q*axi-(2.0*yt/(rr*(rr+xi)))*sd+j2*sd*cd)],
+                          -t2*(yt*yt*q*axi+j2*sd*cd))
+        ep[8] = -t3*(xi*q*q*aeta+j3*sd*sd)
+        ep[9] = -t3*(-xi2*q*aeta*sd+j1*sd*sd)
+        ep[10] = np.where(rz, -t3*(q*q*q*aeta*sd+j1*sd*sd), -t3*(q*q*cd/rr3+q*q*q*aeta*sd+j1*sd*sd))
+        ep[11] = np.where(~rz & ~srpx,
+                          -t3*((yt*cd-dt*sd)*q*q*axi-q*2.0*sd*cd/(rr*(rr+xi))-(xi*q*q*aeta-j2)*sd*sd),
+                          -t3*((yt*cd-dt*sd)*q*q*axi-(xi*q*q*aeta-j2)*sd*sd))
+
+    return up, ep
+
+
+def fault(x, y, fault, sd, cd, mat, sa, ca, displacements=True, strains=True):
+    """ finite rectangular fault, returns (dis, str) lists of three arrays,
+        None for a part that is not asked for
+    """
+
+    p = y.astype(np.float64)*cd + float(fault['depth'])*sd
+    xd = x.astype(np.float64)
+    # data.x[j]-data.l is single precision arithmetic in disloc.c
+    xl = (x - fault['length']).astype(np.float64)
+    yd = y.astype(np.float64)
+    w = float(fault['width'])
+
+    u = [0.0]*9
+    e = [0.0]*12
+    for xi, eta, sign in [(xd, p, 1.0), (xd, p - w, -1.0), (xl, p, -1.0), (xl, p - w, 1.0)]:
+        up, ep = chin(yd, fault, sd, cd, mat, xi, eta, displacements, strains)
+        if sign > 0:
+            if displacements:
+                u = [a + b for a, b in zip(u, up)]
+            if strains:
+                e = [a + b for a, b in zip(e, ep)]
+        else:
+            if displacements:
+                u = [a - b for a, b in zip(u, up)]
+            if strains:
+                e = [a - b for a, b in zip(e, ep)]
+
+    sa = float(sa)
+    ca = float(ca)
+    dis = None
+    if displacements:
+        u = [np.where(np.abs(ui) <= 1.0e-08, 0.0, ui) for ui in u]
+        upr = [u[0]*ca + u[1]*sa, -u[0]*sa + u[1]*ca,
+               u[3]*ca + u[4]*sa, -u[3]*sa + u[4]*ca,
+               u[6]*ca + u[7]*sa, -u[6]*sa + u[7]*ca]
+        upr = [np.where(np.abs(ui) <= 1.0e-08, 0.0, ui) for ui in upr]
+        dis = [upr[0] + upr[2] + upr[4], upr[1] + upr[3] + upr[5], u[2] + u[5] + u[8]]
+
+    strain = None
+    if strains:
+        epr = transform(e, sa, ca)
+        epr = [np.where(np.abs(ei) <= 1.0e-08, 0.0, ei) for ei in epr]
+        strain = [epr[0] + epr[4] + epr[8],
+                  0.5*(epr[1] + epr[5] + epr[9] + epr[2] + epr[6] + epr[10]),
+                  epr[3] + epr[7] + epr[11]]
+
+    return dis, strain
+
+
+def outputcoordinates(model, xo, yo):
+    """ x, y as printed by disloc.c
+
+        disloc.c rotates the points into the frame of the last fault and
+        back again in single precision before writing them
+    """
+
+    if not model['faults']:
+        return xo, yo
+
+    item = model['faults'][-1]
+    sa, ca = faultgeometry(item)[:2]
+    xp = xo - item['x']
+    yp = yo - item['y']
+    x = xp*ca - yp*sa
+    y = xp*sa + yp*ca
+
+    return x*ca + y*sa + item['x'], -x*sa + y*ca + item['y']
+
+
+def lookvector(elevation, azimuth):
+    """ unit look vector, same as SARImage.lineofsight """
+
+    azimuth, elevation = math.radians(azimuth), math.radians(elevation)
+    return [math.sin(azimuth)*math.cos(elevation), math.cos(azimuth)*math.cos(elevation), math.sin(elevation)]
+
+
+def columns(products="all"):
+    """ output columns of a run for products """
+
+    return ["x", "y"] + PRODUCTS[products]
+
+
+def evaluate(model, xo, yo, products="all", look=None):
+    """ sum the contribution of every fault at the points xo, yo
+
+        products: key of PRODUCTS, look: look vector for los
+        returns dict of x, y (as printed by disloc.c) and the arrays of
+        the products, ux ... eyy for all
+    """
+
+    npts = len(xo)
+    displacements = products in ["all", "displacement", "los"]
+    strains = products in ["all", "strain"]
+    names = []
+    if displacements:
+        names += PRODUCTS["displacement"]
+    if strains:
+        names += PRODUCTS["strain"]
+    sums = [np.zeros(npts) for i in names]
+
+    with np.errstate(all='ignore'):
+        for item in model['faults']:
+            sa, ca, sd, cd, mat = faultgeometry(item)
+            xp = xo - item['x']
+            yp = yo - item['y']
+            x = xp*ca - yp*sa
+            y = xp*sa + yp*ca
+            # point source
+            if item['type'] == 0:
+                dis, strain = point(x, y, item, sd, cd, mat, sa, ca, displacements, strains)
+            # finite fault
+            elif item['type'] == 1:
+                dis, strain = fault(x, y, item, sd, cd, mat, sa, ca, displacements, strains)
+            else:
+                continue
+            for i, value in enumerate((dis or []) + (strain or [])):
+                sums[i] += value
+
+    result = {}
+    result['x'], result['y'] = outputcoordinates(model, xo, yo)
+    for name, value in zip(names, sums):
+        result[name] = value
+
+    return selectproducts(result, products, look)
+
+
+def selectproducts(result, products="all", look=None):
+    """ keep the columns of products in a result, los is projected here """
+
+    if products == "los":
+        result['los'] = look[0]*result['ux'] + look[1]*result['uy'] + look[2]*result['uz']
+    for name in COMPONENTS:
+        if name in result and name not in PRODUCTS[products]:
+            del result[name]
+    result['products'] = products
+
+    return result
+
+
+def tiles(model, blocksize=BLOCKSIZE, processes=1):
+    """ split the observation points into row tiles
+
+        returns a list of (start, stop) point ranges; a grid is split on
+        whole rows, at least one tile per process
+    """
+
+    nx, ny = gridsize(model)
+    if model['grid'] is None:
+        nx, ny = 1, nx
+    rows = max(1, min(blocksize//max(nx, 1), -(-ny//max(processes, 1))))
+
+    return [(k*nx, min(k + rows, ny)*nx) for k in range(0, ny, rows)]
+
+
+def faultchunks(faults, processes=1):
+    """ split the fault list into contiguous chunks, one per process """
+
+    size = max(1, -(-len(faults)//max(processes, 1)))
+
+    return [faults[k:k + size] for k in range(0, len(faults), size)]
+
+
+def stitch(blocks, names=None):
+    """ concatenate per-tile results in order """
+
+    if names is None:
+        names = columns()
+    result = {}
+    for name in names:
+        if blocks:
+            result[name] = np.concatenate([b[name] for b in blocks])
+        else:
+            result[name] = np.zeros(0)
+
+    return result
+
+
+def _evaluatetile(job):
+    """ pool worker: evaluate one tile """
+
+    evaluator, model, xo, yo, products, look = job
+    return evaluator(model, xo, yo, products=products, look=look)
+
+
+def _evaluatefaults(job):
+    """ pool worker: partial grid of one chunk of faults over all points """
+
+    evaluator, model, xo, yo, blocksize, products, look = job
+    blocks = [evaluator(model, xo[start:start + blocksize], yo[start:start + blocksize],
+                        products=products, look=look)
+              for start in range(0, len(xo), blocksize)]
+    return stitch(blocks, columns(products))
+
+
+def disloc(model, blocksize=BLOCKSIZE, evaluator=None, processes=1, timeout=None, split="rows",
+           products="all", look=None):
+    """ run the model on all observation points
+
+        evaluator: function(model, xo, yo) for one block of points,
+                   default: evaluate() in this module
+        processes: number of worker processes, 0 or None: one per core,
+                   1: serial
+        timeout:   seconds to wait for the worker pool, raises
+                   multiprocessing.TimeoutError
+        split:     rows: workers evaluate row tiles of the grid,
+                   faults: workers evaluate all points for a chunk of
+                   the fault list and the partial grids are summed
+        products:  all, displacement, strain or los, see PRODUCTS;
+                   look: look vector for los, see lookvector()
+        returns a result dict: gridsize, grid, lat, lon, faults, stats and the
+        output columns x, y, ux, uy, uz, exx, exy, eyy (or those of the
+        products) as flat arrays
+    """
+
+    if evaluator is None:
+        evaluator = evaluate
+    if not processes:
+        processes = os.cpu_count() or 1
+
+    starttime = time.time()
+    xo, yo = observationpoints(model)
+    # los is projected after the fault reduction, as in the serial run
+    partial = "displacement" if products == "los" else products
+    if split == "faults":
+        jobs = []
+        for chunk in faultchunks(model['faults'], processes):
+            submodel = dict(model, faults=chunk)
+            jobs.append((evaluator, submodel, xo, yo, blocksize, partial, None))
+        worker = _evaluatefaults
+    else:
+        jobs = [(evaluator, model, xo[start:stop], yo[start:stop], products, look)
+                for start, stop in tiles(model, blocksize, processes)]
+        worker = _evaluatetile
+
+    if processes > 1 and len(jobs) > 1:
+        # map keeps the job order, so the result never depends on which
+        # worker finishes first
+        with multiprocessing.Pool(min(processes, len(jobs))) as pool:
+            blocks = pool.map_async(worker, jobs).get(timeout)
+    else:
+        blocks = [worker(job) for job in jobs]
+
+    if split == "faults" and blocks:
+        # deterministic reduction: partial grids summed in fault order,
+        # x, y come from the chunk holding the last fault
+        result = blocks[-1].copy()
+        for name in PRODUCTS[partial]:
+            total = blocks[0][name].copy()
+            for block in blocks[1:]:
+                total += block[name]
+            result[name] = total
+        result = selectproducts(result, products, look)
+    elif split == "faults":
+        result = {"x": xo, "y": yo}
+        for name in PRODUCTS[products]:
+            result[name] = np.zeros(len(xo))
+    else:
+        # points are independent, stitching the tiles in order gives
+        # the same arrays as the serial run
+        result = stitch(blocks, columns(products))
+
+    seconds = time.time() - starttime
+    npatches = len(model['faults'])
+    result.update({"gridsize": gridsize(model), "grid": model['grid'], "lat": model['lat'],
+                   "lon": model['lon'], "faults": model['faults'], "products": products})
+    result['stats'] = {"split": split, "processes": min(processes, max(len(jobs), 1)),
+                       "patches": npatches, "points": len(xo), "seconds": seconds,
+                       "throughput": npatches*len(xo)/seconds if seconds > 0 else 0.0}
+
+    return result
+
+
+def headerrows(ncols):
+    """ rows taken by the header of a binary table with ncols columns """
+
+    if ncols == len(HEADERFIELDS):
+        return 1
+    return -(-(len(HEADERFIELDS) + 1)//ncols)
+
+
+def writebinary(result, outputfile, dtype=np.float64):
+    """ write result as a .npy table, see HEADERFIELDS
+
+        the header keeps nx, ny, the origin and the grid spacing (nan for
+        a point list); readers can open the file with
+        np.load(outputfile, mmap_mode='r') or readbinary()
+    """
+
+    products = result.get('products', "all")
+    names = columns(products)
+    nx, ny = result['gridsize']
+    grid = result.get('grid')
+    if grid is None:
+        spacing = [np.nan]*4
+    else:
+        spacing = [grid[0], grid[1], grid[3], grid[4]]
+    header = [nx, ny, result['lat'], result['lon']] + spacing
+    rows = headerrows(len(names))
+    if products != "all":
+        header.append(PRODUCTCODES.index(products))
+    header += [np.nan]*(rows*len(names) - len(header))
+
+    npts = len(result['x'])
+    table = np.lib.format.open_memmap(outputfile, mode="w+", dtype=dtype, shape=(npts + rows, len(names)))
+    table[:rows] = np.reshape(header, (rows, len(names)))
+    for i, name in enumerate(names):
+        table[rows:, i] = result[name]
+    table.flush()
+    del table
+
+
+def readbinary(outputfile):
+    """ open a binary table memory-mapped
+
+        returns (header, table): header dict of HEADERFIELDS, products and
+        columns, table the memory-mapped rows below the header
+    """
+
+    table = np.load(outputfile, mmap_mode='r')
+    if table.ndim != 2 or table.shape[1] < 3:
+        raise ValueError("bad disloc table: %s" % outputfile)
+    rows = headerrows(table.shape[1])
+    values = np.asarray(table[:rows], dtype=np.float64).ravel()
+    header = dict(zip(HEADERFIELDS, values.tolist()))
+    header['products'] = "all" if rows == 1 else PRODUCTCODES[int(values[len(HEADERFIELDS)])]
+    header['columns'] = columns(header['products'])
+
+    return header, table[rows:]
+
+
+def writeoutput(result, outputfile, dtype=np.float64):
+    """ write result in the disloc.c text format, or as a binary table
+        when outputfile ends in .npy
+    """
+
+    if outputfile.endswith(".npy"):
+        writebinary(result, outputfile, dtype)
+        return
+
+    names = columns(result.get('products', "all"))
+    FL = "%.16g"
+    with open(outputfile, "w") as f:
+        nx, ny = result['gridsize']
+        f.write("%d  %d  %f  %f\n" % (nx, ny, result['lat'], result['lon']))
+        for item in result['faults']:
+            f.write(" ".join([FL]*3) % (item['x'], item['y'], item['strike']) + "\n")
+            f.write(" ".join([FL]*9) % tuple(item[k] for k in ["depth", "dip", "lambda", "mu",
+                                                               "u1", "u2", "u3", "length", "width"]) + "\n")
+        if names == columns():
+            f.write("  x      y       ux        uy        uz        ")
+            f.write("exx       exy       eyy\n")
+        else:
+            f.write("  x      y     " + "".join("  %-8s" % name for name in names[2:]).rstrip() + "\n")
+        table = np.column_stack([result[k] for k in names])
+        np.savetxt(f, table, fmt="  % 6.5f  % 6.5f" + "  % 10.3e"*(len(names) - 2))
+
+
+def main():
+
+    # test case: compare with disloc binary output
+    with open("test/4fault.txt") as f:
+        model = readinput(f.read())
+    result = disloc(model)
+    writeoutput(result, "test/4fault.engine.csv")
+
+
+if __name__ == "__main__":
+    main()
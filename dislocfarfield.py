@@ -0,0 +1,281 @@
+"""
+    dislocfarfield.py
+        -- accuracy-controlled far field for large multi-patch models
+        -- a bucket index over the patch centroids finds, for each block of
+           observation points, the patches that are far away: beyond a
+           first distance a finite fault is replaced by a point source at
+           its centroid (type 0, point() instead of fault()), beyond a
+           second distance the patch is left out
+
+    cutoffs of a patch with slip s, length L, width W (a = half diagonal,
+    M = s*L*W/(2*pi), R = distance to the centroid at depth):
+        point source error  <= QUADRUPOLE*M*a*a/R**4 + ROUNDOFF, for R >= POINTRATIO*a
+        left out            <= MONOPOLE*M/R**2
+    each is applied when it is below the per-patch tolerance; the bounds of
+    all approximated patches are summed at every point and the largest sum
+    is reported as the error bound of the run (displacement, output units)
+
+    disloc.c leaves the along-strike tensile displacement of a finite fault
+    at zero, the point source drops it too; the point source strains follow
+    the disloc.c point() formulas, so strains get their own, looser bound
+"""
+
+import math
+import time
+
+import numpy as np
+
+import dislocengine
+
+# bound constants, fitted over random geometries with a safety factor
+MONOPOLE = 4.0
+QUADRUPOLE = 8.0
+STRAIN = 8.0
+ROUNDOFF = 1.0e-7
+
+# point source only this many half diagonals away from the centroid
+POINTRATIO = 4.0
+
+# default tolerance per patch, relative to the largest slip
+RTOL = 1.0e-5
+
+# buckets per side of the centroid index
+BUCKETS = 16
+
+
+def patchindex(faults, tolerance):
+    """ centroids, cutoff distances and error scales of the patches
+
+        returns a dict of arrays, one entry per fault; type 0 faults are
+        already point sources and are only ever left out
+    """
+
+    n = len(faults)
+    index = {"cx": np.zeros(n), "cy": np.zeros(n), "depth": np.zeros(n),
+             "moment": np.zeros(n), "halfdiag": np.zeros(n),
+             "rpoint": np.full(n, np.inf), "rdrop": np.full(n, np.inf),
+             "active": np.zeros(n, dtype=bool)}
+
+    for k, item in enumerate(faults):
+        if item['type'] not in [0, 1]:
+            continue
+        sa, ca, sd, cd, mat = dislocengine.faultgeometry(item)
+        slip = math.sqrt(sum(float(item[s])**2 for s in ["u1", "u2", "u3"]))
+        length = float(item['length'])
+        width = float(item['width'])
+        moment = slip*length*width/(2.0*math.pi)
+        if item['type'] == 1:
+            # fault frame: along strike 0..length, up dip 0..width
+            xf = length/2.0
+            yf = width*cd/2.0
+            index['cx'][k] = float(item['x']) + xf*float(ca) + yf*float(sa)
+            index['cy'][k] = float(item['y']) - xf*float(sa) + yf*float(ca)
+            index['depth'][k] = float(item['depth']) - width*sd/2.0
+            halfdiag = 0.5*math.hypot(length, width)
+            if tolerance > ROUNDOFF:
+                rpoint = (QUADRUPOLE*moment*halfdiag*halfdiag/(tolerance - ROUNDOFF))**0.25
+                index['rpoint'][k] = max(rpoint, POINTRATIO*halfdiag)
+        else:
+            index['cx'][k] = float(item['x'])
+            index['cy'][k] = float(item['y'])
+            index['depth'][k] = float(item['depth'])
+            halfdiag = 0.0
+            index['rpoint'][k] = 0.0
+        index['moment'][k] = moment
+        index['halfdiag'][k] = halfdiag
+        index['rdrop'][k] = math.sqrt(MONOPOLE*moment/tolerance) if tolerance > 0 else np.inf
+        index['rpoint'][k] = min(index['rpoint'][k], index['rdrop'][k])
+        index['active'][k] = True
+
+    # buckets over the centroids, each knows its extent and cutoffs
+    active = np.flatnonzero(index['active'])
+    buckets = []
+    if len(active):
+        cx, cy = index['cx'][active], index['cy'][active]
+        size = max(np.ptp(cx), np.ptp(cy), 1.0e-6)/BUCKETS
+        keys = (np.floor((cx - cx.min())/size)*(BUCKETS + 1) + np.floor((cy - cy.min())/size)).astype(np.int64)
+        for key in np.unique(keys):
+            members = active[keys == key]
+            buckets.append({"members": members,
+                            "xmin": index['cx'][members].min(), "xmax": index['cx'][members].max(),
+                            "ymin": index['cy'][members].min(), "ymax": index['cy'][members].max(),
+                            "depth": np.abs(index['depth'][members]).min(),
+                            "rpoint": index['rpoint'][members].min(),
+                            "rdrop": index['rdrop'][members].max()})
+    index['buckets'] = buckets
+
+    return index
+
+
+def pointsource(x, y, item, sd, cd, mat, sa, ca):
+    """ point source stand-in for a finite fault, see dislocengine.point
+
+        x, y are in the frame of the source; the along-strike tensile
+        displacement is removed as in the finite fault of disloc.c
+    """
+
+    dis, strain = dislocengine.point(x, y, item, sd, cd, mat, sa, ca)
+    if float(item['u3']) != 0.0:
+        # u013 of point() in disloc.c
+        x = x.astype(np.float64)
+        y = y.astype(np.float64)
+        d = float(item['depth'])
+        r = np.sqrt(x*x + y*y + d*d)
+        r3 = r*r*r
+        q = y*sd - d*cd
+        t3 = float(item['u3'])*float(item['length']*item['width'])/(2.0*math.pi)
+        i02 = mat*x*((1.0/(r*(r+d)*(r+d)))-(y*y*(3.0*r+d)/(r3*(r+d)*(r+d)*(r+d))))
+        i03 = mat*(x/r3) - i02
+        along = t3*(3.0*x*q*q/(r3*r*r) - i03*sd*sd)
+        dis = [dis[0] - along*float(ca), dis[1] + along*float(sa), dis[2]]
+
+    return dis, strain
+
+
+def evaluate(model, index, xo, yo, evaluator=None):
+    """ sum the patches at the points xo, yo with the far-field cutoffs
+
+        returns (result, counts, bound, strainbound): result as
+        dislocengine.evaluate, counts of point source and left out
+        patch*point evaluations, per-point error bounds
+    """
+
+    if evaluator is None:
+        evaluator = dislocengine.evaluate
+
+    npts = len(xo)
+    sums = [np.zeros(npts) for i in dislocengine.COMPONENTS]
+    bound = np.zeros(npts)
+    strainbound = np.zeros(npts)
+    counts = {"pointsource": 0, "skipped": 0}
+    faults = model['faults']
+
+    # bucket query against the bounding box of the block
+    x64 = xo.astype(np.float64)
+    y64 = yo.astype(np.float64)
+    xmin, xmax, ymin, ymax = x64.min(), x64.max(), y64.min(), y64.max()
+    near = []
+    for bucket in index['buckets']:
+        dx = max(bucket['xmin'] - xmax, xmin - bucket['xmax'], 0.0)
+        dy = max(bucket['ymin'] - ymax, ymin - bucket['ymax'], 0.0)
+        if math.sqrt(dx*dx + dy*dy + bucket['depth']**2) > bucket['rdrop']:
+            continue
+        near.append(bucket['members'])
+    near = set(np.concatenate(near).tolist()) if near else set()
+
+    with np.errstate(all='ignore'):
+        for k, item in enumerate(faults):
+            if not index['active'][k]:
+                continue
+            moment = index['moment'][k]
+            if k not in near:
+                # whole block beyond the second cutoff
+                r2 = (x64 - index['cx'][k])**2 + (y64 - index['cy'][k])**2 + index['depth'][k]**2
+                bound += MONOPOLE*moment/r2
+                strainbound += STRAIN*moment/r2**1.5
+                counts['skipped'] += npts
+                continue
+
+            r2 = (x64 - index['cx'][k])**2 + (y64 - index['cy'][k])**2 + index['depth'][k]**2
+            r = np.sqrt(r2)
+            drop = r > index['rdrop'][k]
+            usepoint = ~drop & (r > index['rpoint'][k])
+            exact = ~drop & ~usepoint
+
+            if drop.any():
+                bound[drop] += MONOPOLE*moment/r2[drop]
+                strainbound[drop] += STRAIN*moment/(r2[drop]*r[drop])
+                counts['skipped'] += int(drop.sum())
+
+            if exact.all():
+                part = evaluator(dict(model, faults=[item]), xo, yo)
+                for i, name in enumerate(dislocengine.COMPONENTS):
+                    sums[i] += part[name]
+            elif exact.any():
+                part = evaluator(dict(model, faults=[item]), xo[exact], yo[exact])
+                for i, name in enumerate(dislocengine.COMPONENTS):
+                    sums[i][exact] += part[name]
+
+            if usepoint.any():
+                sa, ca, sd, cd, mat = dislocengine.faultgeometry(item)
+                source = dict(item, type=0, x=np.float32(index['cx'][k]), y=np.float32(index['cy'][k]),
+                              depth=np.float32(index['depth'][k]))
+                xp = xo[usepoint] - source['x']
+                yp = yo[usepoint] - source['y']
+                x = xp*ca - yp*sa
+                y = xp*sa + yp*ca
+                if item['type'] == 1:
+                    dis, strain = pointsource(x, y, source, sd, cd, mat, sa, ca)
+                    halfdiag = index['halfdiag'][k]
+                    bound[usepoint] += QUADRUPOLE*moment*halfdiag*halfdiag/r2[usepoint]**2 + ROUNDOFF
+                    strainbound[usepoint] += STRAIN*moment/(r2[usepoint]*r[usepoint])
+                    counts['pointsource'] += int(usepoint.sum())
+                else:
+                    dis, strain = dislocengine.point(x, y, source, sd, cd, mat, sa, ca)
+                for i, value in enumerate(dis + strain):
+                    sums[i][usepoint] += value
+
+    result = {}
+    result['x'], result['y'] = dislocengine.outputcoordinates(model, xo, yo)
+    for name, value in zip(dislocengine.COMPONENTS, sums):
+        result[name] = value
+
+    return result, counts, bound, strainbound
+
+
+def disloc(model, evaluator=None, tolerance=None, blocksize=dislocengine.BLOCKSIZE):
+    """ run the model with far-field cutoffs
+
+        tolerance: displacement error allowed per patch in output units,
+                   default RTOL times the largest slip
+        same return value as dislocengine.disloc; stats also give the
+        tolerance, the error bounds and the evaluations that were replaced
+        by a point source or skipped
+    """
+
+    starttime = time.time()
+    faults = model['faults']
+    if tolerance is None:
+        slips = [math.sqrt(sum(float(item[s])**2 for s in ["u1", "u2", "u3"])) for item in faults]
+        tolerance = RTOL*max(slips + [0.0])
+    index = patchindex(faults, tolerance)
+
+    xo, yo = dislocengine.observationpoints(model)
+    blocks = []
+    counts = {"pointsource": 0, "skipped": 0}
+    errorbound = 0.0
+    strainbound = 0.0
+    for start, stop in dislocengine.tiles(model, blocksize):
+        block, blockcounts, bound, sbound = evaluate(model, index, xo[start:stop], yo[start:stop], evaluator)
+        blocks.append(block)
+        for key in counts:
+            counts[key] += blockcounts[key]
+        if len(bound):
+            errorbound = max(errorbound, float(bound.max()))
+            strainbound = max(strainbound, float(sbound.max()))
+    result = dislocengine.stitch(blocks)
+
+    seconds = time.time() - starttime
+    npatches = len(faults)
+    result.update({"gridsize": dislocengine.gridsize(model), "grid": model['grid'], "lat": model['lat'],
+                   "lon": model['lon'], "faults": faults})
+    result['stats'] = {"split": "farfield", "processes": 1, "patches": npatches, "points": len(xo),
+                       "seconds": seconds, "tolerance": tolerance, "errorbound": errorbound,
+                       "strainbound": strainbound, "evaluations": npatches*len(xo),
+                       "pointsource": counts['pointsource'], "skipped": counts['skipped'],
+                       "throughput": npatches*len(xo)/seconds if seconds > 0 else 0.0}
+
+    return result
+
+
+def main():
+
+    # test case: compare with the full evaluation
+    with open("test/4fault.txt") as f:
+        model = dislocengine.readinput(f.read())
+    result = disloc(model, tolerance=1.0e-3)
+    print(result['stats'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+    dislocgeotiff.py
+        -- multi-band float32 GeoTIFF of a disloc grid without GDAL
+        -- bands: los (displacement along the look vector, output units,
+           not wrapped), ux, uy, uz, exx, exy, eyy, as far as the table
+           has them
+        -- the file is laid out first (header, one IFD, one strip per
+           band), the bands are then written through a memory map row
+           block by row block, so the grid is never held in memory
+
+    georeference: WGS84 lon/lat (EPSG 4326), grid values at the pixel
+    centres (PixelIsPoint), extent as computed by SARImage.drawimage();
+    band names are in ImageDescription and in the GDAL metadata tag
+
+    usage:
+        export("output.npy", "output.tif", look=(60, -5))
+"""
+
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+import dislocengine
+from SARImage import dxy2lonlat, readtable
+
+BANDS = ["los", "ux", "uy", "uz", "exx", "exy", "eyy"]
+
+# grid rows copied per block
+BLOCKROWS = 256
+
+# TIFF field types
+SHORT, LONG, ASCII, DOUBLE = 3, 4, 2, 12
+TYPES = {SHORT: ("H", 2), LONG: ("I", 4), ASCII: ("s", 1), DOUBLE: ("d", 8)}
+
+
+def readcolumns(disO, dislocresult=None):
+    """ gridsize, reference lon/lat and the columns of a disloc output
+
+        .npy columns are memory-mapped, text tables are read at once
+    """
+
+    if dislocresult is not None:
+        names = dislocengine.columns(dislocresult.get('products', "all"))
+        columns = dict((k, dislocresult[k]) for k in names)
+        return dislocresult['gridsize'], [float(dislocresult['lon']), float(dislocresult['lat'])], columns
+    if disO.endswith(".npy"):
+        header, table = dislocengine.readbinary(disO)
+        columns = dict((k, table[:, i]) for i, k in enumerate(header['columns']))
+        return [int(header['nx']), int(header['ny'])], [header['lon'], header['lat']], columns
+    gridsize, reflonlat, names, table = readtable(disO)
+    return gridsize, reflonlat, dict((k, table[:, i]) for i, k in enumerate(names))
+
+
+def ifdentry(tag, kind, values, extra, extraoffset):
+    """ 12 byte IFD entry, values longer than 4 bytes go to extra """
+
+    if kind == ASCII:
+        data = values.encode() + b"\0"
+        count = len(data)
+    else:
+        code, size = TYPES[kind]
+        data = struct.pack("<%d%s" % (len(values), code), *values)
+        count = len(values)
+    if len(data) <= 4:
+        return struct.pack("<HHI", tag, kind, count) + data.ljust(4, b"\0")
+    offset = extraoffset + len(extra)
+    extra += data
+    if len(extra) % 2:
+        extra += b"\0"
+    return struct.pack("<HHII", tag, kind, count, offset)
+
+
+def tiffheader(nx, ny, names, extent):
+    """ header and IFD of the file; returns (bytes, offset of the bands) """
+
+    nbands = len(names)
+    lonmin, lonmax, latmin, latmax = extent
+    scale = [(lonmax - lonmin)/max(nx - 1, 1), (latmax - latmin)/max(ny - 1, 1), 0.0]
+    # GTModelType geographic, GTRasterType PixelIsPoint, GeographicType WGS84
+    geokeys = [1, 1, 0, 3, 1024, 0, 1, 2, 1025, 0, 1, 2, 2048, 0, 1, 4326]
+    gdal = "<GDALMetadata>" + "".join('<Item name="DESCRIPTION" sample="%d" role="description">%s</Item>'
+                                      % (i, name) for i, name in enumerate(names)) + "</GDALMetadata>"
+
+    fields = [(256, LONG, [nx]), (257, LONG, [ny]), (258, SHORT, [32]*nbands), (259, SHORT, [1]),
+              (262, SHORT, [1]), (270, ASCII, " ".join(names)), (273, LONG, None),
+              (277, SHORT, [nbands]), (278, LONG, [ny]), (279, LONG, [nx*ny*4]*nbands),
+              (284, SHORT, [2])]
+    if nbands > 1:
+        fields.append((338, SHORT, [0]*(nbands - 1)))
+    fields += [(339, SHORT, [3]*nbands), (33550, DOUBLE, scale),
+               (33922, DOUBLE, [0.0, 0.0, 0.0, lonmin, latmax, 0.0]),
+               (34735, SHORT, geokeys), (42112, ASCII, gdal)]
+
+    ifdoffset = 8
+    extraoffset = ifdoffset + 2 + 12*len(fields) + 4
+    # strip offsets depend on the size of the extra values, which does
+    # not depend on the offsets themselves
+    for attempt in range(2):
+        extra = bytearray()
+        entries = []
+        for tag, kind, values in fields:
+            if tag == 273:
+                values = [dataoffset + b*nx*ny*4 for b in range(nbands)] if attempt else [0]*nbands
+            entries.append(ifdentry(tag, kind, values, extra, extraoffset))
+        dataoffset = extraoffset + len(extra)
+        dataoffset += -dataoffset % 16
+
+    if dataoffset + nbands*nx*ny*4 >= 2**32:
+        raise ValueError("raster larger than 4 GB: %d bands of %d x %d" % (nbands, nx, ny))
+    header = b"II" + struct.pack("<HI", 42, ifdoffset) + struct.pack("<H", len(fields))
+    header += b"".join(entries) + struct.pack("<I", 0) + bytes(extra)
+    return header.ljust(dataoffset, b"\0"), dataoffset
+
+
+def export(disO, outputfile, dislocresult=None, look=None, bands=None, blockrows=BLOCKROWS):
+    """ write the grid of a disloc output as a GeoTIFF
+
+        look: (elevation, azimuth) for the los band, no los band without
+        bands: names to write, default: every one of BANDS the table has
+        returns the band names and the [west, east, south, north] extent
+    """
+
+    (nx, ny), reflonlat, columns = readcolumns(disO, dislocresult)
+    npts = len(columns['x'])
+    if nx < 2 or ny < 2 or nx*ny != npts:
+        raise ValueError("raster needs a generated grid, got %d points for %d x %d" % (npts, nx, ny))
+
+    g = None if look is None else dislocengine.lookvector(look[0], look[1])
+    available = [k for k in BANDS if k in columns]
+    if 'los' not in columns and g is not None and 'ux' in columns:
+        available.insert(0, 'los')
+    names = available if bands is None else [k for k in bands if k in available]
+    if not names:
+        raise ValueError("no raster bands in %s" % disO)
+
+    # extent as in drawimage, the grid is regular in lon and lat
+    x, y = columns['x'], columns['y']
+    lon, lat = dxy2lonlat([np.array([np.min(x), np.max(x)], dtype=np.float64),
+                           np.array([np.min(y), np.max(y)], dtype=np.float64)], reflonlat)
+    extent = [float(lon[0]), float(lon[1]), float(lat[0]), float(lat[1])]
+    # first raster row is the north edge
+    flip = float(y[nx]) > float(y[0])
+
+    header, dataoffset = tiffheader(nx, ny, names, extent)
+    directory = os.path.dirname(os.path.abspath(outputfile))
+    fd, tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.truncate(dataoffset + len(names)*nx*ny*4)
+        raster = np.memmap(tmpname, dtype="<f4", mode="r+", offset=dataoffset, shape=(len(names), ny, nx))
+        for b, name in enumerate(names):
+            for j0 in range(0, ny, blockrows):
+                j1 = min(j0 + blockrows, ny)
+                rows = slice(j0*nx, j1*nx)
+                if name == 'los' and 'los' not in columns:
+                    values = (g[0]*np.asarray(columns['ux'][rows], dtype=np.float64)
+                              + g[1]*np.asarray(columns['uy'][rows], dtype=np.float64)
+                              + g[2]*np.asarray(columns['uz'][rows], dtype=np.float64))
+                else:
+                    values = np.asarray(columns[name][rows])
+                values = values.reshape(j1 - j0, nx)
+                if flip:
+                    raster[b, ny - j1:ny - j0] = values[::-1]
+                else:
+                    raster[b, j0:j1] = values
+        raster.flush()
+        del raster
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, outputfile)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+
+    return names, extent
+
+
+def main():
+
+    # test case: 4fault grid with the default look of SARImage
+    with open("test/4fault.txt") as f:
+        model = dislocengine.readinput(f.read())
+    result = dislocengine.disloc(model)
+    print(export("", "test/4fault.tif", dislocresult=result, look=(60, -5)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+    dislocgreens.py
+        -- Green's function cache for the in-process engines
+        -- Okada displacement and strain are linear in u1/u2/u3: each fault
+           is evaluated once per slip component with unit slip, the
+           response grids are kept on disk, and a model that only changes
+           slip becomes a weighted sum of cached arrays
+
+    cache layout:
+        [cachedir]/[key]-u1.npy   (6, npts) float64: ux uy uz exx exy eyy
+        key: sha1 of line 1, the observation points and the fault geometry
+             (x, y, strike, type, depth, dip, lambda, mu, length, width)
+
+    files are opened with np.load(mmap_mode='r'), so several workers can
+    share them read-only; the least recently used files are removed when
+    the cache grows beyond CACHESIZE bytes
+"""
+
+import os
+import time
+import hashlib
+import tempfile
+
+import numpy as np
+
+import dislocengine
+
+CACHEDIR = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "cache" + os.path.sep + "greens"
+
+# size bound of the cache in bytes
+CACHESIZE = 2*1024**3
+
+SLIPS = ["u1", "u2", "u3"]
+
+# fault fields that do not change when only the slip changes
+GEOMETRY = ["x", "y", "strike", "type", "depth", "dip", "lambda", "mu", "length", "width"]
+
+
+def gridkey(model):
+    """ hash of line 1 and the observation points """
+
+    h = hashlib.sha1()
+    h.update(np.array([model['lat'], model['lon']], dtype=np.float32).tobytes())
+    h.update(str(model['genparm']).encode())
+    if model['grid'] is None:
+        h.update(np.ascontiguousarray(model['xo']).tobytes())
+        h.update(np.ascontiguousarray(model['yo']).tobytes())
+    else:
+        h.update(repr([float(x) for x in model['grid']]).encode())
+
+    return h.hexdigest()
+
+
+def faultkey(grid, fault):
+    """ hash of the grid key and the geometry of one fault """
+
+    h = hashlib.sha1(grid.encode())
+    h.update(np.array([fault[k] for k in GEOMETRY], dtype=np.float32).tobytes())
+
+    return h.hexdigest()
+
+
+def unitresponse(model, fault, slip, evaluator=None, cachedir=CACHEDIR):
+    """ response of one fault to unit slip in one component
+
+        returns ((6, npts) array, hit); the array is memory-mapped when it
+        comes from the cache
+    """
+
+    path = cachedir + os.path.sep + faultkey(gridkey(model), fault) + "-" + slip + ".npy"
+
+    if os.path.exists(path):
+        try:
+            response = np.load(path, mmap_mode='r')
+            # mark as recently used for the eviction
+            os.utime(path)
+            return response, True
+        except (OSError, ValueError):
+            # removed by another worker's eviction or unreadable
+            pass
+
+    unitfault = dict(fault)
+    for k in SLIPS:
+        unitfault[k] = np.float32(1.0 if k == slip else 0.0)
+    result = dislocengine.disloc(dict(model, faults=[unitfault]), evaluator=evaluator)
+    response = np.array([result[k] for k in dislocengine.COMPONENTS])
+
+    # write to a temporary name and rename, readers never see partial files
+    os.makedirs(cachedir, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=cachedir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, response)
+    os.replace(tmpname, path)
+
+    return response, False
+
+
+def evict(cachedir=CACHEDIR, maxbytes=CACHESIZE):
+    """ remove least recently used files until the cache fits maxbytes """
+
+    entries = []
+    for name in os.listdir(cachedir):
+        if not name.endswith(".npy"):
+            continue
+        path = cachedir + os.path.sep + name
+        try:
+            info = os.stat(path)
+        except OSError:
+            continue
+        entries.append((info.st_mtime, info.st_size, path))
+
+    total = sum(size for mtime, size, path in entries)
+    removed = 0
+    for mtime, size, path in sorted(entries):
+        if total <= maxbytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+        removed += 1
+
+    return removed
+
+
+def disloc(model, evaluator=None, cachedir=CACHEDIR, maxbytes=CACHESIZE):
+    """ run the model as a weighted sum of cached unit responses
+
+        same return value as dislocengine.disloc; stats also count cache
+        hits and misses.  The |u| <= 1e-8 cutoffs of disloc.c are applied
+        to the unit responses, so values can differ from a direct run far
+        below the output precision
+    """
+
+    starttime = time.time()
+    xo, yo = dislocengine.observationpoints(model)
+    npts = len(xo)
+    sums = np.zeros((len(dislocengine.COMPONENTS), npts))
+    hits = 0
+    misses = 0
+
+    for item in model['faults']:
+        if item['type'] not in [0, 1]:
+            continue
+        for slip in SLIPS:
+            weight = float(item[slip])
+            if weight == 0.0:
+                continue
+            response, hit = unitresponse(model, item, slip, evaluator=evaluator, cachedir=cachedir)
+            if hit:
+                hits += 1
+            else:
+                misses += 1
+            sums += weight*response
+
+    if misses:
+        evict(cachedir, maxbytes)
+
+    result = {"gridsize": dislocengine.gridsize(model), "grid": model['grid'], "lat": model['lat'],
+              "lon": model['lon'], "faults": model['faults']}
+    result['x'], result['y'] = dislocengine.outputcoordinates(model, xo, yo)
+    for i, name in enumerate(dislocengine.COMPONENTS):
+        result[name] = sums[i]
+
+    seconds = time.time() - starttime
+    npatches = len(model['faults'])
+    result['stats'] = {"split": "greens", "processes": 1, "patches": npatches, "points": npts,
+                       "seconds": seconds, "hits": hits, "misses": misses,
+                       "throughput": npatches*npts/seconds if seconds > 0 else 0.0}
+
+    return result
+
+
+def main():
+
+    # test case: second run with scaled slip is served from the cache
+    with open("test/4fault.txt") as f:
+        model = dislocengine.readinput(f.read())
+    print(disloc(model)['stats'])
+    for item in model['faults']:
+        for slip in SLIPS:
+            item[slip] = item[slip]*2
+    print(disloc(model)['stats'])
+
+
+if __name__ == "__main__":
+    main()
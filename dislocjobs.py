@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+    dislocjobs.py
+        -- asynchronous workflow jobs: a sqlite queue and a pool of worker
+           processes, no broker
+        -- the service submits a job and returns at once, a worker claims
+           the oldest queued job, runs dislocworkflow() with JOBTIMEOUT and
+           keeps its stage and progress in the queue; the summary is
+           stored with the job when it finishes
+
+    job states: queued, running, success, failed
+    a job with a batch argument is a multiple-files batch, see dislocbatch.py,
+    one with a sweep argument a parameter sweep, see dislocsweep.py
+
+    usage:
+        python dislocjobs.py -n 4          # start 4 workers
+        jobid = submit({"input": text})
+        status(jobid), result(jobid)
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import multiprocessing
+
+JOBDB = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "cache" + os.path.sep + "jobs.sqlite"
+
+# seconds a queued job may run, instead of the 15 s of a request
+JOBTIMEOUT = 600
+
+# seconds an idle worker waits before looking at the queue again
+POLL = 0.5
+
+# worker processes started by default
+WORKERS = 2
+
+SCHEMA = """create table if not exists jobs (
+    id text primary key, state text, args text, submitted real, started real,
+    finished real, stage text, progress real, pid integer, result text)"""
+
+
+def connect(db=JOBDB):
+    """ connection to the queue, created on first use """
+
+    os.makedirs(os.path.dirname(db), exist_ok=True)
+    conn = sqlite3.connect(db, timeout=30, isolation_level=None)
+    conn.execute("pragma journal_mode=wal")
+    conn.execute(SCHEMA)
+    return conn
+
+
+def submit(args, db=JOBDB):
+    """ queue a workflow job, returns its id """
+
+    jobid = uuid.uuid4().hex
+    conn = connect(db)
+    try:
+        conn.execute("insert into jobs (id, state, args, submitted, stage, progress) values (?, 'queued', ?, ?, 'queued', 0)",
+                     (jobid, json.dumps(args), time.time()))
+    finally:
+        conn.close()
+    return jobid
+
+
+def status(jobid, db=JOBDB):
+    """ state, queue position (0: not queued), stage and progress of a
+        job, None for an unknown id
+    """
+
+    conn = connect(db)
+    try:
+        row = conn.execute("select state, submitted, started, finished, stage, progress from jobs where id = ?",
+                           (jobid,)).fetchone()
+        if row is None:
+            return None
+        state, submitted, started, finished, stage, progress = row
+        position = 0
+        if state == 'queued':
+            position = conn.execute("select count(*) from jobs where state = 'queued' and submitted <= ?",
+                                    (submitted,)).fetchone()[0]
+    finally:
+        conn.close()
+
+    return {"job": jobid, "state": state, "position": position, "stage": stage, "progress": progress,
+            "submitted": submitted, "started": started, "finished": finished}
+
+
+def result(jobid, db=JOBDB):
+    """ summary of a finished job, None while it is queued or running """
+
+    conn = connect(db)
+    try:
+        row = conn.execute("select result from jobs where id = ?", (jobid,)).fetchone()
+    finally:
+        conn.close()
+    if row is None or row[0] is None:
+        return None
+    return json.loads(row[0])
+
+
+def queued(db=JOBDB):
+    """ number of jobs waiting for a worker """
+
+    conn = connect(db)
+    try:
+        return conn.execute("select count(*) from jobs where state = 'queued'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def claim(conn):
+    """ mark the oldest queued job running, returns (id, args) or None """
+
+    conn.execute("begin immediate")
+    try:
+        row = conn.execute("select id, args from jobs where state = 'queued' order by submitted limit 1").fetchone()
+        if row is not None:
+            conn.execute("update jobs set state = 'running', started = ?, stage = 'started', pid = ? where id = ?",
+                         (time.time(), os.getpid(), row[0]))
+        conn.execute("commit")
+    except BaseException:
+        conn.execute("rollback")
+        raise
+    return None if row is None else (row[0], json.loads(row[1]))
+
+
+def finish(conn, jobid, summary):
+    """ store the summary and the final state of a job """
+
+    # a batch with some failed items is done, its items tell which
+    state = 'success' if summary.get('status') in ['success', 'partial'] else 'failed'
+    conn.execute("update jobs set state = ?, finished = ?, stage = 'finished', progress = 1, result = ? where id = ?",
+                 (state, time.time(), json.dumps(summary), jobid))
+
+
+def recover(db=JOBDB):
+    """ fail the running jobs of workers that no longer exist """
+
+    conn = connect(db)
+    try:
+        for jobid, pid in conn.execute("select id, pid from jobs where state = 'running'").fetchall():
+            try:
+                os.kill(pid, 0)
+            except (OSError, TypeError):
+                finish(conn, jobid, {"status": "failed", "error": "worker exited"})
+    finally:
+        conn.close()
+
+
+def work(db=JOBDB, poll=POLL, timeout=JOBTIMEOUT):
+    """ worker loop: run queued jobs one at a time
+
+        timeout: seconds of a job without its own timeout argument, of
+                 every item of a batch or run of a sweep
+    """
+
+    # imported here so that submitting does not load the workflow
+    from disloc_exec import dislocworkflow
+    from dislocbatch import batchworkflow
+    from dislocsweep import sweepworkflow
+
+    conn = connect(db)
+    while True:
+        job = claim(conn)
+        if job is None:
+            time.sleep(poll)
+            continue
+        jobid, args = job
+
+        def progress(stage, fraction):
+            conn.execute("update jobs set stage = ?, progress = ? where id = ?", (stage, fraction, jobid))
+
+        try:
+            jobtimeout = float(args.pop('timeout', None) or timeout)
+            if 'batch' in args:
+                summary = batchworkflow(args, progress=progress, timeout=jobtimeout)
+            elif 'sweep' in args:
+                summary = sweepworkflow(args, progress=progress, timeout=jobtimeout)
+            else:
+                summary = dislocworkflow(args, progress=progress, timeout=jobtimeout)
+        except Exception as e:
+            summary = {"status": "failed", "error": str(e)}
+        finish(conn, jobid, summary)
+
+
+def serve(workers=WORKERS, db=JOBDB, timeout=JOBTIMEOUT):
+    """ run a pool of workers until interrupted """
+
+    recover(db)
+    pool = [multiprocessing.Process(target=work, args=(db, POLL, timeout)) for i in range(workers)]
+    for process in pool:
+        process.start()
+    try:
+        for process in pool:
+            process.join()
+    except KeyboardInterrupt:
+        for process in pool:
+            process.terminate()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Run disloc workflow jobs from the queue.")
+    parser.add_argument('-n','--workers', action='store',dest='workers',type=int,default=WORKERS,help='worker processes, default: %d' % WORKERS)
+    parser.add_argument('-t','--timeout', action='store',dest='timeout',type=float,default=JOBTIMEOUT,help='seconds a job may run, default: %d' % JOBTIMEOUT)
+    args = parser.parse_args()
+    serve(args.workers, timeout=args.timeout)
+
+
+if __name__ == "__main__":
+    main()
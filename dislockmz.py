@@ -0,0 +1,122 @@
+"""
+    dislockmz.py
+        -- KMZ of an interferogram overlay assembled in memory from the
+           KML text and the encoded PNG
+        -- the PNG and the legend are stored as they are (ZIP_STORED, PNG
+           is already deflated), only the KML is compressed; the legend
+           2pi.png is read once per process
+        -- artifacts are written once through a temporary name and a
+           rename, or streamed without touching the disk
+
+    artifacts of an overlay [name]: [name].png, [name].kml, [name].kmz;
+    ARTIFACTS lists the ones written by default
+"""
+
+import io
+import os
+import time
+import zipfile
+import tempfile
+import threading
+
+LEGENDFILE = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "2pi.png"
+
+# files written by default, as before the in-memory builder
+ARTIFACTS = ["png", "kml", "kmz"]
+
+KMZTYPE = "application/vnd.google-earth.kmz"
+
+# bytes per block of a streamed response
+STREAMBLOCK = 64*1024
+
+_legend = None
+_lock = threading.Lock()
+
+
+def legend():
+    """ bytes of 2pi.png, read on first use """
+
+    global _legend
+
+    with _lock:
+        if _legend is None:
+            with open(LEGENDFILE, "rb") as f:
+                _legend = f.read()
+        return _legend
+
+
+def parseartifacts(value=None):
+    """ artifact kinds from a list or a comma separated string, None: ARTIFACTS """
+
+    if value is None:
+        return list(ARTIFACTS)
+    if isinstance(value, str):
+        value = [] if value.strip() in ["", "none"] else value.split(",")
+    kinds = [kind.strip() for kind in value]
+    for kind in kinds:
+        if kind not in ARTIFACTS:
+            raise ValueError("unknown artifact: %s" % kind)
+    return kinds
+
+
+def entry(name, compression):
+    """ zip entry stamped with the current time """
+
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = compression
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def kmzbytes(kmlname, kml, pngname, pngdata):
+    """ KMZ holding the KML, the PNG and the legend """
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as kmz:
+        kmz.writestr(entry(kmlname, zipfile.ZIP_DEFLATED), kml)
+        kmz.writestr(entry(pngname, zipfile.ZIP_STORED), pngdata)
+        kmz.writestr(entry("2pi.png", zipfile.ZIP_STORED), legend())
+    return buffer.getvalue()
+
+
+def writeatomic(path, data):
+    """ write bytes to path through a temporary file and a rename """
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, path)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+
+
+def writekmz(outputfile, kmlname, kml, pngname, pngfile):
+    """ write a KMZ through a temporary file and a rename, the PNG is
+        copied from pngfile in blocks instead of being held in memory
+    """
+
+    directory = os.path.dirname(os.path.abspath(outputfile))
+    fd, tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmpname, "w") as kmz:
+            kmz.writestr(entry(kmlname, zipfile.ZIP_DEFLATED), kml)
+            kmz.write(pngfile, pngname, compress_type=zipfile.ZIP_STORED)
+            kmz.writestr(entry("2pi.png", zipfile.ZIP_STORED), legend())
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, outputfile)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+
+
+def stream(data, blocksize=STREAMBLOCK):
+    """ bytes in blocks, for a streamed HTTP response body """
+
+    view = memoryview(data)
+    for start in range(0, len(view), blocksize):
+        yield bytes(view[start:start + blocksize])
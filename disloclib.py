@@ -0,0 +1,130 @@
+"""
+    disloclib.py
+        -- ctypes wrapper for libdisloc.so, disloc.c built as a shared library
+        -- same numerics as the disloc binary without a fork, an input
+           file or a text output file
+
+    compile:
+        gcc -shared -fPIC -DDISLOC_LIBRARY disloc.c -o libdisloc.so -lm
+"""
+
+import os
+import ctypes
+import threading
+
+import numpy as np
+
+import dislocengine
+
+
+class FaultRecord(ctypes.Structure):
+    """ struct faultrec in disloc.c """
+
+    _fields_ = [("x", ctypes.c_float),
+                ("y", ctypes.c_float),
+                ("strike", ctypes.c_float),
+                ("type", ctypes.c_int),
+                ("d", ctypes.c_float),
+                ("delta", ctypes.c_float),
+                ("lambda_", ctypes.c_float),
+                ("mu", ctypes.c_float),
+                ("u1", ctypes.c_float),
+                ("u2", ctypes.c_float),
+                ("u3", ctypes.c_float),
+                ("l", ctypes.c_float),
+                ("w", ctypes.c_float)]
+
+
+# disloc.c keeps its state in globals, one call at a time per process
+_lock = threading.Lock()
+_library = None
+
+
+def getlibrary():
+    """ load libdisloc.so from the script location """
+
+    global _library
+
+    if _library is None:
+        script_path = os.path.dirname(os.path.realpath(__file__))
+        library = ctypes.CDLL(script_path + os.path.sep + "libdisloc.so")
+        floatp = np.ctypeslib.ndpointer(dtype=np.float32, flags="C_CONTIGUOUS")
+        doublep = np.ctypeslib.ndpointer(dtype=np.float64, flags="C_CONTIGUOUS")
+        library.disloc_points.argtypes = [ctypes.c_int, floatp, floatp, ctypes.c_int,
+                                          ctypes.POINTER(FaultRecord), doublep, doublep]
+        library.disloc_points.restype = ctypes.c_int
+        library.disloc_strains.argtypes = [ctypes.c_int]
+        library.disloc_strains.restype = None
+        _library = library
+
+    return _library
+
+
+def faultrecords(faults):
+    """ convert engine fault dicts to an array of struct faultrec """
+
+    records = (FaultRecord*len(faults))()
+    for record, item in zip(records, faults):
+        record.x = item['x']
+        record.y = item['y']
+        record.strike = item['strike']
+        record.type = item['type']
+        record.d = item['depth']
+        record.delta = item['dip']
+        record.lambda_ = item['lambda']
+        record.mu = item['mu']
+        record.u1 = item['u1']
+        record.u2 = item['u2']
+        record.u3 = item['u3']
+        record.l = item['length']
+        record.w = item['width']
+    return records
+
+
+def evaluate(model, xo, yo, products="all", look=None):
+    """ sum the contribution of every fault at the points xo, yo
+
+        same arguments and return value as dislocengine.evaluate;
+        displacement and los skip the strains in disloc.c, strain still
+        computes the displacements
+    """
+
+    library = getlibrary()
+
+    xo = np.ascontiguousarray(xo, dtype=np.float32)
+    yo = np.ascontiguousarray(yo, dtype=np.float32)
+    npts = len(xo)
+    records = faultrecords(model['faults'])
+    out = np.zeros((npts, 6))
+    xy = np.zeros((npts, 2))
+
+    with _lock:
+        library.disloc_strains(int(products in ["all", "strain"]))
+        status = library.disloc_points(npts, xo, yo, len(records), records, out, xy)
+    if status < 0:
+        raise MemoryError("disloc_points: out of memory")
+
+    result = {"x": xy[:, 0], "y": xy[:, 1]}
+    for i, name in enumerate(dislocengine.COMPONENTS):
+        result[name] = out[:, i]
+
+    return dislocengine.selectproducts(result, products, look)
+
+
+def disloc(model):
+    """ run the model on all observation points, see dislocengine.disloc """
+
+    return dislocengine.disloc(model, evaluator=evaluate)
+
+
+def main():
+
+    # test case: compare with disloc binary output
+    with open("test/4fault.txt") as f:
+        model = dislocengine.readinput(f.read())
+    result = disloc(model)
+    dislocengine.writeoutput(result, "test/4fault.library.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+    dislocmetrics.py
+        -- stage timing of a workflow job and metrics of all jobs
+        -- dislocworkflow() records its stages in the thread that runs
+           it: input, cache, engine, raster, parse, los, colorize, png,
+           kml; the time of a stage does not include the stages
+           inside it, e.g. png encoding pulls colored rows from the
+           streamed table
+        -- every job adds its counts and times to cache/metrics.json,
+           shared by the processes of this host (service, pool and job
+           workers), shown by /dislocservice/metrics in the Prometheus
+           text format
+
+    rss of a stage: peak resident bytes of the process at the end of the
+    stage, ru_maxrss; the peak of the job includes jobs run before it in
+    the same process
+
+    usage:
+        with recording(Stages()) as stages:
+            with stage("engine"):
+                ...
+        stages.summary()
+"""
+
+import os
+import json
+import time
+import fcntl
+import tempfile
+import threading
+import contextlib
+
+import disloccost
+
+METRICSFILE = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "cache" + os.path.sep + "metrics.json"
+
+# upper bounds of the histogram buckets, seconds and bytes
+SECONDBUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+BYTEBUCKETS = [2**26, 2**27, 2**28, 2**29, 2**30, 2**31, 2**32, 2**33]
+
+COUNTERS = ["jobs", "failures", "timeouts", "cache_hits", "cache_misses"]
+
+_local = threading.local()
+
+
+class Stages(object):
+    """ wall time and peak rss of the stages of one job """
+
+    def __init__(self):
+        self.start = time.time()
+        self.stages = {}
+        self.stack = []
+        self.timeout = False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ time a stage, less the stages inside it """
+
+        frame = [time.time(), 0.0]
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            elapsed = time.time() - frame[0]
+            if self.stack:
+                self.stack[-1][1] += elapsed
+            record = self.stages.setdefault(name, {"seconds": 0.0, "rss": 0})
+            record['seconds'] += elapsed - frame[1]
+            record['rss'] = max(record['rss'], disloccost.peakmemory())
+
+    def summary(self, job=None):
+        """ timing of summary.json: seconds, peak rss, the size of the
+            job (disloccost.size()) and the stages
+        """
+
+        timing = {"seconds": time.time() - self.start, "rss": disloccost.peakmemory()}
+        if job is not None:
+            timing.update(grid=job['grid'], points=job['points'], faults=job['faults'])
+        timing['stages'] = {name: dict(record) for name, record in self.stages.items()}
+        return timing
+
+
+@contextlib.contextmanager
+def recording(stages):
+    """ stages of the workflow run in this thread go to stages """
+
+    previous = getattr(_local, 'stages', None)
+    _local.stages = stages
+    try:
+        yield stages
+    finally:
+        _local.stages = previous
+
+
+def current():
+    """ Stages of the job of this thread, None outside a job """
+
+    return getattr(_local, 'stages', None)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """ time a stage of the job of this thread, nothing outside a job """
+
+    stages = current()
+    if stages is None:
+        yield
+    else:
+        with stages.stage(name):
+            yield
+
+
+def histogram(buckets):
+    """ empty histogram: counts per bucket and one above, sum, count """
+
+    return {"counts": [0]*(len(buckets) + 1), "sum": 0.0, "count": 0}
+
+
+def observe(hist, buckets, value):
+    """ add a value to a histogram """
+
+    k = 0
+    while k < len(buckets) and value > buckets[k]:
+        k += 1
+    hist['counts'][k] += 1
+    hist['sum'] += value
+    hist['count'] += 1
+
+
+def load(metricsfile=METRICSFILE):
+    """ metrics of the jobs of this host, empty before the first job """
+
+    try:
+        with open(metricsfile) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"counters": dict.fromkeys(COUNTERS, 0), "job": histogram(SECONDBUCKETS),
+                "rss": histogram(BYTEBUCKETS), "stages": {}}
+
+
+def record(status, stages, metricsfile=METRICSFILE):
+    """ add a finished job to the metrics of this host """
+
+    cache = status.get('cache') or {}
+    os.makedirs(os.path.dirname(metricsfile), exist_ok=True)
+    with open(metricsfile + ".lock", "a") as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        metrics = load(metricsfile)
+        counters = metrics['counters']
+        counters['jobs'] += 1
+        counters['failures'] += status.get('status') != 'success'
+        counters['timeouts'] += bool(stages.timeout)
+        if 'hit' in cache:
+            counters['cache_hits' if cache['hit'] else 'cache_misses'] += 1
+        observe(metrics['job'], SECONDBUCKETS, time.time() - stages.start)
+        observe(metrics['rss'], BYTEBUCKETS, disloccost.peakmemory())
+        for name, item in stages.stages.items():
+            observe(metrics['stages'].setdefault(name, histogram(SECONDBUCKETS)), SECONDBUCKETS, item['seconds'])
+
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(metricsfile), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(json.dumps(metrics))
+        os.replace(tmpname, metricsfile)
+
+
+def histogramlines(name, hist, buckets, labels=""):
+    """ Prometheus lines of one histogram, cumulative buckets """
+
+    lines = []
+    total = 0
+    for bound, count in zip([repr(float(b)) for b in buckets] + ["+Inf"], hist['counts']):
+        total += count
+        lines.append('%s_bucket{%sle="%s"} %d' % (name, labels, bound, total))
+    labels = "{%s}" % labels.rstrip(",") if labels else ""
+    lines.append("%s_sum%s %r" % (name, labels, float(hist['sum'])))
+    lines.append("%s_count%s %d" % (name, labels, hist['count']))
+    return lines
+
+
+def prometheus(metricsfile=METRICSFILE):
+    """ the metrics of this host in the Prometheus text format """
+
+    metrics = load(metricsfile)
+    helps = {"jobs": "Workflow jobs run.", "failures": "Workflow jobs failed.",
+             "timeouts": "Workflow jobs whose disloc run timed out.",
+             "cache_hits": "Jobs served from the result cache.", "cache_misses": "Jobs run and added to the result cache."}
+    lines = []
+    for key in COUNTERS:
+        name = "disloc_%s_total" % key
+        lines += ["# HELP %s %s" % (name, helps[key]), "# TYPE %s counter" % name,
+                  "%s %d" % (name, metrics['counters'].get(key, 0))]
+
+    lines += ["# HELP disloc_job_seconds Wall time of a workflow job.", "# TYPE disloc_job_seconds histogram"]
+    lines += histogramlines("disloc_job_seconds", metrics['job'], SECONDBUCKETS)
+    lines += ["# HELP disloc_job_rss_bytes Peak resident bytes of the process at the end of a job.",
+              "# TYPE disloc_job_rss_bytes histogram"]
+    lines += histogramlines("disloc_job_rss_bytes", metrics['rss'], BYTEBUCKETS)
+    lines += ["# HELP disloc_stage_seconds Wall time of a workflow stage, without the stages inside it.",
+              "# TYPE disloc_stage_seconds histogram"]
+    for name in sorted(metrics['stages']):
+        lines += histogramlines("disloc_stage_seconds", metrics['stages'][name], SECONDBUCKETS, 'stage="%s",' % name)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,164 @@
+"""
+    dislocpalette.py
+        -- color lookup tables for the interferogram images
+        -- a palette is a loader that builds its (n, 3) rgb table and an
+           index function that maps the image values to integer rows of
+           it; tables are built once per process, an image is colored
+           with one fancy-indexing operation
+
+    palettes:
+        uavsar      colortable.csv, 201 levels, row = level + 100
+        wheel       Goldstein color wheel, 15 levels at brightness 14
+        wheelflip   same with the colors in reverse order
+
+    usage:
+        rgb = colorize(z, "uavsar")          # z: (npts,) array
+        register("gray", loader, index)      # loader() -> (n, 3) array,
+                                             # index(z, bounds) -> rows
+"""
+
+import os
+import math
+import threading
+
+import numpy as np
+
+COLORTABLE = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "colortable.csv"
+
+# levels of colortable.csv are -OFFSET ... OFFSET
+OFFSET = 100
+
+# brightness row of the color wheel used for images
+BRIGHTNESS = 14
+
+_palettes = {}
+_tables = {}
+_lock = threading.Lock()
+
+
+def register(name, loader, index):
+    """ add a palette, replaces one of the same name
+
+        loader(): returns the (n, 3) rgb table in [0, 1]
+        index(z, bounds): returns integer rows of the table for the
+                          values z, bounds: (min, max) of the whole
+                          image, None: those of z
+    """
+
+    with _lock:
+        _palettes[name] = (loader, index)
+        _tables.pop(name, None)
+
+
+def names():
+    """ registered palette names """
+
+    return sorted(_palettes)
+
+
+def table(name):
+    """ rgb table of a palette, loaded on first use """
+
+    if name not in _palettes:
+        raise ValueError("unknown palette: %s" % name)
+    with _lock:
+        if name not in _tables:
+            _tables[name] = np.asarray(_palettes[name][0](), dtype=np.float64)
+        return _tables[name]
+
+
+def colorize(z, name, bounds=None):
+    """ (npts, 3) rgb values of z
+
+        bounds: (min, max) the colors are scaled to, when z is a part of
+                the image; None: the range of z
+    """
+
+    lut = table(name)
+    return lut[_palettes[name][1](np.asarray(z), bounds)]
+
+
+def scaled(z, levels, bounds=None):
+    """ z mapped linearly onto 0 ... levels """
+
+    minz, maxz = (np.nanmin(z), np.nanmax(z)) if bounds is None else bounds
+    return (z - minz)/(maxz - minz)*levels
+
+
+def uavsartable():
+    """ rows of colortable.csv (level, r, g, b, alpha) at level + OFFSET """
+
+    rows = np.loadtxt(COLORTABLE, delimiter=",", ndmin=2)
+    lut = np.zeros((2*OFFSET + 1, 3))
+    lut[rows[:, 0].astype(int) + OFFSET] = rows[:, 1:4]
+    return lut
+
+
+def uavsarindex(z, bounds=None):
+    """ 201 levels, nan is colored by the first row """
+
+    with np.errstate(invalid='ignore'):
+        level = np.fix(scaled(z, 2*OFFSET, bounds))
+    level[np.isnan(level)] = 0
+    return level.astype(int)
+
+
+def color_wheel(fcw):
+    """ make goldstein color wheel """
+
+    #fcw=1 flips order of colors
+    wheel = [[None]*16 for i in range(3)]
+    for i in range(16):
+        if i==0:
+            ib=255
+            ir=ib
+            ig=ib
+        elif i>=1 and i<=5:
+            ib = 255
+            ir = (i-1)*51
+            ig = 255 - 51*(i-1)
+        elif i>=6 and i<=10:
+            ir = 255
+            ig = (i-6)*51
+            ib = 255 - (i-6)*51
+        elif i>=11 and i<=15:
+            ig = 255
+            ib = (i-11)*51
+            ir = 255 -(i-11)*51
+        else:
+            print("something wrong!")
+        wheel[0][i]=math.floor(ir/255.0*225)+30
+        wheel[1][i]=math.floor(ig/255.0*225)+30
+        wheel[2][i]=math.floor(ib/255.0*225)+30
+
+    if fcw == 1:
+        #flip the color wheel
+        for i in range(3):
+            junk = wheel[i][1:]
+            junk.reverse()
+            wheel[i][1:]=junk
+
+    colormatrx = []
+    for j in range(256):
+        mag = math.floor(j/16)
+        i = j % 16
+        red = math.floor(mag/16.0*wheel[0][i]*16/15)
+        green = math.floor(mag/16.0*wheel[1][i]*16/15)
+        blue = math.floor(mag/16.0*wheel[2][i]*16/15)
+        colormatrx.append([red/255.0,green/255.0,blue/255.0])
+
+    return colormatrx
+
+
+def wheelindex(z, bounds=None):
+    """ levels 1 ... 15, nan is colored by row 0 """
+
+    with np.errstate(invalid='ignore'):
+        level = np.fix(scaled(z, 14, bounds) + 0.001) + 1
+    level[np.isnan(level) | (level < 0)] = 0
+    return level.astype(int)
+
+
+register("uavsar", uavsartable, uavsarindex)
+register("wheel", lambda: color_wheel(0)[(BRIGHTNESS - 1)*16:BRIGHTNESS*16], wheelindex)
+register("wheelflip", lambda: color_wheel(1)[(BRIGHTNESS - 1)*16:BRIGHTNESS*16], wheelindex)
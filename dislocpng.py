@@ -0,0 +1,135 @@
+"""
+    dislocpng.py
+        -- PNG writer for the interferogram overlays without matplotlib
+        -- the rgb image is flipped (origin lower as in imshow), scaled by
+           an integer factor with bilinear or nearest resampling, given a
+           constant alpha and compressed block by block with zlib
+
+    the defaults give the size of the matplotlib path of drawimage():
+    a figure of nx/12 x ny/12 inches saved at 96 dpi is 8 pixels per point
+
+    usage:
+        writepng("output.png", rgb)               # rgb: (ny, nx, 3) in [0, 1]
+        data = b"".join(pngchunks(rgb, scale=1))
+"""
+
+import zlib
+import struct
+
+import numpy as np
+
+# output pixels per grid point
+SCALE = 8
+
+# opacity of the overlay, imshow(alpha=0.9) in drawimage
+ALPHA = 0.9
+
+# output rows per compressed block, bounds the memory of the scaled rows
+BLOCKROWS = 256
+
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def chunk(tag, data):
+    """ one PNG chunk: length, tag, data, crc """
+
+    return struct.pack("!I", len(data)) + tag + data + struct.pack("!I", zlib.crc32(tag + data) & 0xffffffff)
+
+
+def weights(n, scale, resample):
+    """ input indices and weights of n*scale output samples
+
+        returns (i0, i1, f): output k = (1 - f)*input[i0] + f*input[i1],
+        sample centres are aligned as in imshow
+    """
+
+    if resample == "nearest":
+        i0 = np.repeat(np.arange(n), scale)
+        return i0, i0, np.zeros(n*scale)
+    if resample != "bilinear":
+        raise ValueError("unknown resampling: %s" % resample)
+
+    u = np.clip((np.arange(n*scale) + 0.5)/scale - 0.5, 0, n - 1)
+    i0 = np.floor(u).astype(int)
+    i1 = np.minimum(i0 + 1, n - 1)
+    return i0, i1, u - i0
+
+
+class FlippedRows(object):
+    """ rows of an rgb array, origin lower: the top row is the last one
+
+        any object with shape (ny, nx, 3) and rows(index) returning the
+        (k, nx, 3) rows at top-first indices can be given to pngchunks()
+        instead of an array, e.g. to color rows only when they are written
+    """
+
+    def __init__(self, rgb):
+        self.rgb = np.asarray(rgb)
+        self.shape = self.rgb.shape
+
+    def rows(self, index):
+        return self.rgb[self.shape[0] - 1 - index]
+
+
+def scaledrows(rgb, scale=SCALE, resample="bilinear", alpha=ALPHA, blockrows=BLOCKROWS):
+    """ (k, nx*scale, 4) uint8 blocks of the flipped, scaled image, top first
+
+        rgb: (ny, nx, 3) array or a row source, see FlippedRows
+    """
+
+    source = rgb if hasattr(rgb, "rows") else FlippedRows(rgb)
+    ny, nx = source.shape[:2]
+    x0, x1, fx = weights(nx, scale, resample)
+    y0, y1, fy = weights(ny, scale, resample)
+    fx = fx[None, :, None]
+    opacity = int(alpha*255)
+
+    for start in range(0, ny*scale, blockrows):
+        stop = min(start + blockrows, ny*scale)
+        # only the input rows this block needs, resampled along x
+        need = np.unique(np.concatenate([y0[start:stop], y1[start:stop]]))
+        rows = source.rows(need).astype(np.float64)
+        rows = (1 - fx)*rows[:, x0] + fx*rows[:, x1]
+        a = np.searchsorted(need, y0[start:stop])
+        b = np.searchsorted(need, y1[start:stop])
+        f = fy[start:stop, None, None]
+        block = np.empty((stop - start, nx*scale, 4), dtype=np.uint8)
+        # truncated as Agg does, within one level of the matplotlib path
+        block[:, :, :3] = np.floor(((1 - f)*rows[a] + f*rows[b])*255 + 1e-6)
+        block[:, :, 3] = opacity
+        yield block
+
+
+def pngchunks(rgb, scale=SCALE, resample="bilinear", alpha=ALPHA, level=6):
+    """ PNG file of an rgb image (array or row source) as a sequence of byte strings """
+
+    ny, nx = (rgb.shape if hasattr(rgb, "rows") else np.shape(rgb))[:2]
+    yield SIGNATURE
+    # 8 bit rgba, no interlace
+    yield chunk(b"IHDR", struct.pack("!IIBBBBB", nx*scale, ny*scale, 8, 6, 0, 0, 0))
+    compressor = zlib.compressobj(level)
+    previous = None
+    for block in scaledrows(rgb, scale, resample, alpha):
+        # filter type 2 (up): difference to the row above, the rows
+        # repeated by the upscaling compress to almost nothing
+        rows = block.reshape(block.shape[0], -1)
+        above = np.empty_like(rows)
+        above[0] = 0 if previous is None else previous
+        above[1:] = rows[:-1]
+        previous = rows[-1]
+        raw = np.empty((rows.shape[0], 1 + rows.shape[1]), dtype=np.uint8)
+        raw[:, 0] = 2
+        raw[:, 1:] = rows - above
+        data = compressor.compress(raw.tobytes())
+        if data:
+            yield chunk(b"IDAT", data)
+    yield chunk(b"IDAT", compressor.flush())
+    yield chunk(b"IEND", b"")
+
+
+def writepng(outputfile, rgb, scale=SCALE, resample="bilinear", alpha=ALPHA, level=6):
+    """ write an rgb image as an rgba PNG file """
+
+    with open(outputfile, "wb") as f:
+        for data in pngchunks(rgb, scale, resample, alpha, level):
+            f.write(data)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+    dislocpool.py
+        -- pre-forked pool of warm workflow workers on a local socket
+        -- the server imports the workflow, loads the color tables, the
+           legend, libdisloc.so and matplotlib once, then forks the
+           workers, which share those pages and accept jobs on the same
+           listening socket; a job costs only its own work
+        -- clients (disloc_exec.py, the service) send the workflow
+           arguments over multiprocessing.connection and get the status
+           and the in-memory artifacts back; without a running pool they
+           run the workflow themselves
+
+    the socket is cache/pool.sock, clients authenticate with the key in
+    cache/pool.key, readable only by the user running the pool
+
+    usage:
+        python dislocpool.py -n 4          # start 4 workers
+        status = run({"input": text, "engine": "numpy"})   # None: no pool
+"""
+
+import os
+import sys
+import signal
+import argparse
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+
+POOLDIR = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "cache"
+ADDRESS = POOLDIR + os.path.sep + "pool.sock"
+KEYFILE = POOLDIR + os.path.sep + "pool.key"
+
+# worker processes started by default
+WORKERS = 2
+
+
+def authkey():
+    """ key of the running pool, None when there is none """
+
+    try:
+        with open(KEYFILE, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def available():
+    """ true if a pool is listening """
+
+    return os.path.exists(ADDRESS) and authkey() is not None
+
+
+def run(args, store=None, timeout=None):
+    """ dislocworkflow(args, store, timeout) in a pool worker, timeout
+        None: the default of the workflow
+
+        input files are read and the working dir made absolute here, the
+        current dir of this process without one, the workers run in the
+        current dir of the pool
+        returns the status, None when no pool is running; a failed status
+        when the worker exits during the job
+    """
+
+    if not available():
+        return None
+    args = dict(args)
+    if 'inputfile' in args:
+        with open(args.pop('inputfile')) as f:
+            args['input'] = f.read()
+    args['workdir'] = os.path.abspath(args.get('workdir') or os.getcwd())
+
+    try:
+        conn = Client(ADDRESS, family="AF_UNIX", authkey=authkey())
+    except (OSError, multiprocessing.AuthenticationError):
+        # stale socket of a pool that is gone
+        return None
+    with conn:
+        try:
+            conn.send(("workflow", args, store is not None, timeout))
+        except OSError:
+            # the pool stopped after accepting
+            return None
+        try:
+            status, artifacts = conn.recv()
+        except (EOFError, OSError):
+            return {"status": "failed", "error": "pool worker exited during the job"}
+    if store is not None:
+        store.update(artifacts)
+    return status
+
+
+def warmup():
+    """ import and load everything a job needs, before the fork """
+
+    import disloc_exec
+    import dislocpalette
+    import dislockmz
+    import disloclib
+    import SARImage
+
+    for name in dislocpalette.names():
+        dislocpalette.table(name)
+    dislockmz.legend()
+    try:
+        disloclib.getlibrary()
+    except OSError:
+        pass
+    try:
+        SARImage.pyplot()
+    except ImportError:
+        pass
+    return disloc_exec.dislocworkflow
+
+
+def work(listener, workflow):
+    """ worker loop: one connection, one or more jobs, at a time """
+
+    while True:
+        try:
+            conn = listener.accept()
+        except (OSError, multiprocessing.AuthenticationError):
+            continue
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    break
+                kind, args, wantstore, timeout = request
+                store = {} if wantstore else None
+                try:
+                    if kind != "workflow":
+                        raise ValueError("unknown request: %s" % kind)
+                    if timeout is None:
+                        status = workflow(args, store=store)
+                    else:
+                        status = workflow(args, store=store, timeout=timeout)
+                except Exception as e:
+                    status = {"status": "failed", "error": str(e)}
+                conn.send((status, store or {}))
+
+
+def serve(workers=WORKERS):
+    """ start the workers and wait until interrupted """
+
+    workflow = warmup()
+
+    os.makedirs(POOLDIR, exist_ok=True)
+    if os.path.exists(ADDRESS):
+        os.remove(ADDRESS)
+    key = os.urandom(32)
+    listener = Listener(ADDRESS, family="AF_UNIX", authkey=key)
+    os.chmod(ADDRESS, 0o600)
+    fd = os.open(KEYFILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+
+    context = multiprocessing.get_context("fork")
+    pool = [context.Process(target=work, args=(listener, workflow)) for i in range(workers)]
+    for process in pool:
+        process.start()
+    # stopped by ctrl-c or kill, also when started in the background
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for process in pool:
+            process.join()
+    except (KeyboardInterrupt, SystemExit):
+        for process in pool:
+            process.terminate()
+    finally:
+        listener.close()
+        for path in [KEYFILE, ADDRESS]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Run a pool of warm disloc workflow workers.")
+    parser.add_argument('-n','--workers', action='store',dest='workers',type=int,default=WORKERS,help='worker processes, default: %d' % WORKERS)
+    args = parser.parse_args()
+    serve(args.workers)
+
+
+if __name__ == "__main__":
+    main()
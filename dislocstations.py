@@ -0,0 +1,135 @@
+"""
+    dislocstations.py
+        -- station (scatter) predictions for large lon/lat station lists,
+           dense GNSS networks or InSAR point clouds
+        -- the station file is read CHUNKSIZE lines at a time, each chunk
+           is converted to x, y, evaluated and appended to the output before
+           the next one is read, so memory does not grow with the stations
+
+    station file: one station per line, blank and # lines are skipped
+        lon lat [site]
+    output, mbh-style as disloc_table.c (site "." when not given):
+        Site Lon Lat DeltaE DeltaN DeltaV sig sig sig
+
+    usage:
+        model = dislocengine.readinput(open("test/4fault.txt").read())
+        stats = predict(model, "stations.txt", "stations.output.txt")
+"""
+
+import math
+import time
+import itertools
+
+import numpy as np
+
+import dislocengine
+
+# stations per chunk, bounds the memory of one evaluation
+CHUNKSIZE = 100000
+
+# placeholder sigma of the mbh-style table (sigdum in disloc_table.c)
+SIGMA = 10.0
+
+LINEFORMAT = "%s%12f%12f%12f%12f%12f%12f%12f%12f\n"
+
+
+def lonlatfactors(lat):
+    """ km per degree of lon and lat at lat, see xy2lat() in disloc_table.c """
+
+    d2r = math.pi/180.0
+    lonfactor = d2r*math.cos(d2r*lat)*(6378.139*(1.0 - math.sin(d2r*lat)*math.sin(d2r*lat)/298.247))
+    latfactor = 111.32
+
+    return lonfactor, latfactor
+
+
+def xy2lonlat(x, y, ref):
+    """ x, y arrays in km to lon, lat arrays, ref: [lon, lat] of the origin """
+
+    lonfactor, latfactor = lonlatfactors(ref[1])
+
+    return np.asarray(x)/lonfactor + ref[0], np.asarray(y)/latfactor + ref[1]
+
+
+def lonlat2xy(lon, lat, ref):
+    """ lon, lat arrays to x, y arrays in km, inverse of xy2lonlat """
+
+    lonfactor, latfactor = lonlatfactors(ref[1])
+
+    return (np.asarray(lon) - ref[0])*lonfactor, (np.asarray(lat) - ref[1])*latfactor
+
+
+def readstations(f, chunksize=CHUNKSIZE):
+    """ read an open station file in chunks
+
+        yields (sites, lon, lat) per chunk, lon/lat as float64 arrays
+    """
+
+    lines = (line for line in f if line.strip() and not line.lstrip().startswith("#"))
+    count = 0
+    while True:
+        chunk = list(itertools.islice(lines, chunksize))
+        if not chunk:
+            return
+        sites = []
+        lonlat = np.empty((len(chunk), 2))
+        for k, line in enumerate(chunk):
+            tokens = line.split()
+            try:
+                lonlat[k] = [float(tokens[0]), float(tokens[1])]
+            except (ValueError, IndexError):
+                raise ValueError("bad station line %d" % (count + k + 1))
+            sites.append(tokens[2] if len(tokens) > 2 else ".")
+        count += len(chunk)
+        yield sites, lonlat[:, 0], lonlat[:, 1]
+
+
+def predict(model, stationfile, outputfile, evaluator=None, chunksize=CHUNKSIZE):
+    """ evaluate the faults of model at the stations in stationfile
+
+        the origin of the model (line 1) is the reference of the station
+        coordinates, its grid or point list is not used; the output is
+        written chunk by chunk
+        returns stats: stations, chunks, patches, seconds, throughput
+    """
+
+    if evaluator is None:
+        evaluator = dislocengine.evaluate
+
+    starttime = time.time()
+    ref = [float(model['lon']), float(model['lat'])]
+    nstations = 0
+    nchunks = 0
+    with open(stationfile, "r") as f, open(outputfile, "w") as out:
+        for sites, lon, lat in readstations(f, chunksize):
+            x, y = lonlat2xy(lon, lat, ref)
+            result = evaluator(model, x.astype(np.float32), y.astype(np.float32), products="displacement")
+            sigma = np.full(len(sites), SIGMA)
+            rows = zip(sites, lon, lat, result['ux'], result['uy'], result['uz'], sigma, sigma, sigma)
+            out.writelines(LINEFORMAT % row for row in rows)
+            nstations += len(sites)
+            nchunks += 1
+
+    seconds = time.time() - starttime
+    npatches = len(model['faults'])
+    stats = {"split": "stations", "processes": 1, "patches": npatches, "points": nstations,
+             "chunks": nchunks, "seconds": seconds,
+             "throughput": npatches*nstations/seconds if seconds > 0 else 0.0}
+
+    return stats
+
+
+def main():
+
+    # test case: stations on a lon/lat lattice around the 4fault origin
+    with open("test/4fault.txt") as f:
+        model = dislocengine.readinput(f.read())
+    lon, lat = np.meshgrid(np.linspace(-117.0, -114.8, 50), np.linspace(32.6, 33.5, 20))
+    with open("test/4fault.stations.txt", "w") as f:
+        for k, (a, b) in enumerate(zip(lon.ravel(), lat.ravel())):
+            f.write("%f %f S%04d\n" % (a, b, k))
+    print(predict(model, "test/4fault.stations.txt", "test/4fault.stations.output.txt", chunksize=300))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+    dislocstream.py
+        -- bounded-memory interferograms of large disloc outputs
+        -- pass 1 reads the table in blocks of grid rows and finds the
+           extent and the range of the fringe values; pass 2 reads the
+           blocks again from the last grid row (the top of the image),
+           colors them and hands the rows to the PNG writer while it
+           compresses, so memory is set by BLOCKROWS, not by the grid
+        -- .npy blocks are read at their offsets, text tables through the
+           byte offsets of the blocks recorded in pass 1
+
+    same images as SARImage.lineofsight() with the bilinear or nearest
+    renderer; the PNG goes to disk and the KMZ copies it from there
+
+    usage:
+        extent = lineofsight(60, -5, 23.8, "output.npy", "")
+"""
+
+import os
+import tempfile
+import itertools
+
+import numpy as np
+
+import dislocengine
+import dislocpalette
+import dislocpng
+import dislocmetrics
+from SARImage import dxy2lonlat, generateKML
+
+# grid rows per block
+BLOCKROWS = 64
+
+# tables with more points are streamed by the workflow
+STREAMPOINTS = 2**22
+
+# bytes per point of a text table, to estimate its points from its size
+TEXTPOINTBYTES = 80
+
+
+class BinaryTable(object):
+    """ .npy disloc table read in blocks of grid rows """
+
+    def __init__(self, disO, blockrows=BLOCKROWS):
+        header, table = dislocengine.readbinary(disO)
+        self.gridsize = [int(header['nx']), int(header['ny'])]
+        self.reflonlat = [header['lon'], header['lat']]
+        self.names = header['columns']
+        self.blockrows = blockrows
+        self.nblocks = -(-self.gridsize[1]//blockrows)
+        # rows are read with plain file reads, pages of a memory map
+        # would stay in the resident set until the map is closed
+        self.path = disO
+        self.dtype = table.dtype
+        with open(disO, "rb") as f:
+            if np.lib.format.read_magic(f) == (1, 0):
+                np.lib.format.read_array_header_1_0(f)
+            else:
+                np.lib.format.read_array_header_2_0(f)
+            self.offset = f.tell() + dislocengine.headerrows(len(self.names))*len(self.names)*self.dtype.itemsize
+        del table
+
+    def block(self, k):
+        """ columns of grid rows k*blockrows ... as float64 arrays """
+
+        nx, ny = self.gridsize
+        start = k*self.blockrows*nx
+        count = (min((k + 1)*self.blockrows, ny)*nx - start)*len(self.names)
+        with open(self.path, "rb") as f:
+            f.seek(self.offset + start*len(self.names)*self.dtype.itemsize)
+            values = np.fromfile(f, dtype=self.dtype, count=count).reshape(-1, len(self.names))
+        return dict((name, values[:, i].astype(np.float64)) for i, name in enumerate(self.names))
+
+    def blocks(self):
+        """ all blocks in order """
+
+        for k in range(self.nblocks):
+            yield self.block(k)
+
+
+class TextTable(object):
+    """ disloc text table read in blocks of grid rows
+
+        the first sequential pass (blocks()) records where each block
+        starts, block(k) seeks there afterwards
+    """
+
+    def __init__(self, disO, blockrows=BLOCKROWS):
+        self.path = disO
+        self.blockrows = blockrows
+        with open(disO, "rb") as f:
+            # line 1: nx ny lat lon
+            first = f.readline().split()
+            self.gridsize = [int(float(first[0])), int(float(first[1]))]
+            self.reflonlat = [float(first[3]), float(first[2])]
+            # fault lines up to the x y ... column header
+            while True:
+                line = f.readline()
+                if not line:
+                    raise ValueError("no column header in %s" % disO)
+                if b"x" in line.split():
+                    self.names = line.decode().split()
+                    break
+            self.offsets = [f.tell()]
+        self.nblocks = -(-self.gridsize[1]//blockrows)
+
+    def read(self, f, k):
+        """ parse block k at the position of f """
+
+        nx, ny = self.gridsize
+        count = (min((k + 1)*self.blockrows, ny) - k*self.blockrows)*nx
+        text = b"".join(itertools.islice(f, count)).decode()
+        values = np.fromstring(text, dtype=np.float64, sep=' ').reshape(-1, len(self.names))
+        if len(values) != count:
+            raise ValueError("%s: %d points in block %d, expected %d" % (self.path, len(values), k, count))
+        return dict((name, values[:, i]) for i, name in enumerate(self.names))
+
+    def block(self, k):
+        """ columns of grid rows k*blockrows ... , after blocks() """
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[k])
+            return self.read(f, k)
+
+    def blocks(self):
+        """ all blocks in order, records their offsets """
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[0])
+            for k in range(self.nblocks):
+                if k == len(self.offsets):
+                    self.offsets.append(f.tell())
+                yield self.read(f, k)
+
+
+def opentable(disO, blockrows=BLOCKROWS):
+    """ BinaryTable or TextTable by the file name """
+
+    if disO.endswith(".npy"):
+        return BinaryTable(disO, blockrows)
+    return TextTable(disO, blockrows)
+
+
+def islarge(disO, dislocresult=None):
+    """ true if the table is large enough to be streamed """
+
+    if dislocresult is not None:
+        npts = len(dislocresult['x'])
+    elif disO.endswith(".npy"):
+        header, table = dislocengine.readbinary(disO)
+        npts = len(table)
+    else:
+        npts = os.path.getsize(disO)//TEXTPOINTBYTES
+    return npts > STREAMPOINTS
+
+
+def fringes(columns, g, radarWL):
+    """ negated wrapped fringe of a block, as drawn by SARImage.drawimage """
+
+    if 'los' in columns:
+        losd = columns['los']/5.0
+    elif 'ux' in columns:
+        losd = (g[0]*columns['ux'] + g[1]*columns['uy'] + g[2]*columns['uz'])/5.0
+    else:
+        raise ValueError("no displacements in the table")
+    fringe = 2*losd / radarWL - np.floor(2*losd / radarWL)
+    return -1*fringe
+
+
+def scan(table, g, radarWL):
+    """ pass 1: fringe range and [west, east, south, north] extent """
+
+    minz, maxz = np.inf, -np.inf
+    minx, maxx, miny, maxy = np.inf, -np.inf, np.inf, -np.inf
+    for columns in table.blocks():
+        with dislocmetrics.stage("los"):
+            z = fringes(columns, g, radarWL)
+        if not np.isnan(z).all():
+            minz, maxz = min(minz, np.nanmin(z)), max(maxz, np.nanmax(z))
+        minx, maxx = min(minx, np.min(columns['x'])), max(maxx, np.max(columns['x']))
+        miny, maxy = min(miny, np.min(columns['y'])), max(maxy, np.max(columns['y']))
+    lon, lat = dxy2lonlat([np.array([minx, maxx]), np.array([miny, maxy])], table.reflonlat)
+
+    return (minz, maxz), [float(lon[0]), float(lon[1]), float(lat[0]), float(lat[1])]
+
+
+class FringeRows(object):
+    """ pass 2: colored image rows, a row source for dislocpng """
+
+    def __init__(self, table, g, radarWL, palette, bounds):
+        self.table = table
+        self.g = g
+        self.radarWL = radarWL
+        self.palette = palette
+        self.bounds = bounds
+        nx, ny = table.gridsize
+        self.shape = (ny, nx, 3)
+        self.colors = {}
+
+    def colored(self, k):
+        """ colors of block k, the last two blocks are kept """
+
+        if k not in self.colors:
+            if len(self.colors) > 1:
+                self.colors.pop(max(self.colors, key=lambda b: abs(b - k)))
+            with dislocmetrics.stage("parse"):
+                columns = self.table.block(k)
+            with dislocmetrics.stage("los"):
+                z = fringes(columns, self.g, self.radarWL)
+            with dislocmetrics.stage("colorize"):
+                rgb = dislocpalette.colorize(z, self.palette, self.bounds)
+            self.colors[k] = rgb.reshape(-1, self.shape[1], 3)
+        return self.colors[k]
+
+    def rows(self, index):
+        """ rows at top-first indices, the top row is the last grid row """
+
+        j = self.shape[0] - 1 - np.asarray(index)
+        out = np.empty((len(j), self.shape[1], 3))
+        blockrows = self.table.blockrows
+        for k in np.unique(j//blockrows):
+            mask = j//blockrows == k
+            out[mask] = self.colored(k)[j[mask] - k*blockrows]
+        return out
+
+
+def lineofsight(ele, azi, radarWL, disO, url, palette=None, renderer="bilinear", scale=dislocpng.SCALE,
+                name="", artifacts=None, store=None, blockrows=BLOCKROWS):
+    """ SARImage.lineofsight() of a table on disk in two bounded passes
+
+        renderer: bilinear or nearest; other arguments as lineofsight()
+        returns the [west, east, south, north] extent
+    """
+
+    if renderer not in ["bilinear", "nearest"]:
+        raise ValueError("streamed images need the bilinear or nearest renderer")
+    if palette is None:
+        palette = "uavsar"
+
+    params = [disO, ele, azi, radarWL]
+    g = dislocengine.lookvector(ele, azi)
+    table = opentable(disO, blockrows)
+    with dislocmetrics.stage("parse"):
+        bounds, extent = scan(table, g, radarWL)
+
+    outputname = os.path.abspath(disO) + ".insar" + name
+    source = FringeRows(table, g, radarWL, palette, bounds)
+    pngfile = outputname + ".png"
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(pngfile), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, dislocmetrics.stage("png"):
+            for data in dislocpng.pngchunks(source, scale=scale, resample=renderer):
+                f.write(data)
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, pngfile)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+    with dislocmetrics.stage("kml"):
+        generateKML(extent, outputname, url, params, None, artifacts, store)
+
+    return extent
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+"""
+    dislocsweep.py
+        -- parameter sweep of one disloc input: the Cartesian product of
+           ranges of fault slip (scale factor), dip and depth (offsets
+           added to every fault) and of the look geometry (elevation,
+           azimuth, radarfrequency)
+        -- work is shared where the geometry does not change:
+           -- one disloc run per fault variant images all the looks, see
+              the looks argument of dislocworkflow()
+           -- fault variants that differ only in slip are weighted sums of
+              the same unit-slip responses (dislocgreens.py): the first
+              variant of each dip and depth runs before the others
+        -- the runs go through dislocbatch.py, in parallel; a failed run
+           fails its variants only
+        -- the result is a flat folder: index.json, and [id].kmz and a
+           thumbnail [id].png for every variant, no job folder per variant
+
+    ranges: "start:stop:step" (stop included), "a,b,c" or a single value
+        slip=0.5:1.5:0.25 dip=-5:5:5 azimuth=-15:15:5
+
+    usage:
+        python dislocsweep.py -i test/4fault.txt -wd sweep1 -s slip=0.5:1.5:0.5 -s azimuth=-15:15:15
+        /dislocservice/sweep?input=...&slip=0.5:1.5:0.5&azimuth=-15:15:15
+"""
+
+import os
+import json
+import math
+import time
+import shutil
+import argparse
+import itertools
+
+import numpy as np
+
+import dislocengine
+import dislocpalette
+import dislocpng
+import dislocbatch
+from SARImage import readdisplacement
+
+# fields of the fault records: slip scales u1, u2, u3, dip and depth are
+# added to the values of every fault
+FAULTFIELDS = ["slip", "dip", "depth"]
+LOOKFIELDS = ["elevation", "azimuth", "radarfrequency"]
+FIELDS = FAULTFIELDS + LOOKFIELDS
+
+# values of a field without a range
+DEFAULTS = {"slip": 1.0, "dip": 0.0, "depth": 0.0, "elevation": 60.0, "azimuth": 0.0, "radarfrequency": 1.26}
+
+# variants of one sweep
+MAXVARIANTS = 1000
+
+# longest side of a thumbnail in pixels
+THUMBSIZE = 128
+
+
+def parserange(text):
+    """ values of "start:stop:step", "a,b,c" or "a" """
+
+    text = str(text).strip()
+    if ":" in text:
+        start, stop, step = [float(x) for x in text.split(":")]
+        if step <= 0 or stop < start:
+            raise ValueError("bad range: " + text)
+        count = int(math.floor((stop - start)/step + 1e-9)) + 1
+        if count > MAXVARIANTS:
+            raise ValueError("range too long: " + text)
+        return [round(start + k*step, 10) for k in range(count)]
+    return [float(x) for x in text.split(",") if x.strip()]
+
+
+def ranges(args):
+    """ values of every field, DEFAULTS (or the look of args) for the
+        fields without a range
+    """
+
+    fields = {}
+    for field in FIELDS:
+        if field in args:
+            fields[field] = parserange(args[field])
+            if not fields[field]:
+                raise ValueError("empty range: " + field)
+        else:
+            fields[field] = [DEFAULTS[field]]
+    return fields
+
+
+def variantinput(text, slip=1.0, dip=0.0, depth=0.0):
+    """ disloc input with the slip of every fault scaled by slip and dip
+        and depth added; fields that do not change keep their text
+    """
+
+    model = dislocengine.readinput(text)
+    tokens = text.split()
+    nfaults = len(model['faults'])
+    pos = len(tokens) - 13*nfaults
+    lines = [" ".join(tokens[:3]), " ".join(tokens[3:pos])]
+    for k in range(nfaults):
+        record = tokens[pos + 13*k:pos + 13*(k + 1)]
+        if depth != 0:
+            record[4] = repr(float(record[4]) + depth)
+        if dip != 0:
+            record[5] = repr(float(record[5]) + dip)
+        if slip != 1:
+            for i in [8, 9, 10]:
+                record[i] = repr(float(record[i])*slip)
+        lines.append(" ".join(record))
+    return "\n".join(lines) + "\n"
+
+
+def thumbnail(outputfile, geometry, thumbfile, palette="uavsar", size=THUMBSIZE):
+    """ small interferogram of a disloc output table: every k-th grid
+        point, one pixel per point
+    """
+
+    displacement = readdisplacement(outputfile)
+    nx, ny = displacement['gridsize']
+    step = max(1, int(math.ceil(max(nx, ny)/float(size))))
+
+    azimuth, elevation = math.radians(geometry['azimuth']), math.radians(geometry['elevation'])
+    g = [math.sin(azimuth)*math.cos(elevation), math.cos(azimuth)*math.cos(elevation), math.sin(elevation)]
+    if 'los' in displacement:
+        losd = displacement['los']/5.0
+    else:
+        losd = (g[0]*displacement['ux'] + g[1]*displacement['uy'] + g[2]*displacement['uz'])/5.0
+    wavelength = 299792458.0/(geometry['radarfrequency']*10**9)*100.0
+    losd = np.asarray(losd).reshape(ny, nx)[::step, ::step]
+    z = -(2*losd/wavelength - np.floor(2*losd/wavelength))
+    rgb = dislocpalette.colorize(z.ravel(), palette).reshape(z.shape + (3,))
+    dislocpng.writepng(thumbfile, rgb, scale=1, resample="nearest")
+
+
+def sweep(inputtext, args, outputdir, processes=dislocbatch.PROCESSES, timeout=dislocbatch.ITEMTIMEOUT,
+          progress=None, urls=False):
+    """ run a sweep and write outputdir/index.json
+
+        args: the ranges (see ranges()) and the workflow parameters of
+              every run; engine defaults to numpy, whose unit-slip
+              responses are reused between slip variants
+        returns the index: status, the values of the fields, every
+        variant with its values, status, latlonbox, kmz and thumbnail,
+        and the totals
+    """
+
+    if progress is None:
+        progress = lambda stage, fraction: None
+    fields = ranges(args)
+    models = list(itertools.product(*[fields[k] for k in FAULTFIELDS]))
+    looks = list(itertools.product(*[fields[k] for k in LOOKFIELDS]))
+    if len(models)*len(looks) > MAXVARIANTS:
+        raise ValueError("%d variants, at most %d" % (len(models)*len(looks), MAXVARIANTS))
+    dislocengine.readinput(inputtext)
+
+    common = {k: v for k, v in args.items() if k not in FIELDS + ['looks', 'input', 'inputfile', 'workdir', 'api']}
+    common.setdefault('engine', 'numpy')
+    if common['engine'] in ['numpy', 'library']:
+        common['greens'] = 'true'
+    common['artifacts'] = 'kmz'
+    palette = common.get('palette', 'uavsar')
+
+    outputdir = os.path.abspath(outputdir)
+    rundir = outputdir + os.path.sep + "runs"
+    os.makedirs(rundir, exist_ok=True)
+    start = time.time()
+
+    # one run per fault variant, all looks at once; the first variant of
+    # each dip and depth fills the unit-slip responses of the others
+    items = []
+    for m, (slip, dip, depth) in enumerate(models):
+        items.append({"name": "m%04d" % m, "input": variantinput(inputtext, slip, dip, depth),
+                      "looks": ";".join("%r,%r,%r" % look for look in looks)})
+    first = {}
+    for m, model in enumerate(models):
+        first.setdefault(model[1:], m)
+    waves = [[items[m] for m in sorted(first.values())],
+             [item for m, item in enumerate(items) if m not in first.values()]]
+
+    runs = {}
+    for w, wave in enumerate(waves):
+        if not wave:
+            continue
+        report = lambda stage, fraction, w=w: progress("runs", (w + fraction)/len(waves))
+        summary = dislocbatch.batch(wave, rundir, common, processes, timeout, report)
+        for item in summary['items']:
+            runs[item['name']] = item
+
+    # index: kmz and thumbnail of every variant, then the runs are removed
+    progress("index", 0.95)
+    variants = []
+    number = 0
+    for m, model in enumerate(models):
+        run = runs["m%04d" % m]
+        runfolder = rundir + os.path.sep + "m%04d" % m
+        try:
+            with open(runfolder + os.path.sep + "summary.json") as f:
+                runsummary = json.load(f)
+        except (OSError, ValueError):
+            runsummary = {}
+        outputfile = [x for x in os.listdir(runfolder) if x.startswith("output.")] if os.path.isdir(runfolder) else []
+        table = [x for x in outputfile if x.endswith(".npy") or x.endswith(".csv")]
+        for k, look in enumerate(looks):
+            number += 1
+            variant = {"id": "v%04d" % number}
+            variant.update(zip(FAULTFIELDS, model))
+            variant.update(zip(LOOKFIELDS, look))
+            variant.update(status=run['status'], error=run['error'])
+            if run['status'] == 'success':
+                name = "" if len(looks) == 1 else ".look%d" % (k + 1)
+                lookstatus = runsummary['looks'][k] if 'looks' in runsummary else runsummary
+                variant['latlonbox'] = lookstatus.get('latlonbox')
+                try:
+                    kmz = [x for x in outputfile if x.endswith(".insar" + name + ".kmz")][0]
+                    os.replace(runfolder + os.path.sep + kmz, outputdir + os.path.sep + variant['id'] + ".kmz")
+                    thumbnail(runfolder + os.path.sep + table[0], dict(zip(LOOKFIELDS, look)),
+                              outputdir + os.path.sep + variant['id'] + ".png", palette)
+                except (IndexError, OSError, ValueError) as e:
+                    variant.update(status="failed", error="no image: " + str(e))
+                else:
+                    variant['kmz'] = variant['id'] + ".kmz"
+                    variant['thumbnail'] = variant['id'] + ".png"
+                    if urls:
+                        variant['kmz'], variant['thumbnail'] = dislocbatch.outputurls([variant['kmz'], variant['thumbnail']], outputdir)
+            variants.append(variant)
+    shutil.rmtree(rundir, ignore_errors=True)
+
+    succeeded = len([x for x in variants if x['status'] == 'success'])
+    if succeeded == len(variants):
+        status = "success"
+    elif succeeded:
+        status = "partial"
+    else:
+        status = "failed"
+    index = {"status": status,
+             "error": "" if status == "success" else "%d of %d variants failed" % (len(variants) - succeeded, len(variants)),
+             "fields": fields,
+             "variants": variants,
+             "stats": {"variants": len(variants), "runs": len(models), "succeeded": succeeded,
+                       "failed": len(variants) - succeeded, "processes": processes, "seconds": time.time() - start}}
+    with open(outputdir + os.path.sep + "index.json", "w") as f:
+        f.write(json.dumps(index, indent=4))
+
+    return index
+
+
+def sweepworkflow(args, progress=None, timeout=dislocbatch.ITEMTIMEOUT):
+    """ a sweep queued by the service: args of dislocjobs.py with the
+        input, the ranges and the number of processes in workers (at most
+        dislocbatch.MAXPROCESSES), outputs in a new static/ folder as urls
+    """
+
+    from disloc_exec import setoutputlocation
+
+    args = dict(args)
+    args.pop('sweep')
+    processes = dislocbatch.workers(args.pop('workers', dislocbatch.PROCESSES))
+    try:
+        return sweep(args.pop('input'), args, setoutputlocation(), processes, timeout, progress, urls=True)
+    except ValueError as e:
+        return {"status": "failed", "error": str(e)}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Run a parameter sweep of a disloc input.")
+    parser.add_argument('-i','--input', action='store',dest='inputfile',required=True,help='disloc input file')
+    parser.add_argument('-wd','--workdir', action='store',dest='workdir',required=True,help='sweep folder: index.json, kmz and thumbnail of every variant')
+    parser.add_argument('-s','--set', action='append',dest='ranges',default=[],help='field=range, field: %s, range: start:stop:step, a,b,c or a value; repeat for more' % ", ".join(FIELDS))
+    parser.add_argument('-p','--param', action='append',dest='params',default=[],help='key=value workflow parameter of every run, e.g. renderer=nearest; repeat for more')
+    parser.add_argument('-n','--processes', action='store',dest='processes',type=int,default=dislocbatch.PROCESSES,help='runs at the same time, default: %d' % dislocbatch.PROCESSES)
+    parser.add_argument('-t','--timeout', action='store',dest='timeout',type=float,default=dislocbatch.ITEMTIMEOUT,help='seconds a run may take, default: %d' % dislocbatch.ITEMTIMEOUT)
+    args = parser.parse_args()
+
+    params = {}
+    for item in args.ranges + args.params:
+        key, sep, value = item.partition("=")
+        if not sep:
+            parser.error("%s is not key=value" % item)
+        params[key] = value
+    for key in [x.partition("=")[0] for x in args.ranges]:
+        if key not in FIELDS:
+            parser.error("unknown field %s, one of %s" % (key, ", ".join(FIELDS)))
+
+    with open(args.inputfile) as f:
+        inputtext = f.read()
+    try:
+        index = sweep(inputtext, params, args.workdir, args.processes, args.timeout)
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(index['stats']))
+
+
+if __name__ == "__main__":
+    main()
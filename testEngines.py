@@ -0,0 +1,206 @@
+"""
+    testEngines.py
+        -- regression checks of the engines and the outputs: the numpy and
+           library engines give the table of the binary for every input
+           of test/, row and fault splits give the serial table, the .npy
+           header and products, streamed images, the result cache and the
+           admission of the service
+
+    needs the disloc binary and libdisloc.so, built as in README.md
+
+    usage:
+        python testEngines.py
+        python -m pytest testEngines.py
+"""
+
+import os
+import sys
+import glob
+import shutil
+import tempfile
+
+import numpy as np
+
+from disloc_exec import exec_disloc, exec_dislocengine, prepareinput, runworkflow, dislocworkflow
+import dislocengine
+import disloccache
+import disloccost
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+INPUTS = sorted(glob.glob(HERE + "/test/*.input")) + [HERE + "/test/4fault.txt"]
+
+# engines and the binary differ in the rounding of the sums only
+RTOL = 1e-7
+ATOL = 1e-9
+
+
+def runengine(inputfile, workdir, engine, **options):
+    """ output.npy table of one engine run, header row included """
+
+    outputfile = workdir + os.path.sep + engine + str(len(os.listdir(workdir))) + ".npy"
+    if engine == 'binary':
+        status = exec_disloc(inputfile, outputfile, workdir=workdir)
+    else:
+        status, result = exec_dislocengine(inputfile, outputfile, workdir=workdir, engine=engine, **options)
+    assert status['status'] == 'success', "%s %s: %s" % (engine, os.path.basename(inputfile), status['error'])
+    return np.load(outputfile)
+
+
+def test_parity(inputs=INPUTS):
+    """ numpy and library engines give the table of the binary """
+
+    basedir = tempfile.mkdtemp(prefix="disloc_engines")
+    try:
+        for inputfile in inputs:
+            reference = runengine(inputfile, basedir, 'binary')
+            for engine in ['numpy', 'library']:
+                table = runengine(inputfile, basedir, engine)
+                assert table.shape == reference.shape, "%s %s: shape %s" % (engine, inputfile, table.shape)
+                assert np.allclose(table, reference, rtol=RTOL, atol=ATOL, equal_nan=True), \
+                    "%s %s: differs from the binary by %g" % (engine, inputfile, np.nanmax(np.abs(table - reference)))
+    finally:
+        shutil.rmtree(basedir)
+
+
+def test_split(inputs=INPUTS):
+    """ row tiles give the serial table exactly, fault chunks up to the
+        order of the sums
+    """
+
+    basedir = tempfile.mkdtemp(prefix="disloc_engines")
+    try:
+        for inputfile in inputs:
+            serial = runengine(inputfile, basedir, 'numpy')
+            rows = runengine(inputfile, basedir, 'numpy', processes=2, split='rows')
+            faults = runengine(inputfile, basedir, 'numpy', processes=2, split='faults')
+            assert np.array_equal(rows, serial, equal_nan=True), "rows %s: differs from the serial run" % inputfile
+            assert np.allclose(faults, serial, rtol=RTOL, atol=ATOL, equal_nan=True), \
+                "faults %s: differs from the serial run" % inputfile
+    finally:
+        shutil.rmtree(basedir)
+
+
+def test_npy(inputfile=HERE + "/test/4fault.txt", elevation=60.0, azimuth=-5.0):
+    """ header of the .npy table and the columns of every product """
+
+    with open(inputfile) as f:
+        model = dislocengine.readinput(f.read())
+    grid = model['grid']
+    basedir = tempfile.mkdtemp(prefix="disloc_engines")
+    try:
+        table = runengine(inputfile, basedir, 'numpy')
+        header = dict(zip(dislocengine.HEADERFIELDS, table[0]))
+        assert (header['nx'], header['ny']) == (grid[2], grid[5]), "grid size %s" % header
+        assert np.allclose([header['lat'], header['lon'], header['x0'], header['dx'], header['y0'], header['dy']],
+                           [model['lat'], model['lon'], grid[0], grid[1], grid[3], grid[4]]), "header %s" % header
+        assert len(table) == grid[2]*grid[5] + 1, "%d rows" % len(table)
+        full = dict(zip(dislocengine.columns(), table[1:].T))
+
+        g = dislocengine.lookvector(elevation, azimuth)
+        full['los'] = g[0]*full['ux'] + g[1]*full['uy'] + g[2]*full['uz']
+        for products in ['displacement', 'strain', 'los']:
+            outputfile = basedir + os.path.sep + products + ".npy"
+            status, result = exec_dislocengine(inputfile, outputfile, workdir=basedir, products=products,
+                                               look=(elevation, azimuth, 23.8))
+            assert status['status'] == 'success', "%s: %s" % (products, status['error'])
+            header, rows = dislocengine.readbinary(outputfile)
+            assert header['products'] == products and header['columns'] == dislocengine.columns(products), \
+                "%s: header %s" % (products, header)
+            for k, name in enumerate(header['columns']):
+                assert np.allclose(rows[:, k], full[name], rtol=RTOL, atol=ATOL), "%s: column %s" % (products, name)
+    finally:
+        shutil.rmtree(basedir)
+
+
+def test_stream(inputfile=HERE + "/test/4fault.txt"):
+    """ images streamed from the table are those made in memory """
+
+    with open(inputfile) as f:
+        data = f.read()
+    basedir = tempfile.mkdtemp(prefix="disloc_engines")
+    try:
+        images = []
+        for stream in ['false', 'true']:
+            workdir = basedir + os.path.sep + "stream" + stream
+            os.makedirs(workdir)
+            status = dislocworkflow({'input': data, 'engine': 'numpy', 'stream': stream, 'artifacts': 'png',
+                                     'api': True, 'workdir': workdir})
+            assert status['status'] == 'success', "stream=%s: %s" % (stream, status['error'])
+            assert status.get('stream', False) == (stream == 'true'), "stream=%s not used" % stream
+            with open(workdir + os.path.sep + "output.npy.insar.png", 'rb') as f:
+                images.append(f.read())
+        assert images[0] == images[1], "streamed png differs"
+    finally:
+        shutil.rmtree(basedir)
+
+
+def test_cache(inputfile=HERE + "/test/4fault.txt"):
+    """ the second identical job is a hit with the files of the first,
+        spacing and number formats of the input do not matter
+    """
+
+    with open(inputfile) as f:
+        data = f.read()
+    basedir = tempfile.mkdtemp(prefix="disloc_engines")
+    cachedir = basedir + os.path.sep + "results"
+    try:
+        statuses = []
+        for text in [data, data.replace(" ", "  ").replace("-115.911333", "-115.9113330")]:
+            workdir = basedir + os.path.sep + "job%d" % len(statuses)
+            args = {'input': text, 'engine': 'numpy', 'artifacts': 'png', 'api': True, 'workdir': workdir}
+            os.makedirs(workdir)
+            outputdir, jobinput = prepareinput(args)
+            statuses.append(disloccache.run(text, args, workdir, lambda: runworkflow(args, workdir, jobinput),
+                                            cachedir=cachedir))
+        first, second = statuses
+        assert first['status'] == 'success' and first['cache']['hit'] is False, "first job: %s" % first['cache']
+        assert second['status'] == 'success' and second['cache']['hit'] is True, "second job: %s" % second['cache']
+        assert second['cache']['key'] == first['cache']['key']
+        for name in ['output.npy', 'output.npy.insar.png']:
+            with open(basedir + "/job0/" + name, 'rb') as f, open(basedir + "/job1/" + name, 'rb') as g:
+                assert f.read() == g.read(), "%s of the hit differs" % name
+    finally:
+        shutil.rmtree(basedir)
+
+
+def test_admission(inputfile=HERE + "/test/4fault.txt"):
+    """ too large: 413, request lane full: 429, unknown engine: 400 """
+
+    import disloc_service_API
+
+    with open(inputfile) as f:
+        data = f.read()
+    client = disloc_service_API.app.test_client()
+    huge = data.replace("-100 1 201 -10 1 101", "-100 0.01 40001 -100 0.01 40001", 1)
+    response = client.get('/dislocservice/disloc', query_string={'input': huge, 'cache': 'false'})
+    assert response.status_code == 413, "huge job: %d" % response.status_code
+    response = client.get('/dislocservice/disloc', query_string={'input': data, 'engine': 'numpi'})
+    assert response.status_code == 400, "unknown engine: %d" % response.status_code
+
+    taken = 0
+    try:
+        while disloccost.acquire():
+            taken += 1
+        response = client.get('/dislocservice/disloc', query_string={'input': data, 'cache': 'false'})
+        assert response.status_code == 429, "full lane: %d" % response.status_code
+    finally:
+        for i in range(taken):
+            disloccost.release()
+
+
+def main():
+    tests = [test_parity, test_split, test_npy, test_stream, test_cache, test_admission]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(test.__name__, "ok")
+        except AssertionError as e:
+            failed += 1
+            print(test.__name__, "FAILED:", e)
+    print("%d of %d tests failed" % (failed, len(tests)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
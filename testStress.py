@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+
+from disloc_exec import dislocworkflow
+
+
+def run_job(workdir, inputdata, azimuth, engine, renderer):
+    """one workflow job in its own working dir"""
+
+    os.makedirs(workdir)
+    args = {'input':inputdata, 'azimuth':azimuth, 'engine':engine, 'renderer':renderer,
+            'api':True, 'workdir':workdir}
+    return dislocworkflow(args)
+
+def read_outputs(workdir):
+    """bytes of the images and the parameters of a finished job"""
+
+    with open(workdir + os.path.sep + "summary.json") as f:
+        summary = json.load(f)
+    images = {}
+    for name in sorted(os.listdir(workdir)):
+        if name.endswith(".png") or name.endswith(".kml"):
+            with open(workdir + os.path.sep + name, 'rb') as f:
+                images[name] = f.read()
+    return summary, images
+
+def test_concurrent(inputfile, njobs=16):
+    """jobs in threads of one process give the files of the same jobs run one by one"""
+
+    with open(inputfile,'r') as f:
+        data = f.read()
+
+    jobs = []
+    for i in range(njobs):
+        azimuth = str(-15 + 30.0*i/(njobs - 1))
+        engine = ['binary', 'numpy'][i % 2]
+        renderer = ['bilinear', 'matplotlib'][(i//2) % 2]
+        jobs.append((azimuth, engine, renderer))
+
+    basedir = tempfile.mkdtemp(prefix="disloc_stress")
+    cwd = os.getcwd()
+    try:
+        # reference: one job at a time
+        for i, job in enumerate(jobs):
+            run_job(basedir + os.path.sep + "serial%d" % i, data, *job)
+
+        # all jobs at once
+        threads = [threading.Thread(target=run_job, args=(basedir + os.path.sep + "thread%d" % i, data) + job)
+                   for i, job in enumerate(jobs)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        failed = 0
+        for i, job in enumerate(jobs):
+            serial, serialimages = read_outputs(basedir + os.path.sep + "serial%d" % i)
+            try:
+                summary, images = read_outputs(basedir + os.path.sep + "thread%d" % i)
+            except (OSError, ValueError):
+                summary, images = {'status':'missing'}, {}
+            good = (summary['status'] == 'success'
+                    and summary['parameters']['azimuth'] == float(job[0])
+                    and summary['output'] == serial['output']
+                    and images == serialimages)
+            if not good:
+                failed += 1
+            print(i, job, "ok" if good else "MISMATCH")
+
+        print("current dir unchanged:", os.getcwd() == cwd)
+        print("%d of %d jobs differ" % (failed, len(jobs)))
+        return failed == 0 and os.getcwd() == cwd
+    finally:
+        shutil.rmtree(basedir)
+
+
+def main():
+    # concurrent jobs: outputs never cross between jobs
+    disloc_input = "test/4fault.txt"
+    njobs = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    ok = test_concurrent(disloc_input, njobs)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()